@@ -0,0 +1,146 @@
+"""
+Benchmarks for modules/footage-processing on a generated video: decoding, frame preprocessing,
+frame sampling and detection (sequential per-frame loop, sampled, pipelined).
+
+By default a stub detector stands in for YOLO: it letterboxes every frame like the real model
+and returns fixed boxes, so the numbers measure the pipeline around inference
+(--real-models loads YOLO_MODEL_PATH through ultralytics).
+"""
+import tempfile
+import time
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+from common import emit, measure, parse_args, use_module
+
+use_module("footage-processing")
+
+from functions import object_detection  # noqa: E402
+from functions.frame_sampling import iter_sampled_frames  # noqa: E402
+
+SCENE_COLORS = [(200, 60, 40), (40, 160, 60), (50, 50, 200), (180, 180, 180), (30, 30, 30)]
+
+
+def make_video(path: Path, n_frames: int, size=(640, 360), fps: int = 25, scene_length: int = 100) -> Path:
+    """Write an mp4 with a new background colour every `scene_length` frames and a moving box."""
+    width, height = size
+    writer = cv2.VideoWriter(str(path), cv2.VideoWriter_fourcc(*"mp4v"), fps, size)
+    for i in range(n_frames):
+        frame = np.full((height, width, 3), SCENE_COLORS[(i // scene_length) % len(SCENE_COLORS)], np.uint8)
+        x = (7 * i) % (width - 80)
+        cv2.rectangle(frame, (x, height // 3), (x + 80, height // 3 + 120), (255, 255, 255), -1)
+        writer.write(frame)
+    writer.release()
+    return path
+
+
+# --- Stub detector ---
+class _Array:
+    def __init__(self, values):
+        self.values = np.asarray(values)
+
+    def cpu(self):
+        return self
+
+    def numpy(self):
+        return self.values
+
+
+class _StubBoxes:
+    def __init__(self, n: int):
+        self.xyxy = _Array(np.tile([10.0, 20.0, 90.0, 140.0], (n, 1)))
+        self.conf = _Array(np.full(n, 0.9))
+        self.cls = _Array(np.arange(n) % 2)
+
+    def __len__(self):
+        return len(self.xyxy.values)
+
+
+class _StubResult:
+    names = {0: "person", 1: "dog"}
+
+    def __init__(self, frame):
+        self.frame = frame
+        self.boxes = _StubBoxes(2)
+
+    def plot(self):
+        annotated = self.frame.copy()
+        for x1, y1, x2, y2 in self.boxes.xyxy.values.astype(int):
+            cv2.rectangle(annotated, (x1, y1), (x2, y2), (0, 255, 0), 2)
+        return annotated
+
+
+class StubYOLO:
+    """Callable like an ultralytics model: letterboxes each frame, returns two fixed boxes."""
+
+    def __call__(self, frames, device=None, verbose=False):
+        if not isinstance(frames, list):
+            frames = [frames]
+        for frame in frames:
+            object_detection.preprocess_frame(frame)
+        return [_StubResult(frame) for frame in frames]
+
+
+def sequential_detect(video_path, model, device):
+    """The per-frame loop of detect_video without the GUI window: read -> infer -> plot."""
+    cap = cv2.VideoCapture(str(video_path))
+    while True:
+        ret, frame = cap.read()
+        if not ret:
+            break
+        model(frame, device=device, verbose=False)[0].plot()
+    cap.release()
+
+
+def main(argv=None):
+    args = parse_args(__doc__, argv)
+    n_frames = 200 if args.quick else 1500
+    if args.real_models:
+        model, device = object_detection.get_model()
+    else:
+        object_detection.model, object_detection.device = StubYOLO(), "cpu"
+        model, device = object_detection.model, "cpu"
+
+    results = {"config": {"frames": n_frames, "real_models": args.real_models}}
+    with tempfile.TemporaryDirectory() as tmp:
+        video = make_video(Path(tmp) / "bench.mp4", n_frames)
+
+        def decode():
+            cap = cv2.VideoCapture(str(video))
+            while cap.read()[0]:
+                pass
+            cap.release()
+
+        results["decode"] = measure(decode, repeat=3, items=n_frames)
+        cap = cv2.VideoCapture(str(video))
+        frame = cap.read()[1]
+        cap.release()
+        results["preprocess_frame"] = measure(lambda: [object_detection.preprocess_frame(frame) for _ in range(100)],
+                                              items=100)
+
+        results["sampling"] = {}
+        for mode, kwargs in (("all", {}), ("stride", {"stride": 5}), ("fps", {"target_fps": 2}), ("scene", {})):
+            kept = sum(1 for _ in iter_sampled_frames(video, mode=mode, **kwargs))
+            results["sampling"][mode] = {
+                **measure(lambda: sum(1 for _ in iter_sampled_frames(video, mode=mode, **kwargs)), repeat=3,
+                          items=n_frames),
+                "frames_kept": kept,
+            }
+
+        results["detect_sequential"] = measure(lambda: sequential_detect(video, model, device), repeat=3,
+                                               items=n_frames)
+        results["detect_sampled_scene"] = measure(
+            lambda: object_detection.detect_video_sampled(str(video), mode="scene", batch_size=8), repeat=3,
+            items=n_frames)
+        results["detect_pipelined"] = measure(
+            lambda: object_detection.detect_video_pipelined(video, batch_size=8), repeat=3, items=n_frames)
+        start = time.perf_counter()
+        stats = object_detection.detect_video_pipelined(video, batch_size=8, output_path=Path(tmp) / "out.mp4")["stats"]
+        results["detect_pipelined_annotated"] = {"wall_ms": 1000 * (time.perf_counter() - start), "stages": stats}
+    return results
+
+
+if __name__ == "__main__":
+    emit(main())
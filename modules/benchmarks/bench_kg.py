@@ -0,0 +1,88 @@
+"""
+Benchmarks for modules/etl/load: knowledge-graph entry creation (per entry, bulk, SQLite store)
+and serialization (Turtle vs streamed N-Triples), on synthetic media metadata.
+"""
+import itertools
+import tempfile
+import time
+from pathlib import Path
+
+from common import emit, measure, parse_args, use_module
+
+use_module("etl/load")
+
+import knowlege_graph as kg  # noqa: E402
+
+KINDS = ["image", "video", "audio", "text"]
+
+
+def make_records(n: int) -> list:
+    return [{
+        "id": f"media_{i}",
+        "kind": KINDS[i % 4],
+        "file_path": f"http://example.org/files/media_{i}.bin",
+        "file_name": f"media_{i}.bin",
+        "format": ["JPEG", "MP4", "MP3", "TXT"][i % 4],
+        "size": 1000 + i,
+        "width": 1920 if i % 4 < 2 else None,
+        "height": 1080 if i % 4 < 2 else None,
+        "duration": (i % 300) + 0.5 if i % 4 in (1, 2) else None,
+        "caption": f"Nội dung số {i} quay ở Hồ Gươm",
+    } for i in range(n)]
+
+
+def build_per_entry(records):
+    g, ns = kg.init_graph()
+    kg.declare_base_ontology(g, ns)
+    for r in records:
+        kg.create_kg_entry(g, ns, r["id"], r["kind"], r)
+    return g, ns
+
+
+def main(argv=None):
+    args = parse_args(__doc__, argv)
+    n = 2000 if args.quick else 50000
+    records = make_records(n)
+    results = {"config": {"entries": n}}
+
+    results["create_kg_entry"] = measure(lambda: build_per_entry(records), repeat=3, items=n)
+
+    def bulk():
+        g, ns = kg.init_graph()
+        kg.declare_base_ontology(g, ns)
+        kg.bulk_load(g, ns, records)
+
+    results["bulk_load"] = measure(bulk, repeat=3, items=n)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp = Path(tmp)
+        graph, _ = build_per_entry(records)
+        results["save_kg_turtle"] = measure(lambda: kg.save_kg(graph, tmp / "kg.owl"), repeat=3, items=n)
+        results["stream_kg_ntriples"] = measure(lambda: kg.stream_kg(records, tmp / "kg.nt"), repeat=3, items=n)
+        results["parse_turtle"] = measure(lambda: kg.Graph().parse(tmp / "kg.owl", format="turtle"),
+                                          repeat=3, items=n)
+
+        runs = itertools.count(1)
+
+        def sqlite_load():
+            g, ns = kg.init_graph(store_path=tmp / f"kg_{next(runs)}.sqlite")
+            kg.declare_base_ontology(g, ns)
+            kg.bulk_load(g, ns, records)
+            g.store.close()
+
+        results["sqlite_bulk_load"] = measure(sqlite_load, repeat=3, warmup=0, items=n)
+        store_path = tmp / "kg_1.sqlite"
+        start = time.perf_counter()
+        g, ns = kg.init_graph(store_path=store_path)
+        results["sqlite_open_ms"] = 1000 * (time.perf_counter() - start)
+        results["sqlite_range_query"] = measure(
+            lambda: g.store.find_subjects(ns.hasDurationSeconds, min_value=60, rdf_type=ns.Video), repeat=20)
+        results["memory_range_query"] = measure(
+            lambda: [s for s, d in graph.subject_objects(ns.hasDurationSeconds)
+                     if d.toPython() >= 60 and (s, kg.RDF.type, ns.Video) in graph], repeat=3)
+        g.store.close()
+    return results
+
+
+if __name__ == "__main__":
+    emit(main())
@@ -0,0 +1,164 @@
+"""
+Benchmarks for modules/prompt-processing: normalize_text, word segmentation, single vs batched
+PhoBERT embedding and keyword extraction.
+
+By default runs offline: a tiny randomly initialised RoBERTa stands in for PhoBERT and a stub
+client with a fixed latency stands in for Gemini (--real-models uses the real ones).
+"""
+import json
+import random
+import threading
+import time
+from types import SimpleNamespace
+
+from common import emit, measure, parse_args, use_module
+
+use_module("prompt-processing")
+
+from functions import embedding_vector_extraction, keyword_extraction  # noqa: E402
+from functions.corpus_preprocessing import iter_preprocessed, segment_text  # noqa: E402
+from functions.text_normalization import normalize_text  # noqa: E402
+
+PHRASES = [
+    "Ảnh chụp Lăng Bác vào tháng 5 năm 2023", "có trời nắng và đám đông", "video đám cưới ở Đà Lạt",
+    "con chó chạy trên bãi biển", "  bạn bè   đi chơi Hồ Gươm ,", "buổi sinh nhật của mẹ", "mưa to ở Sài Gòn .",
+    "quay bằng điện thoại", "hoa anh đào nở rộ", "cả nhà ăn Tết Nguyên Đán",
+]
+STUB_LLM_LATENCY = 0.05  # giây mỗi lần gọi API giả lập
+
+
+def make_texts(n: int, seed: int, phrases_per_text: int = 4) -> list:
+    rng = random.Random(seed)
+    return [" ".join(rng.choice(PHRASES) for _ in range(phrases_per_text)) + " ." for _ in range(n)]
+
+
+# --- Stubs ---
+class StubTokenizer:
+    """Whitespace tokenizer with PhoBERT's special ids, enough for the embedding code paths."""
+
+    bos_token_id, pad_token_id, eos_token_id = 0, 1, 2
+
+    def __init__(self, vocab_size: int):
+        self.vocab_size = vocab_size
+
+    def _ids(self, text: str) -> list:
+        return [0] + [4 + hash(word) % (self.vocab_size - 4) for word in text.split()] + [2]
+
+    def encode(self, text: str, return_tensors=None):
+        import torch
+        return torch.tensor([self._ids(text)])
+
+    def __call__(self, texts, truncation=False, max_length=None, **kwargs):
+        encoded = [self._ids(t) for t in texts]
+        if truncation and max_length:
+            encoded = [ids if len(ids) <= max_length else ids[:max_length - 1] + [2] for ids in encoded]
+        return {"input_ids": encoded}
+
+
+def install_stub_phobert(seed: int):
+    import torch
+    from transformers import RobertaConfig, RobertaModel
+
+    torch.manual_seed(seed)
+    config = RobertaConfig(vocab_size=1000, hidden_size=128, num_hidden_layers=2, num_attention_heads=2,
+                           intermediate_size=256, max_position_embeddings=260, pad_token_id=1)
+    embedding_vector_extraction.phobert_model = RobertaModel(config).eval()
+    embedding_vector_extraction.phobert_tokenizer = StubTokenizer(config.vocab_size)
+
+
+class StubGeminiClient:
+    """Answers every request with a fixed JSON after `latency` seconds."""
+
+    def __init__(self, latency: float):
+        self.latency = latency
+        self.models = SimpleNamespace(generate_content=self._generate)
+
+    def _generate(self, model, contents):
+        time.sleep(self.latency)
+        return SimpleNamespace(text=json.dumps({"type": "image", "location": "Lăng Bác"}, ensure_ascii=False))
+
+
+# --- Benchmarks ---
+def bench_normalization(texts: list) -> dict:
+    results = {"normalize_text": measure(lambda: [normalize_text(t) for t in texts], items=len(texts))}
+    normalized = [normalize_text(t) for t in texts]
+    try:
+        from pyvi import ViTokenizer
+    except ImportError:
+        return results
+    sample = normalized[: max(1, len(normalized) // 10)]
+    results["vitokenizer_plain"] = measure(lambda: [ViTokenizer.tokenize(t) for t in sample], repeat=3,
+                                           items=len(sample))
+    results["segment_text_memoized"] = measure(lambda: [segment_text(t) for t in sample], repeat=3,
+                                               items=len(sample))
+    results["iter_preprocessed_inprocess"] = measure(lambda: list(iter_preprocessed(texts, workers=0)),
+                                                     repeat=3, items=len(texts))
+    return results
+
+
+def bench_embedding(texts: list) -> dict:
+    single = measure(lambda: [embedding_vector_extraction.get_phobert_sentence_embedding(t) for t in texts],
+                     repeat=3, items=len(texts))
+    results = {"single": single}
+    for batch_size in (8, 32):
+        results[f"batch_{batch_size}"] = measure(
+            lambda: embedding_vector_extraction.get_phobert_sentence_embeddings(texts, batch_size=batch_size),
+            repeat=3, items=len(texts))
+        results[f"batch_{batch_size}"]["speedup_vs_single"] = single["median_ms"] / results[f"batch_{batch_size}"]["median_ms"]
+    return results
+
+
+def bench_keywords(texts: list, stub_latency: float) -> dict:
+    results = {
+        "rules": measure(lambda: [keyword_extraction.extract_keywords(t, mode="rules") for t in texts],
+                         items=len(texts)),
+    }
+    unique = [f"{t} #{i}" for i, t in enumerate(texts[:20])]
+
+    def cold():
+        keyword_extraction.llm_cache.clear()
+        for t in unique:
+            keyword_extraction.extract_keywords(t, mode="llm")
+
+    results["llm_cold"] = measure(cold, repeat=3, warmup=0, items=len(unique))
+    results["llm_cached"] = measure(lambda: [keyword_extraction.extract_keywords(t, mode="llm") for t in unique],
+                                    items=len(unique))
+
+    def concurrent_same_prompt(n_threads: int = 16):
+        keyword_extraction.llm_cache.clear()
+        threads = [threading.Thread(target=keyword_extraction.extract_keywords, args=("cùng một câu hỏi", "llm"))
+                   for _ in range(n_threads)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+    before = keyword_extraction.stats["llm_calls"]
+    results["llm_coalesced_16_threads"] = measure(concurrent_same_prompt, repeat=3, warmup=0)
+    results["llm_coalesced_16_threads"]["api_calls_per_run"] = (keyword_extraction.stats["llm_calls"] - before) / 3
+    results["stub_latency_ms"] = 1000 * stub_latency
+    return results
+
+
+def main(argv=None):
+    args = parse_args(__doc__, argv)
+    n = 500 if args.quick else 5000
+    texts = make_texts(n, args.seed)
+    results = {"config": {"texts": n, "real_models": args.real_models}}
+
+    results["normalization"] = bench_normalization(texts)
+
+    if args.real_models:
+        embedding_vector_extraction.load_phobert()
+    else:
+        install_stub_phobert(args.seed)
+    results["embedding"] = bench_embedding(texts[: 64 if args.quick else 256])
+
+    if not args.real_models:
+        keyword_extraction.set_client(StubGeminiClient(STUB_LLM_LATENCY))
+    results["keyword_extraction"] = bench_keywords(texts[:200], STUB_LLM_LATENCY)
+    return results
+
+
+if __name__ == "__main__":
+    emit(main())
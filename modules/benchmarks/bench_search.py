@@ -0,0 +1,115 @@
+"""
+Benchmarks for modules/hybrid-search: vector search recall@k against latency (IVF nprobe sweep
+and compressed indexes), keyword search and rank fusion, on synthetic data.
+"""
+import time
+
+import numpy as np
+
+from common import emit, measure, parse_args, percentiles_ms, use_module
+
+use_module("hybrid-search")
+
+from functions.embedding_compression import CompressedIndex, exact_search, recall_at_k  # noqa: E402
+from functions.keyword_index import KeywordIndex  # noqa: E402
+from functions.rank_fusion import reciprocal_rank_fusion  # noqa: E402
+from functions.vector_index import IVFFlatIndex  # noqa: E402
+
+DIM = 768
+K = 10
+
+
+def make_embeddings(n: int, n_queries: int, seed: int, n_clusters: int = 64, rank: int = 64):
+    """Clustered low-rank vectors plus noise, roughly shaped like sentence embeddings."""
+    rng = np.random.default_rng(seed)
+    basis = rng.normal(size=(rank, DIM)).astype(np.float32)
+    centers = rng.normal(size=(n_clusters, rank)).astype(np.float32) * 3
+    labels = rng.integers(n_clusters, size=n)
+    latent = centers[labels] + rng.normal(size=(n, rank)).astype(np.float32)
+    corpus = latent @ basis + 0.1 * rng.normal(size=(n, DIM)).astype(np.float32)
+    queries = corpus[rng.choice(n, n_queries, replace=False)] + rng.normal(size=(n_queries, DIM)).astype(np.float32)
+    return corpus.astype(np.float32), queries.astype(np.float32)
+
+
+def latency_and_recall(search, queries, exact_ids) -> dict:
+    durations, found = [], []
+    for q in queries:
+        start = time.perf_counter()
+        ids, _ = search(q)
+        durations.append(time.perf_counter() - start)
+        found.append(ids[0])
+    return {f"recall@{K}": recall_at_k(np.stack(found), exact_ids, K), **percentiles_ms(durations),
+            "qps": len(queries) / sum(durations)}
+
+
+def bench_ivf(corpus, queries, exact_ids) -> dict:
+    start = time.perf_counter()
+    index = IVFFlatIndex.build(corpus, metric="cosine")
+    results = {"build_s": time.perf_counter() - start, "nlist": index.nlist, "sweep": []}
+    for nprobe in (1, 4, 8, 16, 32, index.nlist):
+        row = latency_and_recall(lambda q: index.search(q, k=K, nprobe=nprobe), queries, exact_ids)
+        results["sweep"].append({"nprobe": nprobe, **row})
+    return results
+
+
+def bench_compressed(corpus, queries, exact_ids, configs) -> list:
+    rows = []
+    for config in configs:
+        start = time.perf_counter()
+        index = CompressedIndex.build(corpus, metric="cosine", **config)
+        build_s = time.perf_counter() - start
+        row = latency_and_recall(lambda q: index.search(q, k=K), queries, exact_ids)
+        rows.append({**config, "build_s": build_s, "bytes_per_vector": index.bytes_per_vector,
+                     "compression": 4 * DIM / index.bytes_per_vector, **row})
+    return rows
+
+
+def bench_keyword(n: int, seed: int) -> dict:
+    rng = np.random.default_rng(seed)
+    types = ["image", "video", "audio", "text"]
+    locations = ["Lăng Bác", "Hồ Gươm", "Đà Lạt", "Hội An", "Sài Gòn", "Huế"]
+    words = "ảnh video chụp quay đám cưới sinh nhật biển núi chó mèo hoa nắng mưa đám đông bạn bè".split()
+    index = KeywordIndex()
+    start = time.perf_counter()
+    index.add_documents(
+        (i, {"description": " ".join(rng.choice(words, 12)), "type": types[i % 4],
+             "location": locations[i % len(locations)], "date": f"20{20 + i % 5}-{1 + i % 12:02d}"})
+        for i in range(n))
+    index.commit()
+    results = {"build_s": time.perf_counter() - start}
+    filters = {"type": "image", "location": "Lăng Bác", "date": {"from": "2021-03", "to": "2023-06"}}
+    results["search_text"] = measure(lambda: index.search("đám cưới biển", k=K), repeat=20)
+    results["search_filtered"] = measure(lambda: index.search("đám cưới biển", filters=filters, k=K), repeat=20)
+    return results
+
+
+def bench_fusion(n: int, seed: int) -> dict:
+    rng = np.random.default_rng(seed)
+    lists = [rng.permutation(n)[:1000] for _ in range(2)]
+    return {"rrf_2x1000": measure(lambda: reciprocal_rank_fusion(lists, top_k=K), repeat=50)}
+
+
+def main(argv=None):
+    args = parse_args(__doc__, argv)
+    n, n_queries = (5000, 50) if args.quick else (50000, 200)
+    corpus, queries = make_embeddings(n, n_queries, args.seed)
+    exact_ids, _ = exact_search(corpus, queries, k=K, metric="cosine")
+
+    configs = [
+        {"quantizer": "none"},  # float32 flat scan: latency baseline without compression
+        {"n_components": 38, "quantizer": "none"},
+        {"n_components": 38, "quantizer": "sq8"},
+        {"quantizer": "sq8"},
+        {"quantizer": "pq", "pq_m": 48, "max_samples": 5000},
+    ]
+    return {
+        "config": {"corpus": n, "queries": n_queries, "dim": DIM, "k": K},
+        "ivf_flat": bench_ivf(corpus, queries, exact_ids),
+        "compressed": bench_compressed(corpus, queries, exact_ids, configs),
+        "keyword_index": bench_keyword(n, args.seed),
+        "rank_fusion": bench_fusion(n, args.seed),
+    }
+
+
+if __name__ == "__main__":
+    emit(main())
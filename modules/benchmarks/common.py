@@ -0,0 +1,80 @@
+"""
+Shared helpers for the benchmark scripts: timing, module imports and JSON output.
+"""
+import argparse
+import json
+import logging
+import statistics
+import sys
+import time
+from pathlib import Path
+
+MODULES_DIR = Path(__file__).resolve().parents[1]
+
+
+def parse_args(description: str, argv=None):
+    """Options shared by every benchmark script."""
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument("--quick", action="store_true", help="Smaller inputs, for a smoke run")
+    parser.add_argument("--real-models", action="store_true",
+                        help="Use the real PhoBERT / YOLO / Gemini instead of the offline stubs")
+    parser.add_argument("--seed", type=int, default=0)
+    return parser.parse_args(argv)
+
+
+def use_module(name: str):
+    """
+    Make `modules/<name>` importable (e.g. 'prompt-processing' -> `from functions import ...`).
+    Each module ships its own `functions` package, so one benchmark process only uses one module.
+    """
+    sys.path.insert(0, str(MODULES_DIR / name))
+    sys.path.insert(1, str(MODULES_DIR))
+    # Các module ghi log INFO cho từng lời gọi; tắt đi để không ảnh hưởng số đo
+    logging.disable(logging.INFO)
+
+
+def measure(fn, repeat: int = 5, warmup: int = 1, items: int = None) -> dict:
+    """
+    Time `fn()` `repeat` times after `warmup` untimed calls.
+    Args:
+        fn: zero-argument callable
+        repeat: number of timed calls
+        warmup: number of untimed calls first (lazy loading, caches, JIT...)
+        items: work items per call, to also report a throughput
+    Returns:
+        dict {"mean_ms", "median_ms", "min_ms", "max_ms", "stdev_ms", "repeat"} (+ "items_per_s")
+    """
+    for _ in range(warmup):
+        fn()
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    result = {
+        "mean_ms": 1000 * statistics.fmean(times),
+        "median_ms": 1000 * statistics.median(times),
+        "min_ms": 1000 * min(times),
+        "max_ms": 1000 * max(times),
+        "stdev_ms": 1000 * statistics.stdev(times) if len(times) > 1 else 0.0,
+        "repeat": repeat,
+    }
+    if items:
+        result["items_per_s"] = items / statistics.median(times)
+    return result
+
+
+def percentiles_ms(samples, points=(50, 95, 99)) -> dict:
+    """Latency percentiles (milliseconds) of a list of per-call durations in seconds."""
+    ordered = sorted(samples)
+    out = {}
+    for p in points:
+        index = min(len(ordered) - 1, max(0, int(round(p / 100 * len(ordered))) - 1))
+        out[f"p{p}_ms"] = 1000 * ordered[index]
+    return out
+
+
+def emit(results: dict):
+    """Print the results of one benchmark script as JSON on stdout (read by run_benchmarks.py)."""
+    json.dump(results, sys.stdout, ensure_ascii=False, indent=2, default=float)
+    sys.stdout.write("\n")
@@ -0,0 +1,153 @@
+"""
+Offline benchmark suite for the retrieval and footage hot paths.
+
+Each benchmark script runs in its own process (every module ships its own `functions` package)
+and the results are merged into one JSON file, so runs can be compared for regressions.
+
+Ví dụ:
+    python modules/benchmarks/run_benchmarks.py --quick
+    python modules/benchmarks/run_benchmarks.py --output results/today.json --compare results/yesterday.json
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+BENCH_DIR = Path(__file__).resolve().parent
+BENCHMARKS = {
+    "prompt": "bench_prompt.py",
+    "search": "bench_search.py",
+    "kg": "bench_kg.py",
+    "footage": "bench_footage.py",
+}
+# Hậu tố của các chỉ số được so sánh giữa hai lần chạy, và chiều "tốt hơn"
+LOWER_IS_BETTER = ("median_ms", "p50_ms", "p95_ms", "p99_ms", "wall_ms", "build_s", "open_ms")
+HIGHER_IS_BETTER = ("items_per_s", "qps", "speedup_vs_single")
+
+
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=BENCH_DIR, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmark(name: str, extra_args: list, timeout: float) -> dict:
+    """Run one benchmark script and parse the JSON it prints."""
+    start = time.perf_counter()
+    proc = subprocess.run([sys.executable, str(BENCH_DIR / BENCHMARKS[name]), *extra_args], cwd=BENCH_DIR,
+                          capture_output=True, text=True, timeout=timeout)
+    if proc.returncode != 0:
+        raise RuntimeError(proc.stderr.strip().splitlines()[-1] if proc.stderr.strip() else f"exit {proc.returncode}")
+    results = json.loads(proc.stdout)
+    results["elapsed_s"] = time.perf_counter() - start
+    return results
+
+
+def flatten(tree, prefix: str = "") -> dict:
+    """{"a": {"b": [{"c": 1}]}} -> {"a.b.0.c": 1}, numeric leaves only."""
+    out = {}
+    items = tree.items() if isinstance(tree, dict) else enumerate(tree) if isinstance(tree, list) else ()
+    for key, value in items:
+        path = f"{prefix}.{key}" if prefix else str(key)
+        if isinstance(value, (dict, list)):
+            out.update(flatten(value, path))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            out[path] = float(value)
+    return out
+
+
+def compare(baseline: dict, current: dict, threshold: float = 0.10) -> list:
+    """
+    So sánh hai file kết quả.
+    Returns:
+        list[dict] với mỗi chỉ số chung: {"metric", "baseline", "current", "change", "regression"}
+        change > 0 nghĩa là tốt hơn; regression khi tệ hơn quá `threshold` (mặc định 10%)
+    """
+    old, new = flatten(baseline.get("results", {})), flatten(current.get("results", {}))
+    rows = []
+    for metric in sorted(old.keys() & new.keys()):
+        if metric.endswith(LOWER_IS_BETTER):
+            sign = -1.0
+        elif metric.endswith(HIGHER_IS_BETTER) or "recall@" in metric:
+            sign = 1.0
+        else:
+            continue
+        if old[metric] == 0:
+            continue
+        change = sign * (new[metric] - old[metric]) / abs(old[metric])
+        rows.append({"metric": metric, "baseline": old[metric], "current": new[metric], "change": change,
+                     "regression": change < -threshold})
+    return rows
+
+
+def _parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Run the offline benchmark suite and write JSON results.")
+    parser.add_argument("--only", default=",".join(BENCHMARKS), help=f"Comma-separated subset of {list(BENCHMARKS)}")
+    parser.add_argument("--output", default=None, help="Result file (default: results/benchmark-<time>.json)")
+    parser.add_argument("--compare", default=None, help="Earlier result file to compare against")
+    parser.add_argument("--threshold", type=float, default=0.10, help="Relative slowdown reported as regression")
+    parser.add_argument("--timeout", type=float, default=1800, help="Seconds per benchmark script")
+    parser.add_argument("--quick", action="store_true")
+    parser.add_argument("--real-models", action="store_true")
+    parser.add_argument("--seed", type=int, default=0)
+    return parser.parse_args(argv)
+
+
+def main(argv=None) -> int:
+    args = _parse_args(argv)
+    names = [n.strip() for n in args.only.split(",") if n.strip()]
+    unknown = set(names) - set(BENCHMARKS)
+    if unknown:
+        raise SystemExit(f"Unknown benchmarks: {sorted(unknown)}")
+    extra = ["--seed", str(args.seed)] + (["--quick"] if args.quick else []) + \
+            (["--real-models"] if args.real_models else [])
+
+    report = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "git_commit": _git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "quick": args.quick,
+            "real_models": args.real_models,
+            "seed": args.seed,
+        },
+        "results": {},
+        "errors": {},
+    }
+    for name in names:
+        print(f"[benchmark] {name} ...", file=sys.stderr, flush=True)
+        try:
+            report["results"][name] = run_benchmark(name, extra, args.timeout)
+        except Exception as e:
+            report["errors"][name] = str(e)
+            print(f"[benchmark] {name} thất bại: {e}", file=sys.stderr)
+
+    output = Path(args.output or BENCH_DIR / "results" / f"benchmark-{time.strftime('%Y%m%d-%H%M%S')}.json")
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(report, ensure_ascii=False, indent=2), encoding="utf-8")
+    print(f"[benchmark] kết quả: {output}", file=sys.stderr)
+
+    regressions = []
+    if args.compare:
+        baseline = json.loads(Path(args.compare).read_text(encoding="utf-8"))
+        rows = compare(baseline, report, args.threshold)
+        report["comparison"] = {"baseline": str(args.compare), "rows": rows}
+        output.write_text(json.dumps(report, ensure_ascii=False, indent=2), encoding="utf-8")
+        regressions = [r for r in rows if r["regression"]]
+        for row in regressions:
+            print(f"[regression] {row['metric']}: {row['baseline']:.4g} -> {row['current']:.4g} "
+                  f"({row['change']:+.1%})", file=sys.stderr)
+        print(f"[benchmark] {len(rows)} chỉ số được so sánh, {len(regressions)} regression.", file=sys.stderr)
+    return 1 if report["errors"] or regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -7,11 +7,19 @@ VIDEO_EXT = {".mp4",".mov",".avi",".mkv",".webm"}
 TEXT_EXT = {".txt",".md",".json",".csv"}
 
 
+MIME_KIND = {"image": "image", "audio": "audio", "video": "video", "text": "text"}
+
+
 def new_id(prefix: str = "m") -> str:
     """Return a short unique id string with prefix."""
     return f"{prefix}_{uuid.uuid4().hex}"
 
 
+def content_id(content_hash: str, prefix: str = "m") -> str:
+    """Return a stable id derived from a file's content hash (same content -> same id across runs)."""
+    return f"{prefix}_{content_hash[:32]}"
+
+
 def classify_file(path: Path) -> str:
     """Return one of: 'image','audio','video','text','other' based on file extension."""
     ext = path.suffix.lower()
@@ -23,4 +31,22 @@ def classify_file(path: Path) -> str:
         return "video"
     if ext in TEXT_EXT:
         return "text"
-    return "other"
\ No newline at end of file
+    return "other"
+
+
+def classify_file_by_magic(path: Path, header_size: int = 2048) -> str:
+    """
+    Return one of: 'image','audio','video','text','other' from the file's magic bytes,
+    reading only the first `header_size` bytes. Falls back to the extension when the
+    MIME type is not conclusive. Requires `python-magic`.
+    """
+    import magic
+
+    with open(path, "rb") as f:
+        header = f.read(header_size)
+    mime = magic.from_buffer(header, mime=True) or ""
+    kind = MIME_KIND.get(mime.split("/", 1)[0])
+    if kind is None:
+        # vd. "application/octet-stream", "application/json" -> dựa vào phần mở rộng
+        return classify_file(path)
+    return kind
@@ -0,0 +1,284 @@
+import hashlib
+import os
+import sqlite3
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from pathlib import Path
+
+from .classify_file import classify_file, classify_file_by_magic, content_id
+
+HASH_CHUNK = 1 << 20  # 1 MiB
+SAMPLE_HASH_BLOCKS = 3  # đầu, giữa, cuối file
+
+
+def hash_file(path, mode: str = "full") -> str:
+    """
+    Return a content hash (BLAKE2b, 128-bit hex) of a file.
+
+    mode='full' hashes every byte. mode='sample' hashes the size plus three 1 MiB blocks
+    (head, middle, tail): much cheaper for large videos, at the cost of missing edits that
+    touch none of the sampled blocks.
+    """
+    h = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as f:
+        if mode == "sample":
+            size = os.fstat(f.fileno()).st_size
+            h.update(size.to_bytes(8, "little"))
+            if size <= SAMPLE_HASH_BLOCKS * HASH_CHUNK:
+                h.update(f.read())
+            else:
+                for offset in (0, size // 2, size - HASH_CHUNK):
+                    f.seek(offset)
+                    h.update(f.read(HASH_CHUNK))
+        else:
+            for chunk in iter(lambda: f.read(HASH_CHUNK), b""):
+                h.update(chunk)
+    return h.hexdigest()
+
+
+class Manifest:
+    """
+    Local SQLite manifest of crawled files: path -> (size, mtime_ns, hash, id, kind).
+    Lookups go to disk, so the manifest never needs to fit in memory.
+    """
+
+    def __init__(self, path):
+        self.conn = sqlite3.connect(str(path))
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS files ("
+            " path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER,"
+            " hash TEXT, id TEXT, kind TEXT)"
+        )
+        self._pending = 0
+
+    def get(self, path: str):
+        return self.conn.execute(
+            "SELECT size, mtime_ns, hash, id, kind FROM files WHERE path = ?", (path,)
+        ).fetchone()
+
+    def put(self, record: dict, commit_every: int = 1000):
+        self.conn.execute(
+            "INSERT OR REPLACE INTO files (path, size, mtime_ns, hash, id, kind) VALUES (?, ?, ?, ?, ?, ?)",
+            (record["path"], record["size"], record["mtime_ns"], record["hash"], record["id"], record["kind"]),
+        )
+        self._pending += 1
+        if self._pending >= commit_every:
+            self.commit()
+
+    def commit(self):
+        self.conn.commit()
+        self._pending = 0
+
+    def start_walk(self):
+        """Start recording the paths seen during one walk (kept on disk, in a temp table)."""
+        self.conn.execute("CREATE TEMP TABLE IF NOT EXISTS seen (path TEXT PRIMARY KEY)")
+        self.conn.execute("DELETE FROM seen")
+
+    def mark_seen(self, paths):
+        self.conn.executemany("INSERT OR IGNORE INTO seen (path) VALUES (?)", ((p,) for p in paths))
+
+    def prune(self) -> int:
+        """Delete the rows of files that were not seen during the last complete walk. Returns the count."""
+        removed = self.conn.execute("DELETE FROM files WHERE path NOT IN (SELECT path FROM seen)").rowcount
+        self.commit()
+        return removed
+
+    def close(self):
+        self.commit()
+        self.conn.close()
+
+
+def _scan_dir(path: str, follow_symlinks: bool):
+    """List one directory. Returns (subdirs, [(file_path, size, mtime_ns)])."""
+    subdirs, files = [], []
+    try:
+        with os.scandir(path) as it:
+            for entry in it:
+                try:
+                    if entry.is_dir(follow_symlinks=follow_symlinks):
+                        subdirs.append(entry.path)
+                    elif entry.is_file(follow_symlinks=follow_symlinks):
+                        st = entry.stat(follow_symlinks=follow_symlinks)
+                        files.append((entry.path, st.st_size, st.st_mtime_ns))
+                except OSError:
+                    continue
+    except OSError:
+        pass
+    return subdirs, files
+
+
+def walk_files(root, workers: int = 8, follow_symlinks: bool = False):
+    """
+    Walk a directory tree with `os.scandir`, listing directories in parallel threads.
+
+    Yields:
+        tuple: `(path, size, mtime_ns)` for every regular file, in no particular order.
+    """
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="crawl-scan") as pool:
+        running = {pool.submit(_scan_dir, str(root), follow_symlinks)}
+        backlog = deque()
+        while running:
+            done, running = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                subdirs, files = future.result()
+                backlog.extend(subdirs)
+                yield from files
+            # Giới hạn số thư mục đang quét đồng thời để bộ nhớ không tăng theo kích thước cây
+            while backlog and len(running) < 4 * workers:
+                running.add(pool.submit(_scan_dir, backlog.popleft(), follow_symlinks))
+
+
+def _describe(path: str, size: int, mtime_ns: int, previous, hash_mode: str, confirm_magic: bool, kinds=None):
+    """Sniff, then hash one file. Runs in a worker thread."""
+    try:
+        kind = classify_file_by_magic(Path(path)) if confirm_magic else classify_file(Path(path))
+        if kinds is not None and kind not in kinds:
+            # Loại không cần xử lý: không băm, chỉ ghi vào manifest để lần sau bỏ qua mà không đọc file
+            return {"path": path, "size": size, "mtime_ns": mtime_ns, "hash": None, "id": None,
+                    "kind": kind, "status": "excluded"}
+        digest = hash_file(path, hash_mode)
+    except OSError:
+        return None
+    if previous is not None and previous[2] == digest:
+        status = "touched"  # chỉ mtime thay đổi, nội dung giữ nguyên
+    else:
+        # hash NULL: file trước đây bị loại theo `kinds`, chưa từng được xử lý
+        status = "new" if previous is None or previous[2] is None else "changed"
+    return {
+        "path": path,
+        "size": size,
+        "mtime_ns": mtime_ns,
+        "hash": digest,
+        "id": content_id(digest),
+        "kind": kind,
+        "status": status,
+    }
+
+
+class Crawler:
+    """
+    Incrementally crawl a media tree, yielding only new or changed files.
+
+    Files whose size and mtime match the manifest are skipped without being read. Otherwise
+    the content is hashed; a file whose hash did not change is only refreshed in the manifest.
+    Ids are derived from the content hash (`content_id`), so the same file keeps the same id
+    across runs and moves.
+
+    A yielded file is recorded in the manifest only once the consumer calls `mark_done(record)`,
+    so files that were yielded but not processed (crash, `break`, loader error) are yielded
+    again on the next run. After a complete walk, manifest rows of files that no longer exist
+    are pruned.
+
+    Args:
+        root: Directory to crawl.
+        manifest_path: SQLite manifest file (default: `<root>/.crawl_manifest.sqlite`).
+        workers (int): Threads used for directory listing and for hashing.
+        hash_mode (str): 'full' or 'sample', see `hash_file`.
+        confirm_magic (bool): Confirm the kind from magic bytes (reads only the file header).
+        kinds (set): Only report these kinds (e.g. {'image', 'video'}); None reports all. With
+                     `confirm_magic`, files of other kinds are sniffed but never hashed, and are
+                     recorded in the manifest so unchanged ones are not read again.
+        follow_symlinks (bool): Follow symbolic links while walking.
+        max_in_flight (int): Maximum number of files being hashed at once.
+        prune (bool): Drop manifest rows of deleted files after a complete walk.
+
+    Ví dụ:
+        with Crawler("database/data") as crawler:
+            for record in crawler:
+                load(record)
+                crawler.mark_done(record)
+    """
+
+    def __init__(self, root, manifest_path=None, workers: int = 8, hash_mode: str = "full",
+                 confirm_magic: bool = False, kinds=None, follow_symlinks: bool = False, max_in_flight: int = 256,
+                 prune: bool = True):
+        self.root = Path(root)
+        self.manifest_path = Path(manifest_path or self.root / ".crawl_manifest.sqlite")
+        self.workers = workers
+        self.hash_mode = hash_mode
+        self.confirm_magic = confirm_magic
+        self.kinds = kinds
+        self.follow_symlinks = follow_symlinks
+        self.max_in_flight = max_in_flight
+        self.prune = prune
+        self.pruned = 0
+        self.manifest = Manifest(self.manifest_path)
+
+    def mark_done(self, record: dict):
+        """Record a yielded file as processed, so later runs skip it while it is unchanged."""
+        self.manifest.put(record)
+
+    def close(self):
+        self.manifest.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __iter__(self):
+        """
+        Yields:
+            dict: {"id", "path", "kind", "size", "mtime_ns", "hash", "status"} with status
+            'new' or 'changed'.
+        """
+        manifest, kinds = self.manifest, self.kinds
+        manifest_file = str(self.manifest_path.resolve())
+        manifest.start_walk()
+        seen = []
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="crawl-hash") as pool:
+            in_flight = set()
+
+            def drain(block: bool):
+                nonlocal in_flight
+                if not in_flight:
+                    return
+                done, in_flight = wait(in_flight, timeout=None if block else 0, return_when=FIRST_COMPLETED)
+                for future in done:
+                    record = future.result()
+                    if record is None:
+                        continue
+                    if record["status"] in ("touched", "excluded"):
+                        # Nội dung không đổi (chỉ cập nhật mtime) hoặc loại bị loại trừ: không cần xử lý
+                        manifest.put(record)
+                    else:
+                        yield record
+
+            for path, size, mtime_ns in walk_files(self.root, self.workers, self.follow_symlinks):
+                if os.path.abspath(path).startswith(manifest_file):
+                    continue  # bỏ qua chính file manifest (và -wal/-shm)
+                seen.append(path)
+                if len(seen) >= 1000:
+                    manifest.mark_seen(seen)
+                    seen = []
+                if kinds is not None and not self.confirm_magic and classify_file(Path(path)) not in kinds:
+                    continue
+                previous = manifest.get(path)
+                if previous is not None and previous[0] == size and previous[1] == mtime_ns and (
+                        previous[2] is not None or (kinds is not None and previous[4] not in kinds)):
+                    continue  # không đổi (hoặc vẫn thuộc loại bị loại trừ): bỏ qua, không cần đọc file
+                in_flight.add(pool.submit(_describe, path, size, mtime_ns, previous, self.hash_mode,
+                                          self.confirm_magic, kinds))
+                yield from drain(block=len(in_flight) >= self.max_in_flight)
+            while in_flight:
+                yield from drain(block=True)
+        manifest.mark_seen(seen)
+        # Chỉ dọn khi đã duyệt hết cây, nếu không các file chưa duyệt tới sẽ bị xóa nhầm
+        if self.prune:
+            self.pruned = manifest.prune()
+        manifest.commit()
+
+
+def crawl(root, manifest_path=None, **kwargs):
+    """
+    Generator form of `Crawler` (same arguments). A record is marked done when the consumer asks
+    for the next one, i.e. after it has finished processing it; a record whose processing raised
+    or that was followed by `break` is not marked and is yielded again on the next run.
+    """
+    with Crawler(root, manifest_path, **kwargs) as crawler:
+        for record in crawler:
+            yield record
+            crawler.mark_done(record)
@@ -0,0 +1,308 @@
+"""
+SQLite-backed rdflib store for the multimedia knowledge graph.
+
+The KG lives in a single SQLite file instead of being parsed from `multimedia_kg.owl` by every
+process: opening it is O(1) in graph size, and attribute lookups go through SQLite indexes.
+Use it through the usual API:
+
+    g, ns = init_graph(store_path="multimedia_kg.sqlite")
+    create_kg_entry(g, ns, "clip_1", "video", {"duration": 75, "format": "MP4"})
+    g.store.find_subjects(ns.hasDurationSeconds, min_value=60, rdf_type=ns.Video)
+"""
+import itertools
+import sqlite3
+from decimal import Decimal
+from pathlib import Path
+
+from rdflib import BNode, Literal, RDF, URIRef
+from rdflib.store import Store, VALID_STORE
+
+DEFAULT_NAMESPACE = "http://example.org/multimedia#"
+# Các thuộc tính văn bản được đánh chỉ mục full-text (FTS5)
+TEXT_PREDICATES = ("hasCaption",)
+COMMIT_EVERY = 10000
+_generations = itertools.count(1)  # mỗi lần open() một số mới, để `version` không trùng giữa các kết nối
+
+_SCHEMA = [
+    "CREATE TABLE IF NOT EXISTS triples ("
+    " s TEXT NOT NULL, p TEXT NOT NULL, o TEXT NOT NULL,"
+    " o_kind TEXT NOT NULL, o_dtype TEXT NOT NULL DEFAULT '', o_lang TEXT NOT NULL DEFAULT '',"
+    " o_num REAL,"
+    " PRIMARY KEY (s, p, o, o_kind, o_dtype, o_lang)) WITHOUT ROWID",
+    # (p, o): rdf:type, hasFormat, hasCaption và mọi tra cứu theo giá trị chính xác
+    "CREATE INDEX IF NOT EXISTS idx_po ON triples (p, o, s)",
+    # (p, o_num): range scan cho hasDurationSeconds, hasWidth, hasHeight...
+    "CREATE INDEX IF NOT EXISTS idx_num ON triples (p, o_num, s) WHERE o_num IS NOT NULL",
+    "CREATE TABLE IF NOT EXISTS namespaces (prefix TEXT PRIMARY KEY, uri TEXT NOT NULL UNIQUE)",
+]
+
+
+def _encode_subject(term) -> str:
+    return f"_:{term}" if isinstance(term, BNode) else str(term)
+
+
+def _decode_subject(value: str):
+    return BNode(value[2:]) if value.startswith("_:") else URIRef(value)
+
+
+def _encode_object(term):
+    """Object term -> (o, o_kind, o_dtype, o_lang, o_num)."""
+    if isinstance(term, Literal):
+        number = None
+        if isinstance(term.value, (int, float, Decimal)) and not isinstance(term.value, bool):
+            number = float(term.value)
+        return str(term), "L", str(term.datatype or ""), term.language or "", number
+    if isinstance(term, BNode):
+        return str(term), "B", "", "", None
+    return str(term), "U", "", "", None
+
+
+def _decode_object(o, o_kind, o_dtype, o_lang):
+    if o_kind == "L":
+        return Literal(o, datatype=URIRef(o_dtype) if o_dtype else None, lang=o_lang or None)
+    if o_kind == "B":
+        return BNode(o)
+    return URIRef(o)
+
+
+class SQLiteKGStore(Store):
+    """
+    rdflib `Store` persisted in SQLite (one table of triples plus secondary indexes).
+
+    Besides the rdflib API (so `Graph`, `create_kg_entry`, `bulk_load`, `save_kg` and SPARQL
+    work unchanged), it exposes index-backed lookups: `find_subjects` and `search_text`.
+    Not context-aware: all triples belong to the default graph.
+    """
+
+    context_aware = False
+    formula_aware = False
+    transaction_aware = False
+    graph_aware = False
+
+    def __init__(self, configuration=None, identifier=None, namespace: str = DEFAULT_NAMESPACE):
+        super().__init__(configuration=None, identifier=identifier)
+        self.conn = None
+        self.fts = False
+        self._pending = 0
+        self._writes = 0
+        self._generation = 0
+        self._text_predicates = {namespace + name for name in TEXT_PREDICATES}
+        if configuration is not None:
+            self.open(configuration, create=True)
+
+    # ------------------------------------------------------------------
+    # Lifecycle
+    # ------------------------------------------------------------------
+    def open(self, configuration, create: bool = False):
+        path = Path(configuration)
+        if path.parent and not path.parent.exists():
+            path.parent.mkdir(parents=True, exist_ok=True)
+        self.conn = sqlite3.connect(str(path))
+        self._generation = next(_generations)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        for statement in _SCHEMA:
+            self.conn.execute(statement)
+        try:
+            self.conn.execute(
+                "CREATE VIRTUAL TABLE IF NOT EXISTS text_index USING fts5(s UNINDEXED, p UNINDEXED, text)")
+            self.fts = True
+        except sqlite3.OperationalError:
+            self.fts = False  # SQLite build không có FTS5: search_text dùng LIKE
+        self.conn.commit()
+        return VALID_STORE
+
+    def commit(self):
+        if self.conn is not None:
+            self.conn.commit()
+        self._pending = 0
+
+    def rollback(self):
+        if self.conn is not None:
+            self.conn.rollback()
+        self._pending = 0
+
+    def close(self, commit_pending_transaction: bool = True):
+        if self.conn is None:
+            return
+        if commit_pending_transaction:
+            self.commit()
+        self.conn.close()
+        self.conn = None
+
+    @property
+    def version(self) -> tuple:
+        """
+        Changes whenever the graph may have changed: writes through this store, or commits to the
+        same file by other connections/processes (`PRAGMA data_version`). Used to invalidate caches
+        built on KG lookups (e.g. hybrid-search's query_cache).
+        """
+        if self.conn is None:
+            return (self._generation, None, self._writes)
+        return (self._generation, self.conn.execute("PRAGMA data_version").fetchone()[0], self._writes)
+
+    # ------------------------------------------------------------------
+    # Writes
+    # ------------------------------------------------------------------
+    def _insert(self, triples):
+        sql = "INSERT OR IGNORE INTO triples (s, p, o, o_kind, o_dtype, o_lang, o_num) VALUES (?, ?, ?, ?, ?, ?, ?)"
+        rows = []
+        for s, p, o in triples:
+            row = (_encode_subject(s), str(p)) + _encode_object(o)
+            if self.fts and row[1] in self._text_predicates and row[3] == "L":
+                # Chỉ đánh chỉ mục full-text khi triple thực sự mới, để thêm lại không tạo bản ghi trùng
+                if self.conn.execute(sql, row).rowcount:
+                    self.conn.execute("INSERT INTO text_index (s, p, text) VALUES (?, ?, ?)", row[:3])
+            else:
+                rows.append(row)
+        self.conn.executemany(sql, rows)
+        self._writes += 1
+
+    def add(self, triple, context=None, quoted: bool = False):
+        self._insert([triple])
+        self._pending += 1
+        if self._pending >= COMMIT_EVERY:
+            self.commit()
+
+    def addN(self, quads):
+        self._insert((s, p, o) for s, p, o, _ in quads)
+        self.commit()
+
+    def remove(self, triple_pattern, context=None):
+        where, params = self._where(triple_pattern)
+        if self.fts:
+            self.conn.execute(
+                "DELETE FROM text_index WHERE rowid IN (SELECT x.rowid FROM text_index x JOIN triples "
+                f"ON triples.s = x.s AND triples.p = x.p AND triples.o = x.text WHERE {where})",
+                params,
+            )
+        self.conn.execute(f"DELETE FROM triples WHERE {where}", params)
+        self._writes += 1
+        self._pending += 1
+
+    # ------------------------------------------------------------------
+    # Reads
+    # ------------------------------------------------------------------
+    @staticmethod
+    def _where(triple_pattern):
+        s, p, o = triple_pattern
+        clauses, params = ["1"], []
+        if s is not None:
+            clauses.append("triples.s = ?")
+            params.append(_encode_subject(s))
+        if p is not None:
+            clauses.append("triples.p = ?")
+            params.append(str(p))
+        if o is not None:
+            o_value, o_kind, o_dtype, o_lang, _ = _encode_object(o)
+            clauses.append("triples.o = ? AND triples.o_kind = ? AND triples.o_dtype = ? AND triples.o_lang = ?")
+            params.extend([o_value, o_kind, o_dtype, o_lang])
+        return " AND ".join(clauses), params
+
+    def triples(self, triple_pattern, context=None):
+        where, params = self._where(triple_pattern)
+        cursor = self.conn.execute(
+            f"SELECT s, p, o, o_kind, o_dtype, o_lang FROM triples WHERE {where}", params)
+        for s, p, o, o_kind, o_dtype, o_lang in cursor:
+            yield (_decode_subject(s), URIRef(p), _decode_object(o, o_kind, o_dtype, o_lang)), iter(())
+
+    def __len__(self, context=None):
+        return self.conn.execute("SELECT COUNT(*) FROM triples").fetchone()[0]
+
+    def contexts(self, triple=None):
+        return iter(())
+
+    # ------------------------------------------------------------------
+    # Namespaces
+    # ------------------------------------------------------------------
+    def bind(self, prefix, namespace, override: bool = True):
+        namespace = str(namespace)
+        if override:
+            self.conn.execute("DELETE FROM namespaces WHERE prefix = ? OR uri = ?", (prefix, namespace))
+            self.conn.execute("INSERT INTO namespaces (prefix, uri) VALUES (?, ?)", (prefix, namespace))
+        else:
+            self.conn.execute("INSERT OR IGNORE INTO namespaces (prefix, uri) VALUES (?, ?)", (prefix, namespace))
+        self._pending += 1
+
+    def namespace(self, prefix):
+        row = self.conn.execute("SELECT uri FROM namespaces WHERE prefix = ?", (prefix,)).fetchone()
+        return URIRef(row[0]) if row else None
+
+    def prefix(self, namespace):
+        row = self.conn.execute("SELECT prefix FROM namespaces WHERE uri = ?", (str(namespace),)).fetchone()
+        return row[0] if row else None
+
+    def namespaces(self):
+        for prefix, uri in self.conn.execute("SELECT prefix, uri FROM namespaces").fetchall():
+            yield prefix, URIRef(uri)
+
+    # ------------------------------------------------------------------
+    # Index-backed lookups
+    # ------------------------------------------------------------------
+    def find_subjects(self, predicate, value=None, min_value=None, max_value=None, rdf_type=None,
+                      limit: int = None):
+        """
+        Subjects whose `predicate` equals `value`, or lies in [min_value, max_value] (numeric).
+        Args:
+            predicate: e.g. ns.hasFormat, ns.hasDurationSeconds, RDF.type
+            value: exact value (compared on its lexical form)
+            min_value, max_value: inclusive numeric bounds, either may be None
+            rdf_type: only subjects of this class (e.g. ns.Video)
+            limit: maximum number of subjects
+        Returns:
+            list[URIRef | BNode]
+        """
+        sql = "SELECT DISTINCT t.s FROM triples t"
+        params = []
+        if rdf_type is not None:
+            sql += " JOIN triples k ON k.s = t.s AND k.p = ? AND k.o = ? AND k.o_kind = 'U'"
+            params.extend([str(RDF.type), str(rdf_type)])
+        sql += " WHERE t.p = ?"
+        params.append(str(predicate))
+        if value is not None:
+            sql += " AND t.o = ?"
+            params.append(str(value))
+        if min_value is not None or max_value is not None:
+            sql += " AND t.o_num IS NOT NULL"
+            if min_value is not None:
+                sql += " AND t.o_num >= ?"
+                params.append(float(min_value))
+            if max_value is not None:
+                sql += " AND t.o_num <= ?"
+                params.append(float(max_value))
+        if limit is not None:
+            sql += " LIMIT ?"
+            params.append(int(limit))
+        return [_decode_subject(row[0]) for row in self.conn.execute(sql, params)]
+
+    def search_text(self, query: str, predicate=None, rdf_type=None, limit: int = 100):
+        """
+        Full-text search over text predicates (hasCaption), best matches first.
+        Args:
+            query: FTS5 query (words are AND-ed), or a substring when FTS5 is unavailable
+            predicate: restrict to one text predicate
+            rdf_type: only subjects of this class
+            limit: maximum number of subjects
+        Returns:
+            list[URIRef | BNode]
+        """
+        sql, params = "SELECT x.s FROM ", []
+        if self.fts:
+            sql += "text_index x"
+            where, order = " WHERE text_index MATCH ?", " GROUP BY x.s ORDER BY MIN(x.rank)"
+            params.append(query)
+        else:
+            sql += "triples x"
+            where = " WHERE x.o LIKE ? AND x.p IN (%s)" % ",".join("?" * len(self._text_predicates))
+            order = " GROUP BY x.s"
+            params.append(f"%{query}%")
+            params.extend(sorted(self._text_predicates))
+        if rdf_type is not None:
+            sql += " JOIN triples k ON k.s = x.s AND k.p = ? AND k.o = ? AND k.o_kind = 'U'"
+            params = [str(RDF.type), str(rdf_type)] + params
+        if predicate is not None:
+            where += " AND x.p = ?"
+            params.append(str(predicate))
+        params.append(int(limit))
+        rows = self.conn.execute(sql + where + order + " LIMIT ?", params).fetchall()
+        return [_decode_subject(row[0]) for row in rows]
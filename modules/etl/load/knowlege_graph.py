@@ -1,66 +1,227 @@
+import os
+from functools import lru_cache
+from itertools import islice
+from pathlib import Path
+
 from rdflib import Graph, Namespace, Literal, RDF, RDFS, OWL
 from rdflib.namespace import XSD
 
-def init_graph(namespace: str = "http://example.org/multimedia#"):
-    g = Graph()
+DEFAULT_NAMESPACE = "http://example.org/multimedia#"
+BULK_BATCH_SIZE = 10000
+STREAM_FORMATS = ("nt", "nq")
+
+def init_graph(namespace: str = DEFAULT_NAMESPACE, store_path=None):
+    """
+    Create the KG graph. With `store_path` the graph is backed by a persistent SQLite store
+    (kg_store.SQLiteKGStore): opening it does not load the graph, and the existing content is
+    reused across processes. Without it, an in-memory rdflib Graph.
+    """
+    if store_path is not None:
+        try:
+            from .kg_store import SQLiteKGStore
+        except ImportError:  # chạy trực tiếp dưới dạng script
+            from kg_store import SQLiteKGStore
+        g = Graph(store=SQLiteKGStore(str(store_path), namespace=namespace))
+    else:
+        g = Graph()
     ns = Namespace(namespace)
     g.bind("ex", ns)
     return g, ns
 
-def declare_base_ontology(g: Graph, ns: Namespace):
-    # basic classes
-    g.add((ns.MultimediaFile, RDF.type, OWL.Class))
-    for cls in ["Image", "Video", "Audio", "TextFile", "Thumbnail", "FeatureVector"]:
-        g.add((getattr(ns, cls), RDF.type, OWL.Class))
+BASE_CLASSES = ["Image", "Video", "Audio", "TextFile", "Thumbnail", "FeatureVector"]
+BASE_PROPERTIES = [
+    "hasFileURI", "hasFileName", "hasFormat", "hasSizeBytes", "hasWidth", "hasHeight",
+    "hasDurationSeconds", "hasFrameRate", "hasSampleRate", "hasChannels", "hasCaption",
+    "hasFeatureID", "hasThumbURI"
+]
 
-    # basic datatype properties (a minimal set)
-    props = [
-        "hasFileURI", "hasFileName", "hasFormat", "hasSizeBytes", "hasWidth", "hasHeight",
-        "hasDurationSeconds", "hasFrameRate", "hasSampleRate", "hasChannels", "hasCaption",
-        "hasFeatureID", "hasThumbURI"
-    ]
-    for p in props:
-        g.add((getattr(ns, p), RDF.type, OWL.DatatypeProperty))
+# (metadata key, property, cast, datatype) cho mỗi thuộc tính của một entry
+ENTRY_FIELDS = [
+    ("file_path", "hasFileURI", None, XSD.anyURI),
+    ("file_name", "hasFileName", None, XSD.string),
+    ("format", "hasFormat", None, XSD.string),
+    ("size", "hasSizeBytes", int, XSD.integer),
+    ("width", "hasWidth", int, XSD.integer),
+    ("height", "hasHeight", int, XSD.integer),
+    ("duration", "hasDurationSeconds", float, XSD.decimal),
+    ("framerate", "hasFrameRate", float, XSD.decimal),
+    ("sample_rate", "hasSampleRate", int, XSD.integer),
+    ("channels", "hasChannels", int, XSD.integer),
+    ("caption", "hasCaption", None, XSD.string),
+    ("feature_id", "hasFeatureID", None, XSD.string),
+    ("thumb_path", "hasThumbURI", None, XSD.anyURI),
+]
 
 
-def create_kg_entry(g: Graph, ns: Namespace, entity_id: str, kind: str, metadata: dict):
-    subj = ns[entity_id]
-    kind_map = {"image": ns.Image, "video": ns.Video, "audio": ns.Audio, "text": ns.TextFile}
-    g.add((subj, RDF.type, kind_map.get(kind, ns.MultimediaFile)))
+@lru_cache(maxsize=None)
+def _kind_map(ns: Namespace):
+    return {"image": ns.Image, "video": ns.Video, "audio": ns.Audio, "text": ns.TextFile}
+
+
+@lru_cache(maxsize=None)
+def _field_terms(ns: Namespace):
+    return [(key, ns[pname], cast, dtype) for key, pname, cast, dtype in ENTRY_FIELDS]
+
+
+def iter_base_ontology_triples(ns: Namespace):
+    """Yield the triples of the base ontology (classes and datatype properties)."""
+    yield (ns.MultimediaFile, RDF.type, OWL.Class)
+    for cls in BASE_CLASSES:
+        yield (ns[cls], RDF.type, OWL.Class)
+    for p in BASE_PROPERTIES:
+        yield (ns[p], RDF.type, OWL.DatatypeProperty)
+
 
-    def add(pname, value, dtype=XSD.string):
+def declare_base_ontology(g: Graph, ns: Namespace):
+    g.addN((s, p, o, g) for s, p, o in iter_base_ontology_triples(ns))
+
+
+def iter_entry_triples(ns: Namespace, entity_id: str, kind: str, metadata: dict):
+    """Yield the triples describing one multimedia file (same triples as create_kg_entry adds)."""
+    subj = ns[entity_id]
+    yield (subj, RDF.type, _kind_map(ns).get(kind, ns.MultimediaFile))
+    for key, prop, cast, dtype in _field_terms(ns):
+        value = metadata.get(key)
         if value is None:
-            return
-        g.add((subj, getattr(ns, pname), Literal(value, datatype=dtype)))
-
-    add("hasFileURI", metadata.get("file_path"), XSD.anyURI)
-    add("hasFileName", metadata.get("file_name"), XSD.string)
-    add("hasFormat", metadata.get("format"), XSD.string)
-    if metadata.get("size") is not None:
-        add("hasSizeBytes", int(metadata.get("size")), XSD.integer)
-    if metadata.get("width") is not None:
-        add("hasWidth", int(metadata.get("width")), XSD.integer)
-    if metadata.get("height") is not None:
-        add("hasHeight", int(metadata.get("height")), XSD.integer)
-    if metadata.get("duration") is not None:
-        add("hasDurationSeconds", float(metadata.get("duration")), XSD.decimal)
-    if metadata.get("framerate") is not None:
-        add("hasFrameRate", float(metadata.get("framerate")), XSD.decimal)
-    if metadata.get("sample_rate") is not None:
-        add("hasSampleRate", int(metadata.get("sample_rate")), XSD.integer)
-    if metadata.get("channels") is not None:
-        add("hasChannels", int(metadata.get("channels")), XSD.integer)
-    if metadata.get("caption") is not None:
-        add("hasCaption", metadata.get("caption"), XSD.string)
-    if metadata.get("feature_id") is not None:
-        add("hasFeatureID", metadata.get("feature_id"), XSD.string)
-    if metadata.get("thumb_path") is not None:
-        add("hasThumbURI", metadata.get("thumb_path"), XSD.anyURI)
+            continue
+        yield (subj, prop, Literal(cast(value) if cast else value, datatype=dtype))
+
+
+def create_kg_entry(g: Graph, ns: Namespace, entity_id: str, kind: str, metadata: dict):
+    g.addN((s, p, o, g) for s, p, o in iter_entry_triples(ns, entity_id, kind, metadata))
 
 
 def save_kg(g: Graph, path):
     g.serialize(destination=str(path), format="turtle")
 
+
+# =========================================================================================
+# Bulk / streaming loader
+# =========================================================================================
+def _entry_args(record: dict):
+    """
+    Split a metadata dict into (entity_id, kind, metadata).
+    The dict carries its own "id" (or "entity_id") and "kind"; records from the crawler
+    (`etl.extract.crawler.crawl`) work as-is, their "path" is used as file_path/file_name.
+    """
+    entity_id = record.get("id") or record.get("entity_id")
+    if not entity_id:
+        raise ValueError(f"Metadata record has no 'id': {record!r}")
+    metadata = record
+    if record.get("file_path") is None and record.get("path") is not None:
+        path = Path(record["path"])
+        metadata = {**record, "file_path": path.resolve().as_uri()}
+        metadata.setdefault("file_name", path.name)
+    return str(entity_id), record.get("kind"), metadata
+
+
+def iter_triples(ns: Namespace, records):
+    """Yield the triples of every metadata dict in `records` (see _entry_args)."""
+    for record in records:
+        yield from iter_entry_triples(ns, *_entry_args(record))
+
+
+def _batched(iterable, size: int):
+    it = iter(iterable)
+    while True:
+        batch = list(islice(it, size))
+        if not batch:
+            return
+        yield batch
+
+
+def bulk_load(g: Graph, ns: Namespace, records, batch_size: int = BULK_BATCH_SIZE) -> int:
+    """
+    Add many entries to an in-memory graph, `batch_size` triples per `addN` call.
+    Args:
+        g: graph to fill
+        ns: namespace of the KG
+        records: iterable of metadata dicts, each with "id" and "kind" (see create_kg_entry)
+        batch_size: triples per addN call
+    Returns:
+        number of triples added
+    """
+    n_triples = 0
+    for batch in _batched(iter_triples(ns, records), batch_size):
+        g.addN((s, p, o, g) for s, p, o in batch)
+        n_triples += len(batch)
+    return n_triples
+
+
+_NT_ESCAPES = str.maketrans({"\\": "\\\\", '"': '\\"', "\n": "\\n", "\r": "\\r"})
+
+
+def _nt_term(term) -> str:
+    """One term in N-Triples syntax (literals always on a single line)."""
+    if isinstance(term, Literal):
+        lexical = '"' + str(term).translate(_NT_ESCAPES) + '"'
+        if term.language:
+            return f"{lexical}@{term.language}"
+        if term.datatype:
+            return f"{lexical}^^<{term.datatype}>"
+        return lexical
+    return f"<{term}>"
+
+
+def _nt_line(triple, context: str = "") -> str:
+    s, p, o = triple
+    return f"{_nt_term(s)} {_nt_term(p)} {_nt_term(o)}{context} .\n"
+
+
+def stream_kg(records, path, namespace: str = DEFAULT_NAMESPACE, fmt: str = "nt", graph_iri: str = None,
+              append: bool = False, with_ontology: bool = None, batch_size: int = BULK_BATCH_SIZE) -> int:
+    """
+    Write entries straight to an N-Triples / N-Quads file without building a Graph,
+    so memory stays constant whatever the number of records.
+    Args:
+        records: iterable of metadata dicts, each with "id" and "kind" (see create_kg_entry)
+        path: output file
+        namespace: namespace of the KG
+        fmt: 'nt' (N-Triples) or 'nq' (N-Quads, every triple in `graph_iri`)
+        graph_iri: named graph of the quads (default: the namespace IRI)
+        append: append to an existing file instead of rewriting it. N-Triples lines are also
+            valid Turtle, so fmt='nt' can append to a Turtle KG written by save_kg.
+        with_ontology: also write the base ontology (default: only when not appending)
+        batch_size: triples formatted per write
+    Returns:
+        number of triples written
+    """
+    if fmt not in STREAM_FORMATS:
+        raise ValueError(f"Unknown stream format '{fmt}', expected one of {STREAM_FORMATS}")
+    ns = Namespace(namespace)
+    context = f" <{graph_iri or namespace}>" if fmt == "nq" else ""
+    if with_ontology is None:
+        with_ontology = not append
+
+    path = Path(path)
+    needs_newline = False
+    if append and path.exists() and path.stat().st_size > 0:
+        with open(path, "rb") as f:
+            f.seek(-1, os.SEEK_END)
+            needs_newline = f.read(1) != b"\n"
+
+    n_triples = 0
+    with open(path, "a" if append else "w", encoding="utf-8") as f:
+        if needs_newline:
+            f.write("\n")
+        if with_ontology:
+            lines = [_nt_line(t, context) for t in iter_base_ontology_triples(ns)]
+            f.writelines(lines)
+            n_triples += len(lines)
+        for batch in _batched(iter_triples(ns, records), batch_size):
+            f.writelines([_nt_line(t, context) for t in batch])
+            n_triples += len(batch)
+    return n_triples
+
+
+def append_kg(path, records, namespace: str = DEFAULT_NAMESPACE, batch_size: int = BULK_BATCH_SIZE) -> int:
+    """
+    Append entries to an existing KG file (.nt, .nq, or a Turtle file such as multimedia_kg.owl)
+    without loading or rewriting it.
+    """
+    fmt = "nq" if Path(path).suffix.lower() == ".nq" else "nt"
+    return stream_kg(records, path, namespace, fmt=fmt, append=True, batch_size=batch_size)
+
 if __name__ == "__main__":
     graph, namespace = init_graph()
     declare_base_ontology(graph, namespace)
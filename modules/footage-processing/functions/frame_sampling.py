@@ -0,0 +1,165 @@
+import cv2
+import numpy as np
+
+SAMPLING_MODES = ("all", "stride", "fps", "scene", "keyframe")
+
+
+# =========================================================================================
+# Scene-change detection - so sánh histogram trên ảnh thu nhỏ (rẻ hơn nhiều so với chạy YOLO)
+# =========================================================================================
+def frame_signature(frame, size=(64, 36), bins=16):
+    """
+    Tính "chữ ký" rẻ của một frame: ảnh xám thu nhỏ + histogram HSV đã chuẩn hóa.
+    Args:
+        frame: ảnh BGR từ OpenCV
+        size: kích thước ảnh thu nhỏ (w, h)
+        bins: số bin cho mỗi kênh H và S
+    Returns:
+        (small_gray, hist)
+    """
+    small = cv2.resize(frame, size, interpolation=cv2.INTER_AREA)
+    gray = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+    hsv = cv2.cvtColor(small, cv2.COLOR_BGR2HSV)
+    hist = cv2.calcHist([hsv], [0, 1], None, [bins, bins], [0, 180, 0, 256])
+    cv2.normalize(hist, hist, alpha=1.0, norm_type=cv2.NORM_L1)
+    return gray, hist
+
+
+def scene_changed(prev_sig, sig, hist_threshold=0.35, diff_threshold=30.0):
+    """
+    Có chuyển cảnh giữa hai chữ ký hay không.
+    Args:
+        prev_sig, sig: kết quả của frame_signature
+        hist_threshold: ngưỡng khoảng cách Bhattacharyya giữa hai histogram (0..1)
+        diff_threshold: ngưỡng chênh lệch điểm ảnh xám trung bình (0..255)
+    Returns:
+        True nếu một trong hai ngưỡng bị vượt
+    """
+    hist_dist = cv2.compareHist(prev_sig[1], sig[1], cv2.HISTCMP_BHATTACHARYYA)
+    if hist_dist > hist_threshold:
+        return True
+    mean_diff = float(np.mean(cv2.absdiff(prev_sig[0], sig[0])))
+    return mean_diff > diff_threshold
+
+
+# =========================================================================================
+# Frame sampling
+# =========================================================================================
+def _iter_keyframes(video_path):
+    """
+    Chỉ giải mã keyframe (I-frame) bằng PyAV: decoder bỏ qua hoàn toàn các frame còn lại.
+    Yields:
+        (frame_index, timestamp, frame_bgr)
+    """
+    try:
+        import av
+    except ImportError as e:
+        raise ImportError("Keyframe-only decoding requires PyAV (`pip install av`)") from e
+
+    with av.open(str(video_path)) as container:
+        stream = container.streams.video[0]
+        stream.codec_context.skip_frame = "NONKEY"
+        fps = float(stream.average_rate or 0) or 25.0
+        for frame in container.decode(stream):
+            timestamp = float(frame.pts * stream.time_base) if frame.pts is not None else 0.0
+            yield int(round(timestamp * fps)), timestamp, frame.to_ndarray(format="bgr24")
+
+
+def iter_sampled_frames(video_path, mode="scene", stride=1, target_fps=None,
+                        hist_threshold=0.35, diff_threshold=30.0, max_gap_seconds=10.0):
+    """
+    Đọc video và chỉ trả về các frame đại diện.
+    Args:
+        video_path: đường dẫn file video
+        mode: 'all' | 'stride' | 'fps' | 'scene' | 'keyframe'
+            - all: mọi frame
+            - stride: cứ mỗi `stride` frame lấy 1
+            - fps: lấy mẫu đều theo `target_fps`
+            - scene: chỉ lấy frame đầu tiên của mỗi cảnh (kiểm tra mỗi `stride` frame)
+            - keyframe: chỉ giải mã keyframe (cần PyAV)
+        stride: bước nhảy frame (mode 'stride', và bước kiểm tra của mode 'scene')
+        target_fps: số frame/giây cần lấy (mode 'fps')
+        hist_threshold, diff_threshold: ngưỡng chuyển cảnh (mode 'scene'), xem scene_changed
+        max_gap_seconds: mode 'scene' vẫn lấy 1 frame sau mỗi khoảng này dù không chuyển cảnh
+    Yields:
+        (frame_index, timestamp, frame_bgr)
+    """
+    if mode not in SAMPLING_MODES:
+        raise ValueError(f"Unknown sampling mode '{mode}', expected one of {SAMPLING_MODES}")
+    if mode == "keyframe":
+        yield from _iter_keyframes(video_path)
+        return
+
+    cap = cv2.VideoCapture(str(video_path))
+    if not cap.isOpened():
+        raise IOError(f"Không thể mở video: {video_path}")
+    fps = cap.get(cv2.CAP_PROP_FPS) or 25.0
+
+    if mode == "all":
+        stride = 1
+    elif mode == "fps":
+        if not target_fps:
+            raise ValueError("mode='fps' requires target_fps")
+        stride = max(1, int(round(fps / target_fps)))
+    stride = max(1, int(stride))
+    max_gap = int(max_gap_seconds * fps) if max_gap_seconds else None
+
+    frame_index = -1
+    last_sig = None
+    last_kept = None
+    try:
+        while True:
+            frame_index += 1
+            # grab() bỏ qua bước chuyển đổi/sao chép frame; chỉ retrieve() frame cần dùng
+            if not cap.grab():
+                break
+            if frame_index % stride:
+                continue
+            ret, frame = cap.retrieve()
+            if not ret:
+                break
+
+            if mode == "scene":
+                sig = frame_signature(frame)
+                forced = max_gap is not None and last_kept is not None and frame_index - last_kept >= max_gap
+                if last_sig is not None and not forced and not scene_changed(last_sig, sig, hist_threshold,
+                                                                             diff_threshold):
+                    continue
+                last_sig = sig
+            last_kept = frame_index
+            yield frame_index, frame_index / fps, frame
+    finally:
+        cap.release()
+
+
+def sample_segments(video_path, **sampling_kwargs):
+    """
+    Lấy mẫu frame và gán cho mỗi frame đại diện đoạn thời gian nó bao phủ
+    (từ frame đó tới trước frame đại diện tiếp theo, hoặc tới hết video).
+    Args:
+        video_path: đường dẫn file video
+        **sampling_kwargs: tham số của iter_sampled_frames
+    Yields:
+        (segment, frame_bgr) với segment = {"frame_index", "start_time", "end_time"}
+    """
+    cap = cv2.VideoCapture(str(video_path))
+    duration = None
+    if cap.isOpened():
+        fps = cap.get(cv2.CAP_PROP_FPS) or 25.0
+        n_frames = cap.get(cv2.CAP_PROP_FRAME_COUNT)
+        duration = n_frames / fps if n_frames > 0 else None
+    cap.release()
+
+    pending = None
+    last_time = 0.0
+    for frame_index, timestamp, frame in iter_sampled_frames(video_path, **sampling_kwargs):
+        if pending is not None:
+            segment, prev_frame = pending
+            segment["end_time"] = timestamp
+            yield segment, prev_frame
+        pending = ({"frame_index": frame_index, "start_time": timestamp, "end_time": None}, frame)
+        last_time = timestamp
+    if pending is not None:
+        segment, prev_frame = pending
+        segment["end_time"] = duration if duration is not None and duration > last_time else last_time
+        yield segment, prev_frame
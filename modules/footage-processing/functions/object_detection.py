@@ -1,24 +1,190 @@
-from ultralytics import YOLO
 import cv2
 import numpy as np
-import torch
-import sys
+import os
+import queue
+import threading
 import logging
+import sys
 import time
+from pathlib import Path
+
+from .frame_sampling import iter_sampled_frames, sample_segments
+
+# Cho phép import các module dùng chung trong ./modules (utils.telemetry)
+_MODULES_DIR = str(Path(__file__).resolve().parents[2])
+if _MODULES_DIR not in sys.path:
+    sys.path.append(_MODULES_DIR)
+
+from utils import telemetry  # noqa: E402
 
 # =========================================================================================
 # Config
 # =========================================================================================
 logging.basicConfig(level=logging.INFO)
-device = "cuda" if torch.cuda.is_available() else "cpu"
 
-# Load YOLO model
-try:
-    model = YOLO("yolov8n.pt")  # Load model YOLOv8 nano (nhẹ, nhanh)
-    logging.info(f"YOLO model loaded on {device}")
-except Exception as e:
-    logging.error(f"Failed to load YOLO model: {e}")
-    sys.exit(1)  # Lỗi -> thoát chương trình luôn
+# Đường dẫn model có thể cấu hình qua biến môi trường (mặc định YOLOv8 nano - nhẹ, nhanh)
+YOLO_MODEL_PATH = os.getenv("YOLO_MODEL_PATH", "yolov8n.pt")
+# Backend suy luận trên CPU: pytorch | torchscript | onnx | onnx-int8 | openvino
+# (file export được đặt cạnh file weights và dùng lại ở các lần sau)
+YOLO_BACKEND = os.getenv("YOLO_BACKEND", "pytorch")
+YOLO_BACKENDS = ("pytorch", "torchscript", "onnx", "onnx-int8", "openvino")
+# Backend chỉ được dùng khi tỉ lệ box khớp với PyTorch (cùng lớp, IoU >= 0.5) trên ảnh kiểm tra đạt ngưỡng này
+YOLO_BACKEND_MIN_AGREEMENT = float(os.getenv("YOLO_BACKEND_MIN_AGREEMENT", "0.9"))
+# Ảnh kiểm tra (phân tách bởi dấu phẩy); mặc định dùng ảnh mẫu đi kèm ultralytics
+YOLO_VERIFY_IMAGES = [p for p in os.getenv("YOLO_VERIFY_IMAGES", "").split(",") if p]
+
+
+class ModelLoadError(RuntimeError):
+    """Raised when the YOLO model cannot be loaded."""
+
+
+# Model được tải lazy ở lần dùng đầu tiên (hoặc qua warm_up()), an toàn đa luồng
+model = None
+device = None
+backend_report = None  # {"backend", "requested", "agreement", ...} của lần tải gần nhất
+_model_lock = threading.Lock()
+
+
+def _box_iou(a, b):
+    x1, y1 = max(a[0], b[0]), max(a[1], b[1])
+    x2, y2 = min(a[2], b[2]), min(a[3], b[3])
+    inter = max(0.0, x2 - x1) * max(0.0, y2 - y1)
+    union = (a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - inter
+    return inter / union if union > 0 else 0.0
+
+
+def detection_agreement(expected, actual, iou_threshold=0.5):
+    """
+    Tỉ lệ khớp giữa hai danh sách detection (xem detections_from_result): số cặp cùng lớp có
+    IoU >= iou_threshold (ghép tham lam), chia cho số detection của danh sách dài hơn.
+    Returns:
+        float trong [0, 1]; 1.0 khi cả hai đều rỗng
+    """
+    if not expected and not actual:
+        return 1.0
+    unmatched = list(actual)
+    matched = 0
+    for det in sorted(expected, key=lambda d: -d["confidence"]):
+        best, best_iou = None, iou_threshold
+        for candidate in unmatched:
+            if candidate["class_id"] == det["class_id"]:
+                iou = _box_iou(det["box"], candidate["box"])
+                if iou >= best_iou:
+                    best, best_iou = candidate, iou
+        if best is not None:
+            unmatched.remove(best)
+            matched += 1
+    return matched / max(len(expected), len(actual))
+
+
+def _export_yolo(eager, model_path, backend):
+    """Export model sang định dạng của `backend` bằng ultralytics (dùng lại file đã export nếu có)."""
+    from utils import inference
+
+    fmt, _, int8 = backend.partition("-")
+    weights = Path(model_path)
+    target = {"onnx": weights.with_suffix(".onnx"), "torchscript": weights.with_suffix(".torchscript"),
+              "openvino": weights.with_name(f"{weights.stem}_openvino_model")}[fmt]
+    if inference.INFERENCE_REEXPORT or not target.exists():
+        target = Path(eager.export(format=fmt, imgsz=640, dynamic=fmt == "onnx", verbose=False))
+    if int8:
+        quantized = target.with_name(f"{target.stem}.int8.onnx")
+        if inference.INFERENCE_REEXPORT or not quantized.exists():
+            inference.quantize_onnx_int8(target, quantized)
+        target = quantized
+    return target
+
+
+def _apply_backend(eager, model_path, backend, device):
+    """
+    Thay model PyTorch bằng bản export của `backend` sau khi so sánh detection với PyTorch trên ảnh kiểm tra.
+    Nếu không export được hoặc kết quả lệch quá ngưỡng thì giữ model PyTorch (kèm cảnh báo).
+    Returns:
+        (model, report)
+    """
+    from ultralytics import YOLO
+    from utils import inference
+
+    report = {"requested": backend, "backend": "pytorch", "threads": inference.configure_threads()}
+    if backend == "pytorch":
+        return eager, report
+    if backend not in YOLO_BACKENDS:
+        raise ModelLoadError(f"Unknown YOLO backend '{backend}', expected one of {YOLO_BACKENDS}")
+    if device != "cpu":
+        logging.info(f"YOLO chạy trên {device}, bỏ qua backend CPU '{backend}'.")
+        return eager, report
+    try:
+        path = _export_yolo(eager, model_path, backend)
+        candidate = YOLO(str(path), task="detect")
+        if YOLO_VERIFY_IMAGES:
+            images = YOLO_VERIFY_IMAGES
+        else:
+            from ultralytics.utils import ASSETS
+            images = [str(p) for p in sorted(Path(ASSETS).glob("*.jpg"))]
+        expected = [detections_from_result(r) for r in eager(images, device=device, verbose=False)]
+        actual = [detections_from_result(r) for r in candidate(images, device=device, verbose=False)]
+    except Exception as e:
+        logging.warning(f"Không dùng được backend YOLO '{backend}', quay về PyTorch: {e}")
+        report["error"] = str(e)
+        return eager, report
+
+    report["agreement"] = min((detection_agreement(e, a) for e, a in zip(expected, actual)), default=1.0)
+    report["path"] = str(path)
+    report["ok"] = report["agreement"] >= YOLO_BACKEND_MIN_AGREEMENT
+    if not report["ok"]:
+        logging.warning(f"Backend YOLO '{backend}' lệch so với PyTorch (khớp {report['agreement']:.2f} "
+                        f"< {YOLO_BACKEND_MIN_AGREEMENT}), quay về PyTorch.")
+        return eager, report
+    report["backend"] = backend
+    logging.info(f"Dùng backend YOLO '{backend}' ({path}, khớp {report['agreement']:.2f} với PyTorch).")
+    return candidate, report
+
+
+def get_model(model_path=None, reload=False, backend=None):
+    """
+    Trả về model YOLO, tải ở lần gọi đầu tiên.
+    Args:
+        model_path: đường dẫn file weights (mặc định YOLO_MODEL_PATH)
+        reload: True nếu muốn tải lại model
+        backend: backend suy luận trên CPU (mặc định YOLO_BACKEND), được kiểm tra với PyTorch
+                 trước khi dùng (xem backend_report)
+    Returns:
+        (model, device)
+    Raises:
+        ModelLoadError: nếu không tải được model (thay vì thoát chương trình)
+    """
+    global model, device, backend_report
+    if model is not None and not reload:
+        return model, device
+    with _model_lock:
+        if model is not None and not reload:
+            return model, device
+        model_path = model_path or YOLO_MODEL_PATH
+        try:
+            import torch
+            from ultralytics import YOLO
+
+            loaded = YOLO(model_path)
+            device = "cuda" if torch.cuda.is_available() else "cpu"
+            loaded, report = _apply_backend(loaded, model_path, backend or YOLO_BACKEND, device)
+        except ModelLoadError:
+            raise
+        except Exception as e:
+            logging.error(f"Failed to load YOLO model: {e}")
+            raise ModelLoadError(f"Failed to load YOLO model '{model_path}': {e}") from e
+        model, backend_report = loaded, report
+        logging.info(f"YOLO model loaded on {device} ({report['backend']})")
+        return model, device
+
+
+def warm_up(model_path=None, img_size=640):
+    """
+    Tải model và chạy thử một frame rỗng để lần detect đầu tiên không bị chậm.
+    Raises:
+        ModelLoadError: nếu không tải được model
+    """
+    yolo, dev = get_model(model_path)
+    yolo(np.zeros((img_size, img_size, 3), dtype=np.uint8), device=dev, verbose=False)
 
 
 # =========================================================================================
@@ -60,11 +226,18 @@ def detect_video(video_path, save_output=False, output_path="output.mp4"):
         video_path: đường dẫn file video
         save_output: True nếu muốn lưu video kết quả
         output_path: đường dẫn lưu video đầu ra
+    Returns:
+        list[{"frame_index", "timestamp", "detections": [...]}] (xem detections_from_result),
+        dùng được cho occurrence_index.OccurrenceIndex.add_frames; None nếu không mở được video
+    Raises:
+        ModelLoadError: nếu không tải được model YOLO
     """
+    model, device = get_model()
     cap = cv2.VideoCapture(video_path)
     if not cap.isOpened():
         logging.error(f"Không thể mở video: {video_path}")
         return
+    video_fps = cap.get(cv2.CAP_PROP_FPS) or 25.0
     
     # Cấu hình writer nếu cần lưu output
     out = None
@@ -76,11 +249,13 @@ def detect_video(video_path, save_output=False, output_path="output.mp4"):
         out = cv2.VideoWriter(output_path, fourcc, fps, (width, height))
 
     frame_count = 0
+    frames = []
     start_time = time.time()
 
     # Đọc từng frame -> detect -> hiển thị
     while True:
-        ret, frame = cap.read()
+        with telemetry.span("decode"):
+            ret, frame = cap.read()
         if not ret:
             break  # Hết video
         
@@ -89,10 +264,17 @@ def detect_video(video_path, save_output=False, output_path="output.mp4"):
         frame_input = frame  # YOLOv8 tự resize được nếu bỏ qua bước trên
 
         # Chạy YOLO detect
-        results = model(frame_input, device=device, verbose=False)
+        with telemetry.span("infer", items=1):
+            results = model(frame_input, device=device, verbose=False)
+        frames.append({
+            "frame_index": frame_count,
+            "timestamp": frame_count / video_fps,
+            "detections": detections_from_result(results[0]),
+        })
 
         # Vẽ bounding box và label lên frame
-        annotated_frame = results[0].plot()
+        with telemetry.span("annotate", items=1):
+            annotated_frame = results[0].plot()
 
         # Lưu video nếu cần
         if save_output:
@@ -116,10 +298,270 @@ def detect_video(video_path, save_output=False, output_path="output.mp4"):
     if out:
         out.release()
     cv2.destroyAllWindows()
+    return frames
+
+
+# =========================================================================================
+# Structured detections + adaptive sampling
+# =========================================================================================
+def detections_from_result(result):
+    """
+    Chuyển kết quả YOLO của một ảnh thành danh sách dict thay vì ảnh đã vẽ box.
+    Returns:
+        list[{"class": str, "class_id": int, "confidence": float, "box": [x1, y1, x2, y2]}]
+    """
+    boxes = result.boxes
+    if boxes is None or len(boxes) == 0:
+        return []
+    xyxy = boxes.xyxy.cpu().numpy()
+    conf = boxes.conf.cpu().numpy()
+    cls = boxes.cls.cpu().numpy().astype(int)
+    names = result.names
+    return [
+        {"class": names[c], "class_id": int(c), "confidence": float(p), "box": [float(v) for v in b]}
+        for b, p, c in zip(xyxy, conf, cls)
+    ]
+
+
+def detect_video_sampled(video_path, mode="scene", batch_size=8, **sampling_kwargs):
+    """
+    Nhận diện đối tượng chỉ trên các frame đại diện (xem frame_sampling.iter_sampled_frames),
+    kết quả được gắn với đoạn thời gian mà frame đó đại diện.
+    Args:
+        video_path: đường dẫn file video
+        mode: 'all' | 'stride' | 'fps' | 'scene' | 'keyframe'
+        batch_size: số frame đại diện gộp vào một lần gọi YOLO
+        **sampling_kwargs: stride, target_fps, hist_threshold, diff_threshold, max_gap_seconds
+    Returns:
+        list[{"frame_index", "start_time", "end_time", "detections"}]
+    Raises:
+        ModelLoadError: nếu không tải được model YOLO
+    """
+    model, device = get_model()
+    segments = []
+    batch_segments, batch_frames = [], []
+
+    def flush():
+        if not batch_frames:
+            return
+        with telemetry.span("infer", items=len(batch_frames)):
+            results = model(batch_frames, device=device, verbose=False)
+        for segment, result in zip(batch_segments, results):
+            segment["detections"] = detections_from_result(result)
+            segments.append(segment)
+        batch_segments.clear()
+        batch_frames.clear()
+
+    start_time = time.time()
+    for segment, frame in sample_segments(video_path, mode=mode, **sampling_kwargs):
+        batch_segments.append(segment)
+        batch_frames.append(frame)
+        if len(batch_frames) >= batch_size:
+            flush()
+    flush()
+
+    elapsed = time.time() - start_time
+    logging.info(f"Detected {len(segments)} representative frames ({mode}) in {elapsed:.2f}s")
+    return segments
+
+
+# =========================================================================================
+# Pipelined, headless detection
+# decode thread -> queue (có giới hạn) -> YOLO theo batch -> (tùy chọn) vẽ box + ghi video
+# =========================================================================================
+_END = object()  # sentinel báo hết dữ liệu giữa các stage
+_POLL_SECONDS = 0.1  # chu kỳ kiểm tra cờ dừng khi chờ hàng đợi
+
+
+class _StageTimer:
+    """Đo thời gian bận và số frame xử lý của một stage."""
+
+    def __init__(self):
+        self.busy = 0.0
+        self.frames = 0
+
+    def report(self):
+        return {
+            "frames": self.frames,
+            "busy_seconds": round(self.busy, 4),
+            "fps": round(self.frames / self.busy, 2) if self.busy > 0 else None,
+        }
+
+
+def _put(q, item, stop):
+    """Đưa item vào hàng đợi; bỏ cuộc khi pipeline được yêu cầu dừng. Trả về False nếu đã dừng."""
+    while not stop.is_set():
+        try:
+            q.put(item, timeout=_POLL_SECONDS)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+def _get(q, stop):
+    """Lấy item từ hàng đợi; trả về _END khi pipeline được yêu cầu dừng."""
+    while not stop.is_set():
+        try:
+            return q.get(timeout=_POLL_SECONDS)
+        except queue.Empty:
+            continue
+    return _END
+
+
+def _decode_worker(video_path, frame_queue, timer, errors, sampling, stop):
+    frames = None
+    try:
+        frames = iter_sampled_frames(video_path, **sampling)
+        while True:
+            t0 = time.perf_counter()
+            item = next(frames, _END)
+            elapsed = time.perf_counter() - t0
+            timer.busy += elapsed
+            if not _put(frame_queue, item, stop) or item is _END:
+                break
+            timer.frames += 1
+            telemetry.observe("decode", elapsed, items=1)
+    except Exception as e:
+        errors.append(e)
+        stop.set()
+    finally:
+        # Đóng generator để giải phóng VideoCapture cả khi dừng giữa chừng
+        if frames is not None:
+            frames.close()
+
+
+def _annotate_worker(annotate_queue, writer, timer, errors, stop):
+    try:
+        while True:
+            item = _get(annotate_queue, stop)
+            if item is _END:
+                break
+            t0 = time.perf_counter()
+            for result in item:
+                writer.write(result.plot())
+                timer.frames += 1
+            elapsed = time.perf_counter() - t0
+            timer.busy += elapsed
+            telemetry.observe("annotate", elapsed, items=len(item))
+    except Exception as e:
+        errors.append(e)
+        stop.set()
+
+
+def detect_video_pipelined(video_path, batch_size=8, queue_size=64, output_path=None, sampling=None,
+                           on_frames=None):
+    """
+    Nhận diện đối tượng không cần màn hình (chạy được trong container), các stage chạy chồng lên nhau:
+    - một thread giải mã frame vào hàng đợi có giới hạn `queue_size`,
+    - frame được gộp thành batch `batch_size` cho một lần gọi YOLO,
+    - vẽ box + ghi video là stage tùy chọn ở thread riêng (chỉ khi có `output_path`).
+    Args:
+        video_path: đường dẫn file video
+        batch_size: số frame mỗi lần gọi YOLO
+        queue_size: kích thước tối đa hàng đợi frame đã giải mã
+        output_path: nếu khác None, ghi video đã vẽ box ra file này
+        sampling: dict tham số cho frame_sampling.iter_sampled_frames (mặc định mọi frame)
+        on_frames: nếu khác None, được gọi với danh sách frame của mỗi batch ngay khi YOLO xong;
+                   khi đó các frame không được giữ lại ("frames" rỗng), bộ nhớ không tăng theo độ dài video
+    Returns:
+        dict {
+            "frames": [{"frame_index", "timestamp", "detections": [{"class", "class_id", "confidence", "box"}]}],
+            "stats": {"decode": {...}, "infer": {...}, "annotate": {...}, "wall_seconds", "fps"}
+        }
+    Lỗi ở bất kỳ stage nào (kể cả `model` hoặc `on_frames`) đặt cờ dừng chung, các thread còn lại
+    thoát khỏi hàng đợi và được join trước khi lỗi được ném lại.
+    Raises:
+        ModelLoadError: nếu không tải được model YOLO
+        IOError: nếu không mở được video
+    """
+    model, device = get_model()
+    sampling = dict(sampling or {"mode": "all"})
+
+    cap = cv2.VideoCapture(str(video_path))
+    if not cap.isOpened():
+        raise IOError(f"Không thể mở video: {video_path}")
+    fps = cap.get(cv2.CAP_PROP_FPS) or 25.0
+    size = (int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)), int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)))
+    cap.release()
+
+    timers = {"decode": _StageTimer(), "infer": _StageTimer(), "annotate": _StageTimer()}
+    errors = []
+    stop = threading.Event()
+    frame_queue = queue.Queue(maxsize=queue_size)
+    decoder = threading.Thread(target=_decode_worker, name="yolo-decode", daemon=True,
+                               args=(video_path, frame_queue, timers["decode"], errors, sampling, stop))
+
+    writer = annotator = annotate_queue = None
+    if output_path is not None:
+        writer = cv2.VideoWriter(str(output_path), cv2.VideoWriter_fourcc(*'mp4v'), fps, size)
+        annotate_queue = queue.Queue(maxsize=max(1, queue_size // batch_size))
+        annotator = threading.Thread(target=_annotate_worker, name="yolo-annotate", daemon=True,
+                                     args=(annotate_queue, writer, timers["annotate"], errors, stop))
+        annotator.start()
+
+    frames = []
+    n_frames = 0
+    wall_start = time.perf_counter()
+    decoder.start()
+
+    batch = []
+    done = False
+    try:
+        while not done:
+            item = _get(frame_queue, stop)
+            if item is _END:
+                done = True
+            else:
+                batch.append(item)
+            if batch and (len(batch) >= batch_size or done) and not stop.is_set():
+                t0 = time.perf_counter()
+                results = model([f for _, _, f in batch], device=device, verbose=False)
+                elapsed = time.perf_counter() - t0
+                timers["infer"].busy += elapsed
+                telemetry.observe("infer", elapsed, items=len(batch))
+                timers["infer"].frames += len(batch)
+                batch_frames = [
+                    {"frame_index": frame_index, "timestamp": timestamp, "detections": detections_from_result(result)}
+                    for (frame_index, timestamp, _), result in zip(batch, results)
+                ]
+                n_frames += len(batch_frames)
+                if on_frames is not None:
+                    on_frames(batch_frames)
+                else:
+                    frames.extend(batch_frames)
+                if annotate_queue is not None:
+                    _put(annotate_queue, results, stop)
+                batch = []
+        if annotate_queue is not None:
+            _put(annotate_queue, _END, stop)
+    except BaseException:
+        # Lỗi ở stage suy luận: báo các thread còn lại dừng để không bị chặn trên hàng đợi
+        stop.set()
+        raise
+    finally:
+        decoder.join()
+        if annotator is not None:
+            annotator.join()
+            writer.release()
+    if errors:
+        raise errors[0]
+
+    wall = time.perf_counter() - wall_start
+    stats = {name: timer.report() for name, timer in timers.items()}
+    stats["wall_seconds"] = round(wall, 4)
+    stats["fps"] = round(n_frames / wall, 2) if wall > 0 else None
+    logging.info(
+        f"Processed {n_frames} frames in {wall:.2f}s ({stats['fps']} FPS) - "
+        f"decode {stats['decode']['fps']} FPS, infer {stats['infer']['fps']} FPS, "
+        f"annotate {stats['annotate']['fps']} FPS"
+    )
+    return {"frames": frames, "stats": stats}
 
 
 # =========================================================================================
 # Run main
 # =========================================================================================
+# Chạy như module để import tương đối hoạt động: python -m functions.object_detection (từ thư mục module)
 if __name__ == "__main__":
     detect_video(r"database\data\6907708323293.mp4", save_output=False)
@@ -0,0 +1,405 @@
+import json
+import logging
+import unicodedata
+from pathlib import Path
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+OCCURRENCE_FORMAT_VERSION = 1
+
+# Từ khóa `object` do extract_keywords trả về thường là tiếng Việt, còn nhãn YOLO (COCO) là tiếng Anh
+LABEL_ALIASES = {
+    "người": "person", "con người": "person", "người đi bộ": "person",
+    "chó": "dog", "con chó": "dog", "mèo": "cat", "con mèo": "cat",
+    "chim": "bird", "ngựa": "horse", "bò": "cow", "cừu": "sheep", "voi": "elephant",
+    "xe đạp": "bicycle", "xe máy": "motorcycle", "xe hơi": "car", "ô tô": "car", "xe ô tô": "car",
+    "xe buýt": "bus", "xe bus": "bus", "xe tải": "truck", "tàu hỏa": "train", "máy bay": "airplane",
+    "thuyền": "boat", "ghế": "chair", "bàn": "dining table", "điện thoại": "cell phone",
+    "máy tính xách tay": "laptop", "ti vi": "tv", "tivi": "tv", "bánh kem": "cake", "ô": "umbrella",
+    "đèn giao thông": "traffic light", "chai": "bottle", "cốc": "cup", "sách": "book",
+}
+
+
+def normalize_label(label) -> str:
+    """Chuẩn hóa nhãn (NFC, chữ thường, gộp khoảng trắng) rồi đổi bí danh tiếng Việt sang nhãn YOLO."""
+    label = " ".join(unicodedata.normalize("NFC", str(label)).lower().split())
+    return LABEL_ALIASES.get(label, label)
+
+
+def merge_intervals(starts, ends, gap: float = 0.0):
+    """
+    Gộp các khoảng [start, end] chồng nhau hoặc cách nhau không quá `gap` giây.
+    Returns:
+        (starts, ends, group) - các khoảng đã gộp (đã sắp xếp, rời nhau) và chỉ số khoảng gộp của từng khoảng đầu vào
+        (theo thứ tự đã sắp xếp theo start)
+    """
+    starts = np.asarray(starts, dtype=np.float64)
+    ends = np.asarray(ends, dtype=np.float64)
+    if starts.shape[0] == 0:
+        return starts, ends, np.empty(0, dtype=np.int64)
+    order = np.argsort(starts, kind="stable")
+    starts, ends = starts[order], ends[order]
+    reach = np.maximum.accumulate(ends)
+    new = np.concatenate([[True], starts[1:] > reach[:-1] + gap])
+    group = np.cumsum(new) - 1
+    first = np.flatnonzero(new)
+    last = np.concatenate([first[1:], [starts.shape[0]]]) - 1
+    return starts[first], reach[last], group
+
+
+def intersect_intervals(a_starts, a_ends, b_starts, b_ends):
+    """
+    Giao của hai danh sách khoảng đã sắp xếp và rời nhau (vector hóa bằng searchsorted).
+    Returns:
+        (starts, ends) của các khoảng giao, đã sắp xếp
+    """
+    lo = np.searchsorted(b_ends, a_starts, side="left")
+    hi = np.searchsorted(b_starts, a_ends, side="right")
+    counts = np.maximum(hi - lo, 0)
+    total = int(counts.sum())
+    if total == 0:
+        return np.empty(0), np.empty(0)
+    a_idx = np.repeat(np.arange(a_starts.shape[0]), counts)
+    b_idx = np.arange(total) - np.repeat(np.cumsum(counts) - counts, counts) + np.repeat(lo, counts)
+    return np.maximum(a_starts[a_idx], b_starts[b_idx]), np.minimum(a_ends[a_idx], b_ends[b_idx])
+
+
+class OccurrenceIndex:
+    """
+    Chỉ mục thời gian của các đối tượng YOLO: nhãn -> video -> các khoảng thời gian đã gộp,
+    mỗi khoảng kèm số detection và confidence lớn nhất.
+
+    - Detection của cùng một nhãn cách nhau không quá `max_gap` giây được gộp thành một khoảng.
+    - `co_occurrences(["person", "dog"], window=5)` tìm các video có người và chó trong cùng một
+      cửa sổ 5 giây bằng phép giao khoảng.
+    - `search` / `search_keywords` trả về `(ids, scores)` với id là `contents.id` (int64) như các
+      index của hybrid-search, để đưa thẳng vào `reciprocal_rank_fusion`. Id video dạng chuỗi
+      (vd. `video_id` do main.py ghi) được đổi qua `id_map`.
+    """
+
+    def __init__(self, max_gap: float = 1.0, min_confidence: float = 0.0, id_map: dict = None):
+        self.max_gap = float(max_gap)
+        self.min_confidence = float(min_confidence)
+        self.id_map = {}           # id video (chuỗi) -> contents.id
+        self.map_ids(id_map or {})
+
+        self.labels = []           # label id -> nhãn
+        self._label_ids = {}
+        self.video_ids = []        # video ordinal -> id ngoài (contents.id hoặc video_id của main.py)
+        self._video_ords = {}
+
+        # Các khoảng đã gộp, sắp xếp theo (label, video, start)
+        self.iv_label = np.empty(0, dtype=np.int64)
+        self.iv_video = np.empty(0, dtype=np.int64)
+        self.iv_start = np.empty(0, dtype=np.float64)
+        self.iv_end = np.empty(0, dtype=np.float64)
+        self.iv_count = np.empty(0, dtype=np.int64)
+        self.iv_conf = np.empty(0, dtype=np.float32)
+        self._postings = {}        # label id -> {video ordinal: (lo, hi)} trong các mảng iv_*
+
+        self._pending = []         # (label id, video ordinal, start, end, confidence)
+        self.ingested = {}         # video_id -> [size, mtime_ns] của phân vùng đã nạp bằng add_dataset
+
+    def __len__(self) -> int:
+        """Số khoảng đã gộp."""
+        return int(self.iv_start.shape[0])
+
+    # ------------------------------------------------------------------
+    # Build
+    # ------------------------------------------------------------------
+    def _label_id(self, label) -> int:
+        label = normalize_label(label)
+        if label not in self._label_ids:
+            self._label_ids[label] = len(self.labels)
+            self.labels.append(label)
+        return self._label_ids[label]
+
+    def _video_ord(self, video_id) -> int:
+        if video_id not in self._video_ords:
+            self._video_ords[video_id] = len(self.video_ids)
+            self.video_ids.append(video_id)
+        return self._video_ords[video_id]
+
+    def map_ids(self, id_map: dict):
+        """Gán `contents.id` cho các id video dạng chuỗi (vd. `video_id` trong dataset của main.py)."""
+        self.id_map.update({video: int(content_id) for video, content_id in id_map.items()})
+        return self
+
+    def content_id(self, video_id):
+        """`contents.id` của một video: chính id đó nếu là số nguyên, nếu không thì tra `id_map` (None nếu chưa gán)."""
+        if isinstance(video_id, (int, np.integer)):
+            return int(video_id)
+        return self.id_map.get(video_id)
+
+    def add_detection(self, video_id, label, start: float, end: float = None, confidence: float = 1.0):
+        """Thêm một detection (thời điểm `start`, hoặc khoảng [start, end] nếu frame đại diện cho cả đoạn)."""
+        if confidence < self.min_confidence:
+            return
+        end = start if end is None else end
+        self._pending.append((self._label_id(label), self._video_ord(video_id), float(start), float(end),
+                              float(confidence)))
+
+    def add_frames(self, video_id, frames):
+        """
+        Thêm kết quả của `detect_video_pipelined` / `detect_video`.
+        Args:
+            frames: list[{"timestamp", "detections": [{"class", "confidence", ...}]}]
+        """
+        for frame in frames:
+            for det in frame["detections"]:
+                self.add_detection(video_id, det["class"], frame["timestamp"], confidence=det["confidence"])
+        return self
+
+    def add_segments(self, video_id, segments):
+        """
+        Thêm kết quả của `detect_video_sampled`: detection của frame đại diện phủ cả đoạn [start_time, end_time].
+        """
+        for segment in segments:
+            end = segment["end_time"] if segment["end_time"] is not None else segment["start_time"]
+            for det in segment["detections"]:
+                self.add_detection(video_id, det["class"], segment["start_time"], end, det["confidence"])
+        return self
+
+    def add_dataset(self, path):
+        """
+        Thêm detections từ dataset do `main.py` ghi ra (`video_id=<id>/part-0.parquet|arrow`).
+        Chỉ đọc các phân vùng đã hoàn tất (có marker `_SUCCESS`). Gọi lại trên cùng dataset không
+        đếm trùng: phân vùng không đổi được bỏ qua, phân vùng đã ghi lại (nhận diện lại) thay thế
+        toàn bộ khoảng cũ của video đó.
+        """
+        import pyarrow as pa
+        import pyarrow.ipc as ipc
+        import pyarrow.parquet as pq
+
+        columns = ["timestamp", "class", "confidence"]
+        for part in sorted(Path(path).glob("video_id=*/part-0.*")):
+            if not (part.parent / "_SUCCESS").exists():
+                continue
+            vid = part.parent.name.split("=", 1)[1]
+            stat = part.stat()
+            signature = [stat.st_size, stat.st_mtime_ns]
+            if self.ingested.get(vid) == signature:
+                continue
+            self.remove_video(vid)
+            if part.suffix == ".parquet":
+                table = pq.read_table(part, columns=columns)
+            else:
+                with pa.memory_map(str(part)) as source:
+                    table = ipc.open_file(source).read_all().select(columns)
+            data = table.to_pydict()
+            for ts, label, conf in zip(data["timestamp"], data["class"], data["confidence"]):
+                self.add_detection(vid, label, ts, confidence=conf)
+            self.ingested[vid] = signature
+        return self
+
+    def remove_video(self, video_id) -> int:
+        """Xóa mọi khoảng của một video (vd. trước khi nhận diện lại). Returns: số khoảng đã xóa."""
+        video = self._video_ords.get(video_id)
+        if video is None:
+            return 0
+        self._pending = [p for p in self._pending if p[1] != video]
+        keep = self.iv_video != video
+        removed = int((~keep).sum())
+        if removed:
+            self._set_intervals(self.iv_label[keep], self.iv_video[keep], self.iv_start[keep],
+                                self.iv_end[keep], self.iv_count[keep], self.iv_conf[keep])
+        return removed
+
+    def commit(self):
+        """Gộp các detection đang chờ với các khoảng hiện có."""
+        if not self._pending:
+            return self
+        pending = np.array([p[:4] for p in self._pending], dtype=np.float64).reshape(-1, 4)
+        labels = np.concatenate([self.iv_label, pending[:, 0].astype(np.int64)])
+        videos = np.concatenate([self.iv_video, pending[:, 1].astype(np.int64)])
+        starts = np.concatenate([self.iv_start, pending[:, 2]])
+        ends = np.concatenate([self.iv_end, pending[:, 3]])
+        counts = np.concatenate([self.iv_count, np.ones(pending.shape[0], dtype=np.int64)])
+        confs = np.concatenate([self.iv_conf, np.array([p[4] for p in self._pending], dtype=np.float32)])
+
+        order = np.lexsort((starts, videos, labels))
+        labels, videos, starts, ends = labels[order], videos[order], starts[order], ends[order]
+        counts, confs = counts[order], confs[order]
+
+        # Mỗi nhóm (label, video) nằm liền nhau; gộp khoảng trong từng nhóm
+        boundary = np.flatnonzero(np.diff(labels) | np.diff(videos)) + 1
+        bounds = np.concatenate([[0], boundary, [labels.shape[0]]])
+        out = {name: [] for name in ("label", "video", "start", "end", "count", "conf")}
+        for lo, hi in zip(bounds[:-1], bounds[1:]):
+            m_starts, m_ends, group = merge_intervals(starts[lo:hi], ends[lo:hi], self.max_gap)
+            out["label"].append(np.full(m_starts.shape[0], labels[lo], dtype=np.int64))
+            out["video"].append(np.full(m_starts.shape[0], videos[lo], dtype=np.int64))
+            out["start"].append(m_starts)
+            out["end"].append(m_ends)
+            out["count"].append(np.bincount(group, weights=counts[lo:hi]).astype(np.int64))
+            merged_conf = np.zeros(m_starts.shape[0], dtype=np.float32)
+            np.maximum.at(merged_conf, group, confs[lo:hi])
+            out["conf"].append(merged_conf)
+
+        n_pending = len(self._pending)
+        self._pending = []
+        self._set_intervals(*(np.concatenate(out[name]) for name in ("label", "video", "start", "end", "count", "conf")))
+        logger.info(f"Đã gộp {n_pending} detection thành {len(self)} khoảng ({len(self.labels)} nhãn, "
+                    f"{len(self.video_ids)} video).")
+        return self
+
+    def _set_intervals(self, labels, videos, starts, ends, counts, confs):
+        self.iv_label, self.iv_video, self.iv_start, self.iv_end = labels, videos, starts, ends
+        self.iv_count, self.iv_conf = counts, confs
+        self._postings = {}
+        if labels.shape[0] == 0:
+            return
+        boundary = np.flatnonzero(np.diff(labels) | np.diff(videos)) + 1
+        bounds = np.concatenate([[0], boundary, [labels.shape[0]]])
+        for lo, hi in zip(bounds[:-1].tolist(), bounds[1:].tolist()):
+            self._postings.setdefault(int(labels[lo]), {})[int(videos[lo])] = (lo, hi)
+
+    # ------------------------------------------------------------------
+    # Queries
+    # ------------------------------------------------------------------
+    def _spans(self, label, min_confidence: float = 0.0) -> dict:
+        """video ordinal -> (starts, ends) của một nhãn, bỏ các khoảng có confidence < min_confidence."""
+        self.commit()
+        label_id = self._label_ids.get(normalize_label(label))
+        if label_id is None:
+            return {}
+        spans = {}
+        for video, (lo, hi) in self._postings.get(label_id, {}).items():
+            keep = self.iv_conf[lo:hi] >= min_confidence
+            if keep.any():
+                spans[video] = (self.iv_start[lo:hi][keep], self.iv_end[lo:hi][keep])
+        return spans
+
+    def summary(self, label) -> dict:
+        """
+        Returns:
+            {video_id: {"count", "max_confidence", "duration", "intervals": [(start, end, count, max_confidence)]}}
+        """
+        self.commit()
+        label_id = self._label_ids.get(normalize_label(label))
+        result = {}
+        for video, (lo, hi) in self._postings.get(label_id, {}).items():
+            intervals = list(zip(self.iv_start[lo:hi].tolist(), self.iv_end[lo:hi].tolist(),
+                                 self.iv_count[lo:hi].tolist(), self.iv_conf[lo:hi].tolist()))
+            result[self.video_ids[video]] = {
+                "count": int(self.iv_count[lo:hi].sum()),
+                "max_confidence": float(self.iv_conf[lo:hi].max()),
+                "duration": float((self.iv_end[lo:hi] - self.iv_start[lo:hi]).sum()),
+                "intervals": intervals,
+            }
+        return result
+
+    def videos(self, label, min_count: int = 1, min_confidence: float = 0.0) -> list:
+        """Các video có nhãn `label` với ít nhất `min_count` detection."""
+        self.commit()
+        label_id = self._label_ids.get(normalize_label(label))
+        return [self.video_ids[video] for video, (lo, hi) in self._postings.get(label_id, {}).items()
+                if self.iv_count[lo:hi].sum() >= min_count and self.iv_conf[lo:hi].max() >= min_confidence]
+
+    def co_occurrences(self, labels, window: float = 5.0, min_confidence: float = 0.0) -> dict:
+        """
+        Tìm các đoạn mà mọi nhãn trong `labels` cùng xuất hiện trong một cửa sổ dài `window` giây.
+
+        Cửa sổ [t, t + window] chạm khoảng [s, e] khi t thuộc [s - window, e], nên tập các điểm bắt
+        đầu hợp lệ của mỗi nhãn là hợp các khoảng [s - window, e]; giao các tập này giữa các nhãn
+        cho ra các cửa sổ thỏa mãn.
+        Returns:
+            {video_id: [(start, end), ...]} - các đoạn (mỗi đoạn dài ít nhất `window` giây)
+        """
+        labels = list(dict.fromkeys(normalize_label(label) for label in labels))
+        if not labels:
+            return {}
+        per_label = [self._spans(label, min_confidence) for label in labels]
+        videos = set(per_label[0])
+        for spans in per_label[1:]:
+            videos &= spans.keys()
+
+        result = {}
+        for video in sorted(videos):
+            starts, ends = None, None
+            for spans in per_label:
+                s, e, _ = merge_intervals(spans[video][0] - window, spans[video][1])
+                starts, ends = (s, e) if starts is None else intersect_intervals(starts, ends, s, e)
+                if starts.shape[0] == 0:
+                    break
+            if starts.shape[0]:
+                # Cửa sổ không bắt đầu trước đầu video
+                result[self.video_ids[video]] = list(zip(np.maximum(starts, 0.0).tolist(), (ends + window).tolist()))
+        return result
+
+    def search(self, labels, window: float = 5.0, k: int = None, min_confidence: float = 0.0):
+        """
+        Danh sách ứng viên cho hybrid search: các video chứa mọi nhãn trong cùng một cửa sổ,
+        xếp hạng theo tổng thời lượng các đoạn cùng xuất hiện.
+        Returns:
+            (ids, scores) - `contents.id` dạng int64 và score giảm dần; video chưa có trong `id_map` bị bỏ qua
+        """
+        matches = self.co_occurrences(labels, window, min_confidence)
+        ids, scores = [], []
+        for video, spans in matches.items():
+            content_id = self.content_id(video)
+            if content_id is not None:
+                ids.append(content_id)
+                scores.append(sum(end - start for start, end in spans))
+        if len(ids) < len(matches):
+            logger.warning(f"{len(matches) - len(ids)} video khớp nhưng chưa có contents.id trong id_map, bị bỏ qua.")
+        ids = np.array(ids, dtype=np.int64)
+        scores = np.array(scores, dtype=np.float64)
+        order = np.argsort(-scores, kind="stable")[:k]
+        return ids[order], scores[order]
+
+    def search_keywords(self, keywords, window: float = 5.0, k: int = None, min_confidence: float = 0.0):
+        """
+        Tìm theo trường `object` của extract_keywords (chuỗi hoặc list, dict hoặc chuỗi JSON).
+        Đối tượng không có trong index (YOLO không nhận diện được) bị bỏ qua.
+        """
+        if isinstance(keywords, str):
+            keywords = json.loads(keywords)
+        objects = (keywords or {}).get("object") or []
+        objects = [objects] if isinstance(objects, str) else list(objects)
+        labels = [normalize_label(o) for o in objects if normalize_label(o) in self._label_ids]
+        if not labels:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float64)
+        return self.search(labels, window, k, min_confidence)
+
+    # ------------------------------------------------------------------
+    # Persistence
+    # ------------------------------------------------------------------
+    def save(self, path):
+        """Lưu index vào một thư mục (`intervals.npz` + `meta.json`)."""
+        self.commit()
+        path = Path(path)
+        path.mkdir(parents=True, exist_ok=True)
+        np.savez(path / "intervals.npz", label=self.iv_label, video=self.iv_video, start=self.iv_start,
+                 end=self.iv_end, count=self.iv_count, conf=self.iv_conf)
+        meta = {
+            "format_version": OCCURRENCE_FORMAT_VERSION,
+            "max_gap": self.max_gap,
+            "min_confidence": self.min_confidence,
+            "labels": self.labels,
+            "video_ids": [v.item() if isinstance(v, np.generic) else v for v in self.video_ids],
+            "id_map": self.id_map,
+            "ingested": self.ingested,
+        }
+        (path / "meta.json").write_text(json.dumps(meta, ensure_ascii=False), encoding="utf-8")
+        logger.info(f"Đã lưu occurrence index ({len(self)} khoảng) vào '{path}'.")
+
+    @classmethod
+    def load(cls, path):
+        """Tải index đã lưu bằng `save`."""
+        path = Path(path)
+        meta = json.loads((path / "meta.json").read_text(encoding="utf-8"))
+        if meta.get("format_version") != OCCURRENCE_FORMAT_VERSION:
+            raise ValueError(f"Unsupported occurrence index format version: {meta.get('format_version')}")
+        index = cls(max_gap=meta["max_gap"], min_confidence=meta["min_confidence"], id_map=meta.get("id_map"))
+        index.labels = meta["labels"]
+        index._label_ids = {label: i for i, label in enumerate(index.labels)}
+        index.video_ids = meta["video_ids"]
+        index._video_ords = {video: i for i, video in enumerate(index.video_ids)}
+        index.ingested = meta.get("ingested", {})
+        with np.load(path / "intervals.npz") as data:
+            index._set_intervals(data["label"], data["video"], data["start"], data["end"], data["count"],
+                                 data["conf"])
+        return index
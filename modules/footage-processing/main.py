@@ -0,0 +1,322 @@
+"""
+Footage ingestion farm: chạy nhận diện đối tượng trên cả một thư mục (hoặc manifest) video
+bằng một process pool, ghi kết quả dạng cột (Parquet / Arrow IPC) phân vùng theo video.
+
+Ví dụ:
+    python main.py database/data --output detections --workers 4 --threads-per-worker 2
+"""
+import argparse
+import hashlib
+import json
+import logging
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+
+# Cho phép import các module dùng chung trong ./modules (vd. etl.extract.classify_file)
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+
+from etl.extract.classify_file import VIDEO_EXT  # noqa: E402
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(processName)s - %(levelname)s - %(message)s")
+logger = logging.getLogger(__name__)
+
+SUCCESS_MARKER = "_SUCCESS"
+ROW_GROUP_SIZE = 10000
+OUTPUT_FORMATS = {"parquet": "part-0.parquet", "arrow": "part-0.arrow"}
+
+
+# =========================================================================================
+# Input discovery
+# =========================================================================================
+def discover_videos(source):
+    """
+    Liệt kê video từ một thư mục (đệ quy) hoặc một manifest.
+    Manifest có thể là file .txt (mỗi dòng một đường dẫn) hoặc .json (list đường dẫn).
+    Returns:
+        list[Path] đã sắp xếp, không trùng lặp
+    """
+    source = Path(source)
+    if source.is_dir():
+        paths = (p for p in source.rglob("*") if p.is_file() and p.suffix.lower() in VIDEO_EXT)
+    elif source.suffix.lower() == ".json":
+        paths = (Path(p) for p in json.loads(source.read_text(encoding="utf-8")))
+    else:
+        lines = source.read_text(encoding="utf-8").splitlines()
+        paths = (Path(line.strip()) for line in lines if line.strip() and not line.startswith("#"))
+    return sorted({p.resolve() for p in paths})
+
+
+def video_id(path: Path) -> str:
+    """Id ổn định cho một video: tên file + hash ngắn của đường dẫn tuyệt đối."""
+    digest = hashlib.sha1(str(Path(path).resolve()).encode("utf-8")).hexdigest()[:10]
+    return f"{Path(path).stem}-{digest}"
+
+
+def partition_dir(output_dir: Path, vid: str) -> Path:
+    return Path(output_dir) / f"video_id={vid}"
+
+
+def is_complete(output_dir: Path, vid: str) -> bool:
+    return (partition_dir(output_dir, vid) / SUCCESS_MARKER).exists()
+
+
+# =========================================================================================
+# Worker process
+# =========================================================================================
+def _init_worker(threads_per_worker: int, model_path):
+    """
+    Khởi tạo mỗi worker: cố định số thread của torch/OpenCV để các worker không tranh nhau CPU,
+    rồi tải model YOLO đúng một lần cho worker đó.
+    """
+    os.environ["OMP_NUM_THREADS"] = str(threads_per_worker)
+    os.environ["MKL_NUM_THREADS"] = str(threads_per_worker)
+    import cv2
+    import torch
+
+    torch.set_num_threads(threads_per_worker)
+    try:
+        torch.set_num_interop_threads(1)
+    except RuntimeError:
+        pass  # chỉ gọi được trước khi torch bắt đầu chạy song song
+    cv2.setNumThreads(1)
+
+    from functions import object_detection
+    object_detection.get_model(model_path)
+
+
+DETECTION_COLUMNS = ("video_id", "video_path", "frame_index", "timestamp", "class", "class_id", "confidence",
+                     "x1", "y1", "x2", "y2")
+
+
+class ColumnarWriter:
+    """
+    Ghi detections của một video theo từng record batch ngay khi chúng được tạo ra (Parquet hoặc
+    Arrow IPC), nên bộ nhớ chỉ phụ thuộc ROW_GROUP_SIZE chứ không phụ thuộc độ dài video.
+    File được ghi vào `.tmp` và chỉ đổi tên nguyên tử khi `close()`; `abort()` xóa file dở dang.
+    """
+
+    def __init__(self, video_path: Path, vid: str, out_dir: Path, fmt: str):
+        import pyarrow as pa
+
+        self._pa = pa
+        self.video_path = str(video_path)
+        self.vid = vid
+        self.schema = pa.schema([
+            ("video_id", pa.string()),
+            ("video_path", pa.string()),
+            ("frame_index", pa.int64()),
+            ("timestamp", pa.float64()),
+            ("class", pa.string()),
+            ("class_id", pa.int32()),
+            ("confidence", pa.float32()),
+            ("x1", pa.float32()),
+            ("y1", pa.float32()),
+            ("x2", pa.float32()),
+            ("y2", pa.float32()),
+        ])
+        self.final_path = out_dir / OUTPUT_FORMATS[fmt]
+        self.tmp_path = self.final_path.with_suffix(self.final_path.suffix + ".tmp")
+        self.n_rows = 0
+        self._columns = {name: [] for name in DETECTION_COLUMNS}
+        if fmt == "parquet":
+            import pyarrow.parquet as pq
+            self._sink = None
+            self._writer = pq.ParquetWriter(self.tmp_path, self.schema, compression="zstd")
+        else:
+            import pyarrow.ipc as ipc
+            self._sink = pa.OSFile(str(self.tmp_path), "wb")
+            self._writer = ipc.new_file(self._sink, self.schema)
+
+    def write_frames(self, frames):
+        """Thêm detections của một lô frame `[{"frame_index", "timestamp", "detections"}]`."""
+        columns = self._columns
+        for frame in frames:
+            for det in frame["detections"]:
+                columns["video_id"].append(self.vid)
+                columns["video_path"].append(self.video_path)
+                columns["frame_index"].append(frame["frame_index"])
+                columns["timestamp"].append(frame["timestamp"])
+                columns["class"].append(det["class"])
+                columns["class_id"].append(det["class_id"])
+                columns["confidence"].append(det["confidence"])
+                for name, value in zip(("x1", "y1", "x2", "y2"), det["box"]):
+                    columns[name].append(value)
+        if len(columns["video_id"]) >= ROW_GROUP_SIZE:
+            self._flush()
+
+    def _flush(self):
+        if not self._columns["video_id"]:
+            return
+        batch = self._pa.record_batch(self._columns, schema=self.schema)
+        self._writer.write_batch(batch)
+        self.n_rows += batch.num_rows
+        self._columns = {name: [] for name in DETECTION_COLUMNS}
+
+    def _close_writer(self):
+        self._writer.close()
+        if self._sink is not None:
+            self._sink.close()
+
+    def close(self) -> int:
+        """Ghi phần còn lại, đóng file và đổi tên sang tên cuối cùng. Returns: số dòng đã ghi."""
+        self._flush()
+        self._close_writer()
+        os.replace(self.tmp_path, self.final_path)
+        return self.n_rows
+
+    def abort(self):
+        try:
+            self._close_writer()
+        finally:
+            self.tmp_path.unlink(missing_ok=True)
+
+
+def process_video(video_path, output_dir, fmt="parquet", batch_size=8, sampling=None):
+    """
+    Nhận diện một video và ghi phân vùng `video_id=<id>/` tương ứng.
+    Returns:
+        dict tóm tắt (video_id, số frame, số detection, thời gian, stats từng stage)
+    """
+    from functions import object_detection
+
+    video_path = Path(video_path)
+    vid = video_id(video_path)
+    out_dir = partition_dir(output_dir, vid)
+    out_dir.mkdir(parents=True, exist_ok=True)
+
+    start = time.time()
+    # Detections được ghi theo từng batch YOLO, không giữ toàn bộ video trong bộ nhớ
+    writer = ColumnarWriter(video_path, vid, out_dir, fmt)
+    try:
+        result = object_detection.detect_video_pipelined(video_path, batch_size=batch_size, sampling=sampling,
+                                                         on_frames=writer.write_frames)
+    except BaseException:
+        writer.abort()
+        raise
+    n_rows = writer.close()
+    summary = {
+        "video_id": vid,
+        "video_path": str(video_path),
+        "frames": result["stats"]["infer"]["frames"],
+        "detections": n_rows,
+        "seconds": round(time.time() - start, 3),
+        "stats": result["stats"],
+    }
+    # Marker được ghi sau cùng: chỉ video có marker mới được coi là hoàn tất khi chạy lại
+    (out_dir / SUCCESS_MARKER).write_text(json.dumps(summary, ensure_ascii=False), encoding="utf-8")
+    return summary
+
+
+# =========================================================================================
+# Farm
+# =========================================================================================
+def run_farm(source, output_dir, workers=None, threads_per_worker=1, fmt="parquet", batch_size=8,
+             sampling=None, model_path=None):
+    """
+    Chạy nhận diện trên toàn bộ video, phân phối qua process pool.
+    Video đã có marker _SUCCESS được bỏ qua, nên có thể chạy lại sau khi bị ngắt.
+    Args:
+        source: thư mục video hoặc manifest
+        output_dir: thư mục gốc của dataset đầu ra
+        workers: số process (mặc định: số core / threads_per_worker)
+        threads_per_worker: số thread torch của mỗi process
+        fmt: 'parquet' hoặc 'arrow'
+        batch_size: số frame mỗi lần gọi YOLO
+        sampling: tham số lấy mẫu frame, xem frame_sampling.iter_sampled_frames
+        model_path: đường dẫn weights YOLO (mặc định YOLO_MODEL_PATH)
+    Returns:
+        dict {"completed": [...], "skipped": [...], "failed": [...]}
+    """
+    if fmt not in OUTPUT_FORMATS:
+        raise ValueError(f"Unknown output format '{fmt}', expected one of {list(OUTPUT_FORMATS)}")
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    workers = workers or max(1, (os.cpu_count() or 1) // max(1, threads_per_worker))
+
+    videos = discover_videos(source)
+    pending = [v for v in videos if not is_complete(output_dir, video_id(v))]
+    report = {"completed": [], "skipped": [str(v) for v in videos if v not in pending], "failed": []}
+    logger.info(f"Tìm thấy {len(videos)} video, {len(report['skipped'])} đã hoàn tất, "
+                f"xử lý {len(pending)} video với {workers} worker x {threads_per_worker} thread.")
+    if not pending:
+        return report
+
+    start = time.time()
+    context = multiprocessing.get_context("spawn")  # an toàn với torch hơn fork
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=_init_worker,
+                             initargs=(threads_per_worker, model_path)) as pool:
+        futures = {
+            pool.submit(process_video, str(v), str(output_dir), fmt, batch_size, sampling): v for v in pending
+        }
+        for future in as_completed(futures):
+            video = futures[future]
+            try:
+                summary = future.result()
+                report["completed"].append(summary)
+                logger.info(f"[{len(report['completed'])}/{len(pending)}] {summary['video_id']}: "
+                            f"{summary['frames']} frames, {summary['detections']} detections "
+                            f"in {summary['seconds']}s")
+            except Exception as e:
+                logger.error(f"Lỗi khi xử lý {video}: {e}")
+                report["failed"].append({"video_path": str(video), "error": str(e)})
+
+    elapsed = time.time() - start
+    total_frames = sum(s["frames"] for s in report["completed"])
+    logger.info(f"Hoàn tất {len(report['completed'])} video ({total_frames} frames) trong {elapsed:.2f}s, "
+                f"{len(report['failed'])} lỗi.")
+    return report
+
+
+def _parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Batch object detection over a directory or manifest of videos.")
+    parser.add_argument("source", help="Video directory or manifest (.txt: one path per line, .json: list)")
+    parser.add_argument("--output", default="detections", help="Output dataset directory")
+    parser.add_argument("--format", choices=sorted(OUTPUT_FORMATS), default="parquet")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--threads-per-worker", type=int, default=1)
+    parser.add_argument("--batch-size", type=int, default=8)
+    parser.add_argument("--model", default=None, help="YOLO weights (default: YOLO_MODEL_PATH or yolov8n.pt)")
+    parser.add_argument("--sampling-mode", default="all", choices=["all", "stride", "fps", "scene", "keyframe"])
+    parser.add_argument("--stride", type=int, default=1)
+    parser.add_argument("--target-fps", type=float, default=None)
+    parser.add_argument("--occurrence-index", default=None,
+                        help="Also build the temporal object-occurrence index of the dataset into this directory")
+    parser.add_argument("--content-ids", default=None,
+                        help="JSON file mapping video paths (or video_ids) to contents.id, for the occurrence index")
+    return parser.parse_args(argv)
+
+
+def build_occurrence_index(output_dir, index_dir, content_ids=None, max_gap=1.0):
+    """
+    Xây chỉ mục nhãn -> video -> khoảng thời gian (functions/occurrence_index.py) từ các phân vùng
+    đã hoàn tất của dataset detections.
+    Args:
+        content_ids: dict {đường dẫn video hoặc video_id: contents.id}, để kết quả tìm kiếm của index
+                     dùng được cho reciprocal_rank_fusion của hybrid-search
+    """
+    from functions.occurrence_index import OccurrenceIndex
+
+    id_map = {}
+    for key, content_id in (content_ids or {}).items():
+        # Khóa là đường dẫn video (tồn tại trên đĩa) hoặc đã là video_id
+        id_map[video_id(Path(key)) if Path(key).exists() else key] = content_id
+    index = OccurrenceIndex(max_gap=max_gap, id_map=id_map).add_dataset(output_dir).commit()
+    index.save(index_dir)
+    return index
+
+
+if __name__ == "__main__":
+    args = _parse_args()
+    sampling = {"mode": args.sampling_mode, "stride": args.stride}
+    if args.target_fps:
+        sampling["target_fps"] = args.target_fps
+    result = run_farm(args.source, args.output, workers=args.workers, threads_per_worker=args.threads_per_worker,
+                      fmt=args.format, batch_size=args.batch_size, sampling=sampling, model_path=args.model)
+    if args.occurrence_index:
+        content_ids = json.loads(Path(args.content_ids).read_text(encoding="utf-8")) if args.content_ids else None
+        build_occurrence_index(args.output, args.occurrence_index, content_ids)
+    sys.exit(1 if result["failed"] else 0)
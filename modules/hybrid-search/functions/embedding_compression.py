@@ -0,0 +1,501 @@
+import json
+import logging
+from pathlib import Path
+
+import numpy as np
+
+from .vector_index import METRICS, _l2_normalize, _top_k, kmeans, next_version, to_numpy_embeddings
+
+logger = logging.getLogger(__name__)
+
+QUANTIZERS = ("none", "sq8", "pq")
+COMPRESSION_FORMAT_VERSION = 1
+SEARCH_CHUNK = 65536
+
+
+# =========================================================================================
+# Dimensionality reduction
+# =========================================================================================
+class PCAProjector:
+    """
+    PCA projection of embeddings to `n_components` dimensions (e.g. 768 -> 38, the size of
+    the `contents.embedding_vector vector(38)` column).
+
+    The same fitted projector must be applied to corpus vectors at index time and to query
+    vectors at search time; `CompressedIndex` does this for you.
+    """
+
+    def __init__(self, n_components: int = 38):
+        self.n_components = int(n_components)
+        self.mean = None         # [dim]
+        self.components = None   # [dim, n_components]
+        self.explained_variance_ratio = None
+
+    @property
+    def is_fitted(self) -> bool:
+        return self.components is not None
+
+    def fit(self, vectors, max_samples: int = 100000, seed: int = 0):
+        """
+        Fit the projection on (a random sample of) the corpus.
+
+        Args:
+            vectors: Training embeddings, shape [n, dim].
+            max_samples (int): Fit on at most this many rows.
+            seed (int): Random seed for sampling.
+        """
+        x = to_numpy_embeddings(vectors)
+        if self.n_components > x.shape[1]:
+            raise ValueError(f"n_components={self.n_components} exceeds the input dimension {x.shape[1]}")
+        if x.shape[0] > max_samples:
+            x = x[np.random.default_rng(seed).choice(x.shape[0], max_samples, replace=False)]
+        self.mean = x.mean(axis=0, dtype=np.float64).astype(np.float32)
+        centered = (x - self.mean).astype(np.float64)
+        # Trị riêng của ma trận hiệp phương sai [dim, dim]: rẻ hơn SVD trên toàn bộ [n, dim]
+        cov = centered.T @ centered / max(1, x.shape[0] - 1)
+        eigvals, eigvecs = np.linalg.eigh(cov)
+        order = np.argsort(eigvals)[::-1][:self.n_components]
+        self.components = np.ascontiguousarray(eigvecs[:, order], dtype=np.float32)
+        total = float(eigvals.sum())
+        self.explained_variance_ratio = (eigvals[order] / total).astype(np.float32) if total > 0 else None
+        if self.explained_variance_ratio is not None:
+            logger.info(f"PCA {x.shape[1]} -> {self.n_components} chiều giữ "
+                        f"{self.explained_variance_ratio.sum():.1%} phương sai.")
+        return self
+
+    def transform(self, vectors) -> np.ndarray:
+        """Project embeddings, shape [n, dim] -> [n, n_components] (float32)."""
+        if not self.is_fitted:
+            raise RuntimeError("PCAProjector must be fitted before transform")
+        x = to_numpy_embeddings(vectors)
+        return np.ascontiguousarray((x - self.mean) @ self.components, dtype=np.float32)
+
+
+# =========================================================================================
+# Quantization
+# =========================================================================================
+class ScalarQuantizer:
+    """
+    8-bit scalar quantization: every dimension is mapped linearly from its trained [min, max]
+    range to 0..255, so a vector costs `dim` bytes instead of `4 * dim`.
+    """
+
+    def __init__(self):
+        self.vmin = None
+        self.scale = None
+
+    def train(self, x: np.ndarray):
+        self.vmin = x.min(axis=0).astype(np.float32)
+        span = x.max(axis=0) - self.vmin
+        span[span == 0] = 1.0
+        self.scale = (span / 255.0).astype(np.float32)
+        return self
+
+    def encode(self, x: np.ndarray) -> np.ndarray:
+        codes = np.rint((x - self.vmin) / self.scale)
+        return np.clip(codes, 0, 255).astype(np.uint8)
+
+    def decode(self, codes: np.ndarray) -> np.ndarray:
+        return codes.astype(np.float32) * self.scale + self.vmin
+
+    def inner_products(self, q: np.ndarray, codes: np.ndarray) -> np.ndarray:
+        """
+        Asymmetric inner products between a float query and encoded vectors:
+        q . (vmin + scale * c) = q . vmin + (q * scale) . c, without decoding the codes.
+        """
+        out = np.empty(codes.shape[0], dtype=np.float32)
+        bias, weights = float(q @ self.vmin), q * self.scale
+        for start in range(0, codes.shape[0], SEARCH_CHUNK):
+            block = codes[start:start + SEARCH_CHUNK]
+            out[start:start + block.shape[0]] = block.astype(np.float32) @ weights + bias
+        return out
+
+
+class ProductQuantizer:
+    """
+    Product quantization: the vector is split into `m` sub-vectors, each replaced by the id
+    of its nearest centroid in a 256-entry sub-codebook, so a vector costs `m` bytes.
+    Search uses asymmetric distance computation (ADC): per query, a [m, 256] lookup table of
+    sub-distances is built once and each code's distance is a sum of `m` table lookups.
+    """
+
+    ksub = 256
+
+    def __init__(self, m: int = 8):
+        self.m = int(m)
+        self.bounds = None     # [m + 1] dimension boundaries of the sub-vectors
+        self.codebooks = None  # list of [ksub, sub_dim]
+
+    def train(self, x: np.ndarray, n_iter: int = 20, seed: int = 0):
+        if self.m > x.shape[1]:
+            raise ValueError(f"m={self.m} exceeds the vector dimension {x.shape[1]}")
+        if x.shape[0] < self.ksub:
+            raise ValueError(f"Product quantization needs at least {self.ksub} training vectors")
+        # Chia đều số chiều; các nhóm có thể lệch nhau 1 chiều khi dim không chia hết cho m
+        self.bounds = np.linspace(0, x.shape[1], self.m + 1).astype(np.int64)
+        self.codebooks = [
+            kmeans(np.ascontiguousarray(x[:, lo:hi]), self.ksub, n_iter=n_iter, seed=seed + j)
+            for j, (lo, hi) in enumerate(zip(self.bounds[:-1], self.bounds[1:]))
+        ]
+        return self
+
+    def encode(self, x: np.ndarray) -> np.ndarray:
+        codes = np.empty((x.shape[0], self.m), dtype=np.uint8)
+        for j, (lo, hi) in enumerate(zip(self.bounds[:-1], self.bounds[1:])):
+            book = self.codebooks[j]
+            book_sq = np.einsum("ij,ij->i", book, book)
+            for start in range(0, x.shape[0], SEARCH_CHUNK):
+                sub = x[start:start + SEARCH_CHUNK, lo:hi]
+                # ||sub - c||^2 bỏ hằng số ||sub||^2
+                codes[start:start + sub.shape[0], j] = (book_sq[None, :] - 2.0 * (sub @ book.T)).argmin(axis=1)
+        return codes
+
+    def decode(self, codes: np.ndarray) -> np.ndarray:
+        return np.concatenate([self.codebooks[j][codes[:, j]] for j in range(self.m)], axis=1)
+
+    def lookup_table(self, q: np.ndarray, metric: str) -> np.ndarray:
+        """[m, ksub] table of sub-distances (squared L2) or sub inner products (cosine)."""
+        table = np.empty((self.m, self.ksub), dtype=np.float32)
+        for j, (lo, hi) in enumerate(zip(self.bounds[:-1], self.bounds[1:])):
+            sub = q[lo:hi]
+            if metric == "cosine":
+                table[j] = self.codebooks[j] @ sub
+            else:
+                diff = self.codebooks[j] - sub
+                table[j] = np.einsum("ij,ij->i", diff, diff)
+        return table
+
+    def adc(self, table: np.ndarray, codes: np.ndarray) -> np.ndarray:
+        """Sum the table entries selected by every code."""
+        out = np.zeros(codes.shape[0], dtype=np.float32)
+        for j in range(self.m):
+            out += table[j][codes[:, j]]
+        return out
+
+
+# =========================================================================================
+# Compressed flat index
+# =========================================================================================
+class CompressedIndex:
+    """
+    Exhaustive-scan index over compressed embeddings: optional PCA projection followed by
+    no quantization ('none'), 8-bit scalar ('sq8') or product quantization ('pq').
+
+    The projection and quantizer are trained once on the corpus and applied identically to
+    corpus vectors (`add`) and to queries (`search`). `search` has the same contract as
+    `IVFFlatIndex.search`.
+
+    Memory per 768-d PhoBERT vector: 3072 bytes uncompressed, `n_components` bytes with
+    PCA + sq8 (e.g. 38 bytes, ~80x), `pq_m` bytes with PQ (e.g. 96 bytes, 32x).
+    """
+
+    def __init__(self, dim: int, metric: str = "cosine", n_components: int = None,
+                 quantizer: str = "sq8", pq_m: int = 8):
+        if metric not in METRICS:
+            raise ValueError(f"Unsupported metric '{metric}', expected one of {METRICS}")
+        if quantizer not in QUANTIZERS:
+            raise ValueError(f"Unsupported quantizer '{quantizer}', expected one of {QUANTIZERS}")
+        self.dim = int(dim)
+        self.metric = metric
+        self.projector = PCAProjector(n_components) if n_components else None
+        self.quantizer = quantizer
+        self.pq_m = int(pq_m)
+        self._codec = None
+        self._trained = False
+        self.codes = None
+        self.ids = np.empty(0, dtype=np.int64)
+        self._norms = None  # ||x||^2 đã giải mã, dùng cho L2 với sq8
+        self.version = next_version()  # đổi sau mỗi train/add (xem vector_index.next_version)
+
+    @property
+    def code_dim(self) -> int:
+        return self.projector.n_components if self.projector is not None else self.dim
+
+    @property
+    def bytes_per_vector(self) -> int:
+        if self.quantizer == "sq8":
+            return self.code_dim
+        if self.quantizer == "pq":
+            return self.pq_m
+        return 4 * self.code_dim
+
+    def __len__(self) -> int:
+        return int(self.ids.shape[0])
+
+    # ------------------------------------------------------------------
+    # Build
+    # ------------------------------------------------------------------
+    def _prepare(self, vectors) -> np.ndarray:
+        x = to_numpy_embeddings(vectors)
+        if x.shape[1] != self.dim:
+            raise ValueError(f"Expected vectors of dimension {self.dim}, got {x.shape[1]}")
+        if self.metric == "cosine":
+            x = _l2_normalize(x)
+        if self.projector is not None:
+            x = self.projector.transform(x)
+            if self.metric == "cosine":
+                x = _l2_normalize(x)
+        return np.ascontiguousarray(x, dtype=np.float32)
+
+    def train(self, vectors, max_samples: int = 100000, seed: int = 0):
+        """
+        Fit the projection and the quantizer on (a sample of) the corpus.
+
+        Args:
+            vectors: Training embeddings, shape [n, dim].
+            max_samples (int): Train on at most this many rows.
+            seed (int): Random seed.
+        """
+        x = to_numpy_embeddings(vectors)
+        if x.shape[0] > max_samples:
+            x = x[np.random.default_rng(seed).choice(x.shape[0], max_samples, replace=False)]
+        if self.projector is not None:
+            self.projector.fit(_l2_normalize(x) if self.metric == "cosine" else x, max_samples, seed)
+        x = self._prepare(x)
+        if self.quantizer == "sq8":
+            self._codec = ScalarQuantizer().train(x)
+            self.codes = np.empty((0, self.code_dim), dtype=np.uint8)
+        elif self.quantizer == "pq":
+            self._codec = ProductQuantizer(self.pq_m).train(x, seed=seed)
+            self.codes = np.empty((0, self.pq_m), dtype=np.uint8)
+        else:
+            self.codes = np.empty((0, self.code_dim), dtype=np.float32)
+        self._norms = np.empty(0, dtype=np.float32)
+        self._trained = True
+        self.version = next_version()
+        return self
+
+    def add(self, vectors, ids=None):
+        """
+        Compress and add vectors to a trained index.
+
+        Args:
+            vectors: Embeddings to add, shape [n, dim].
+            ids: Optional int64 external ids. Defaults to consecutive ids after the current size.
+        """
+        if not self._trained:
+            raise RuntimeError("Index must be trained before adding vectors")
+        x = self._prepare(vectors)
+        if ids is None:
+            start = int(self.ids.max()) + 1 if len(self) else 0
+            ids = np.arange(start, start + x.shape[0], dtype=np.int64)
+        ids = np.asarray(ids, dtype=np.int64)
+        if ids.shape[0] != x.shape[0]:
+            raise ValueError("ids and vectors must have the same length")
+
+        codes = self._codec.encode(x) if self._codec is not None else x
+        norms = np.empty(0, dtype=np.float32)
+        if self.quantizer == "sq8" and self.metric == "l2":
+            decoded = self._codec.decode(codes)
+            norms = np.einsum("ij,ij->i", decoded, decoded)
+        self.codes = np.concatenate([np.asarray(self.codes), codes])
+        self.ids = np.concatenate([np.asarray(self.ids), ids])
+        self._norms = np.concatenate([np.asarray(self._norms), norms])
+        self.version = next_version()
+        return self
+
+    @classmethod
+    def build(cls, vectors, ids=None, metric: str = "cosine", n_components: int = None,
+              quantizer: str = "sq8", pq_m: int = 8, **train_kwargs):
+        """Train a compressed index and add all vectors in one call."""
+        x = to_numpy_embeddings(vectors)
+        index = cls(x.shape[1], metric=metric, n_components=n_components, quantizer=quantizer, pq_m=pq_m)
+        index.train(x, **train_kwargs)
+        index.add(x, ids)
+        return index
+
+    # ------------------------------------------------------------------
+    # Search
+    # ------------------------------------------------------------------
+    def _distances(self, q: np.ndarray) -> np.ndarray:
+        if self.quantizer == "pq":
+            table = self._codec.lookup_table(q, self.metric)
+            scores = self._codec.adc(table, self.codes)
+            return 1.0 - scores if self.metric == "cosine" else scores
+        if self.quantizer == "sq8":
+            ip = self._codec.inner_products(q, self.codes)
+            if self.metric == "cosine":
+                return 1.0 - ip
+            return np.maximum(float(q @ q) - 2.0 * ip + self._norms, 0.0)
+        if self.metric == "cosine":
+            return 1.0 - self.codes @ q
+        diff = self.codes - q
+        return np.einsum("ij,ij->i", diff, diff)
+
+    def search(self, queries, k: int = 5):
+        """
+        Return the k nearest neighbours of each query, using asymmetric distances
+        (float query against compressed corpus).
+
+        Args:
+            queries: Query embeddings, shape [n_queries, dim] or [dim].
+            k (int): Number of neighbours to return.
+
+        Returns:
+            tuple[np.ndarray, np.ndarray]: `(ids, distances)`, both of shape [n_queries, k],
+            sorted by ascending (approximate) distance. Missing neighbours are padded with
+            id -1 and distance +inf.
+        """
+        if not self._trained:
+            raise RuntimeError("Index must be trained before searching")
+        q = self._prepare(queries)
+        out_ids = np.full((q.shape[0], k), -1, dtype=np.int64)
+        out_dist = np.full((q.shape[0], k), np.inf, dtype=np.float32)
+        if len(self) == 0:
+            return out_ids, out_dist
+        for i in range(q.shape[0]):
+            dist = self._distances(q[i])
+            top = _top_k(dist, k)
+            out_ids[i, :top.shape[0]] = self.ids[top]
+            out_dist[i, :top.shape[0]] = dist[top]
+        return out_ids, out_dist
+
+    # ------------------------------------------------------------------
+    # Persistence
+    # ------------------------------------------------------------------
+    def save(self, path):
+        """
+        Persist the index (projection, codebooks, codes and ids) as `.npy` files plus `meta.json`.
+
+        Args:
+            path: Target directory (created if missing).
+        """
+        path = Path(path)
+        path.mkdir(parents=True, exist_ok=True)
+        np.save(path / "codes.npy", np.asarray(self.codes))
+        np.save(path / "ids.npy", np.asarray(self.ids))
+        np.save(path / "norms.npy", np.asarray(self._norms))
+        if self.projector is not None:
+            np.save(path / "pca_mean.npy", self.projector.mean)
+            np.save(path / "pca_components.npy", self.projector.components)
+        if self.quantizer == "sq8":
+            np.save(path / "sq_min.npy", self._codec.vmin)
+            np.save(path / "sq_scale.npy", self._codec.scale)
+        elif self.quantizer == "pq":
+            np.save(path / "pq_bounds.npy", self._codec.bounds)
+            np.savez(path / "pq_codebooks.npz", *self._codec.codebooks)
+        meta = {
+            "format_version": COMPRESSION_FORMAT_VERSION,
+            "dim": self.dim,
+            "metric": self.metric,
+            "n_components": self.projector.n_components if self.projector is not None else None,
+            "quantizer": self.quantizer,
+            "pq_m": self.pq_m,
+            "size": len(self),
+        }
+        (path / "meta.json").write_text(json.dumps(meta, indent=2), encoding="utf-8")
+        logger.info(f"Đã lưu compressed index ({len(self)} vector, {self.bytes_per_vector} byte/vector) vào '{path}'.")
+
+    @classmethod
+    def load(cls, path, mmap: bool = True):
+        """
+        Load an index saved with `save`.
+
+        Args:
+            path: Index directory.
+            mmap (bool): Memory-map the codes and ids instead of reading them into RAM.
+
+        Returns:
+            CompressedIndex: The loaded index.
+        """
+        path = Path(path)
+        meta = json.loads((path / "meta.json").read_text(encoding="utf-8"))
+        if meta.get("format_version") != COMPRESSION_FORMAT_VERSION:
+            raise ValueError(f"Unsupported index format version: {meta.get('format_version')}")
+        mode = "r" if mmap else None
+
+        index = cls(meta["dim"], metric=meta["metric"], n_components=meta["n_components"],
+                    quantizer=meta["quantizer"], pq_m=meta["pq_m"])
+        if index.projector is not None:
+            index.projector.mean = np.load(path / "pca_mean.npy")
+            index.projector.components = np.load(path / "pca_components.npy")
+        if index.quantizer == "sq8":
+            index._codec = ScalarQuantizer()
+            index._codec.vmin = np.load(path / "sq_min.npy")
+            index._codec.scale = np.load(path / "sq_scale.npy")
+        elif index.quantizer == "pq":
+            index._codec = ProductQuantizer(meta["pq_m"])
+            index._codec.bounds = np.load(path / "pq_bounds.npy")
+            with np.load(path / "pq_codebooks.npz") as books:
+                index._codec.codebooks = [books[f"arr_{j}"] for j in range(meta["pq_m"])]
+        index.codes = np.load(path / "codes.npy", mmap_mode=mode)
+        index.ids = np.load(path / "ids.npy", mmap_mode=mode)
+        index._norms = np.load(path / "norms.npy")
+        index._trained = True
+        return index
+
+
+# =========================================================================================
+# Evaluation
+# =========================================================================================
+def exact_search(vectors, queries, k: int = 10, metric: str = "cosine", ids=None):
+    """
+    Brute-force search over uncompressed float32 embeddings (the recall baseline).
+
+    Returns:
+        tuple[np.ndarray, np.ndarray]: `(ids, distances)` of shape [n_queries, k].
+    """
+    x, q = to_numpy_embeddings(vectors), to_numpy_embeddings(queries)
+    if metric == "cosine":
+        x, q = _l2_normalize(x), _l2_normalize(q)
+    ids = np.arange(x.shape[0], dtype=np.int64) if ids is None else np.asarray(ids, dtype=np.int64)
+    x_sq = np.einsum("ij,ij->i", x, x)
+    out_ids = np.full((q.shape[0], k), -1, dtype=np.int64)
+    out_dist = np.full((q.shape[0], k), np.inf, dtype=np.float32)
+    for i in range(q.shape[0]):
+        dist = 1.0 - x @ q[i] if metric == "cosine" else np.maximum(x_sq - 2.0 * (x @ q[i]) + q[i] @ q[i], 0.0)
+        top = _top_k(dist, k)
+        out_ids[i, :top.shape[0]] = ids[top]
+        out_dist[i, :top.shape[0]] = dist[top]
+    return out_ids, out_dist
+
+
+def recall_at_k(approx_ids: np.ndarray, exact_ids: np.ndarray, k: int = None) -> float:
+    """
+    Mean fraction of the exact top-k neighbours found in the approximate top-k.
+
+    Args:
+        approx_ids: [n_queries, >=k] ids returned by the compressed index.
+        exact_ids: [n_queries, >=k] ids returned by `exact_search`.
+        k (int): Cut-off (default: the width of `exact_ids`).
+
+    Returns:
+        float: Recall@k in [0, 1].
+    """
+    k = exact_ids.shape[1] if k is None else int(k)
+    hits = [
+        len(np.intersect1d(a[:k][a[:k] >= 0], e[:k][e[:k] >= 0])) / max(1, int((e[:k] >= 0).sum()))
+        for a, e in zip(np.asarray(approx_ids), np.asarray(exact_ids))
+    ]
+    return float(np.mean(hits)) if hits else 0.0
+
+
+def evaluate_compression(vectors, queries, configs, k: int = 10, metric: str = "cosine", ids=None):
+    """
+    Build one `CompressedIndex` per config and measure recall@k against the uncompressed baseline.
+
+    Args:
+        vectors: Corpus embeddings, shape [n, dim].
+        queries: Query embeddings, shape [n_queries, dim].
+        configs: Iterable of `CompressedIndex` keyword dicts, e.g.
+                 `[{"n_components": 38, "quantizer": "sq8"}, {"quantizer": "pq", "pq_m": 96}]`.
+        k (int): Recall cut-off.
+        metric (str): 'cosine' or 'l2'.
+
+    Returns:
+        list[dict]: One row per config with `recall@k`, `bytes_per_vector` and `compression`
+        (ratio against float32 storage of the original vectors).
+    """
+    x = to_numpy_embeddings(vectors)
+    exact_ids, _ = exact_search(x, queries, k=k, metric=metric, ids=ids)
+    rows = []
+    for config in configs:
+        index = CompressedIndex.build(x, ids=ids, metric=metric, **config)
+        approx_ids, _ = index.search(queries, k=k)
+        rows.append({
+            **config,
+            f"recall@{k}": recall_at_k(approx_ids, exact_ids, k),
+            "bytes_per_vector": index.bytes_per_vector,
+            "compression": 4 * x.shape[1] / index.bytes_per_vector,
+        })
+    return rows
@@ -0,0 +1,515 @@
+import json
+import logging
+import re
+import unicodedata
+from collections import Counter
+from pathlib import Path
+
+import numpy as np
+
+from .vector_index import next_version
+
+logger = logging.getLogger(__name__)
+
+# Các trường thuộc tính do `keyword_extraction.extract_keywords` trả về
+ATTRIBUTE_FIELDS = (
+    "type", "activity", "location", "event", "date",
+    "people", "emotion", "device", "weather", "object",
+)
+TEXT_FIELDS = ("title", "description", "transcript")
+DEFAULT_FILTER_FIELDS = ("type", "date")
+
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+_DATE_RE = re.compile(r"^\s*(\d{4})(?:[-/.](\d{1,2}))?(?:[-/.](\d{1,2}))?")
+_DATE_MAX_SUFFIX = "\uffff"
+
+
+def tokenize(text: str) -> list:
+    """Lowercase, NFC-normalize and split text into word tokens."""
+    if not text:
+        return []
+    return _TOKEN_RE.findall(unicodedata.normalize("NFC", text).lower())
+
+
+def normalize_value(value) -> str:
+    """Canonical form of an attribute value used as posting-list key."""
+    return " ".join(tokenize(str(value)))
+
+
+def normalize_date(value) -> str:
+    """
+    Normalize a date to 'YYYY', 'YYYY-MM' or 'YYYY-MM-DD' so that lexicographic order
+    equals chronological order and prefixes select whole months/years.
+
+    Returns:
+        str: The normalized date, or '' if the value is not a recognizable date.
+    """
+    match = _DATE_RE.match(str(value))
+    if not match:
+        return ""
+    parts = [match.group(1)] + [p.zfill(2) for p in match.groups()[1:] if p]
+    return "-".join(parts)
+
+
+def _as_list(value) -> list:
+    if value is None:
+        return []
+    if isinstance(value, (list, tuple, set)):
+        return [v for v in value if v is not None and v != ""]
+    return [value] if value != "" else []
+
+
+def _is_member(sorted_haystack: np.ndarray, needles: np.ndarray) -> np.ndarray:
+    """Boolean mask of `needles` present in `sorted_haystack` (binary search, O(m log n))."""
+    if sorted_haystack.shape[0] == 0:
+        return np.zeros(needles.shape[0], dtype=bool)
+    pos = np.searchsorted(sorted_haystack, needles)
+    pos[pos == sorted_haystack.shape[0]] = 0
+    return sorted_haystack[pos] == needles
+
+
+def intersect_sorted(postings: list) -> np.ndarray:
+    """
+    Intersect sorted, duplicate-free posting lists, smallest first so that every step
+    only binary-searches the surviving candidates into the next list.
+    """
+    if not postings:
+        return np.empty(0, dtype=np.int64)
+    postings = sorted(postings, key=len)
+    result = postings[0]
+    for other in postings[1:]:
+        if result.shape[0] == 0:
+            break
+        result = result[_is_member(other, result)]
+    return result
+
+
+def _to_csr(lists: list, dtype=np.int64):
+    offsets = np.zeros(len(lists) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(x) for x in lists])
+    flat = np.concatenate(lists).astype(dtype) if lists else np.empty(0, dtype=dtype)
+    return flat, offsets
+
+
+class KeywordIndex:
+    """
+    Inverted index for keyword search: BM25 over the free text (title, description,
+    transcript) plus per-field posting lists for the attributes produced by
+    `extract_keywords`.
+
+    Documents are numbered internally by insertion order, so every posting list is a sorted
+    int array. Structured filters are evaluated as posting-list intersections and only the
+    surviving candidates are BM25-scored.
+    """
+
+    def __init__(self, k1: float = 1.2, b: float = 0.75, text_fields=TEXT_FIELDS,
+                 attribute_fields=ATTRIBUTE_FIELDS):
+        self.k1 = float(k1)
+        self.b = float(b)
+        self.text_fields = tuple(text_fields)
+        self.attribute_fields = tuple(attribute_fields)
+
+        self.doc_ids = np.empty(0, dtype=np.int64)     # ordinal -> external id
+        self.doc_len = np.empty(0, dtype=np.float32)   # ordinal -> number of tokens
+
+        # Text postings (CSR): term -> row, docs/tfs[offsets[row]:offsets[row + 1]]
+        self.vocab = {}
+        self.post_docs = np.empty(0, dtype=np.int64)
+        self.post_tfs = np.empty(0, dtype=np.float32)
+        self.post_offsets = np.zeros(1, dtype=np.int64)
+
+        # Attribute postings: field -> {value: sorted ordinals}
+        self.field_postings = {f: {} for f in self.attribute_fields if f != "date"}
+        # Date: keys sorted lexicographically, aligned with their document ordinals
+        self.date_keys = np.empty(0, dtype=object)
+        self.date_docs = np.empty(0, dtype=np.int64)
+
+        self.alive = np.ones(0, dtype=bool)  # ordinal -> False nếu đã xóa (tombstone, chờ compact)
+        self.n_deleted = 0
+
+        self._pending = []
+        self.version = next_version()  # đổi sau mỗi commit / delete (xem vector_index.next_version)
+
+    def __len__(self) -> int:
+        """Number of live documents, including queued ones."""
+        return int(self.doc_ids.shape[0]) - self.n_deleted + len(self._pending)
+
+    # ------------------------------------------------------------------
+    # Build
+    # ------------------------------------------------------------------
+    def add_document(self, doc_id: int, document: dict):
+        """
+        Queue a document for indexing.
+
+        Args:
+            doc_id (int): External id (e.g. `contents.id`).
+            document (dict): Text fields (`title`, `description`, `transcript`) and/or any of the
+                             attribute fields from `extract_keywords`. A nested `keywords` dict or
+                             JSON string (as produced by `process_prompt`) is also accepted.
+
+        Raises:
+            json.JSONDecodeError: If `keywords` is a string that is not valid JSON.
+        """
+        keywords = document.get("keywords")
+        if isinstance(keywords, str):  # chuỗi JSON từ `extract_keywords` / `process_prompt`
+            document = dict(document, keywords=json.loads(keywords))
+        self._pending.append((int(doc_id), document))
+
+    def add_documents(self, documents):
+        """Queue an iterable of `(doc_id, document)` pairs."""
+        for doc_id, document in documents:
+            self.add_document(doc_id, document)
+        return self
+
+    def commit(self):
+        """Merge queued documents into the packed posting lists."""
+        if not self._pending:
+            return self
+        base = int(self.doc_ids.shape[0])
+
+        term_lists = {}
+        doc_len = []
+        field_lists = {f: {} for f in self.field_postings}
+        date_pairs = []
+
+        for offset, (_, document) in enumerate(self._pending):
+            ordinal = base + offset
+            attrs = dict(document.get("keywords") or {}, **document)
+
+            text = " ".join(str(attrs.get(f) or "") for f in self.text_fields)
+            tokens = tokenize(text)
+            doc_len.append(len(tokens))
+            for term, count in Counter(tokens).items():
+                entry = term_lists.setdefault(term, ([], []))
+                entry[0].append(ordinal)
+                entry[1].append(count)
+
+            for field, values in field_lists.items():
+                for value in {normalize_value(v) for v in _as_list(attrs.get(field))}:
+                    if value:
+                        values.setdefault(value, []).append(ordinal)
+            if "date" in self.attribute_fields:
+                for value in {normalize_date(v) for v in _as_list(attrs.get("date"))}:
+                    if value:
+                        date_pairs.append((value, ordinal))
+
+        self._merge_text(term_lists)
+        for field, values in field_lists.items():
+            postings = self.field_postings[field]
+            for value, ordinals in values.items():
+                new = np.asarray(ordinals, dtype=np.int64)
+                postings[value] = np.concatenate([postings[value], new]) if value in postings else new
+        if date_pairs:
+            # Chỉ sắp xếp delta rồi chèn vào sau các khóa bằng nhau (ordinals mới luôn lớn hơn)
+            date_pairs.sort()
+            keys = np.array([k for k, _ in date_pairs], dtype=object)
+            docs = np.array([d for _, d in date_pairs], dtype=np.int64)
+            positions = np.searchsorted(self.date_keys, keys, side="right")
+            self.date_keys = np.insert(self.date_keys, positions, keys)
+            self.date_docs = np.insert(self.date_docs, positions, docs)
+
+        self.doc_ids = np.concatenate([self.doc_ids, [d for d, _ in self._pending]]).astype(np.int64)
+        self.doc_len = np.concatenate([self.doc_len, doc_len]).astype(np.float32)
+        self.alive = np.concatenate([self.alive, np.ones(len(doc_len), dtype=bool)])
+        logger.info(f"Đã đánh chỉ mục {len(self._pending)} tài liệu (tổng cộng {len(self.doc_ids)}).")
+        self._pending = []
+        self.version = next_version()
+        return self
+
+    def delete(self, doc_ids) -> int:
+        """
+        Tombstone the documents with the given ids (queued ones are dropped). Deleted documents
+        never match `filter` / `search`; `compact` removes them from the posting lists.
+
+        Returns:
+            int: Number of documents deleted.
+        """
+        doc_ids = np.unique(np.asarray(doc_ids, dtype=np.int64).reshape(-1))
+        if doc_ids.shape[0] == 0:
+            return 0
+        if self._pending:
+            wanted = set(doc_ids.tolist())
+            kept = [(d, doc) for d, doc in self._pending if d not in wanted]
+            count = len(self._pending) - len(kept)
+            self._pending = kept
+        else:
+            count = 0
+        hits = np.isin(self.doc_ids, doc_ids) & self.alive
+        if hits.any():
+            self.alive[hits] = False
+            self.n_deleted += int(hits.sum())
+            count += int(hits.sum())
+            self.version = next_version()
+        return count
+
+    def upsert_documents(self, documents):
+        """Queue `(doc_id, document)` pairs, replacing any document with the same id (delete + add)."""
+        documents = list(documents)
+        self.delete([doc_id for doc_id, _ in documents])
+        return self.add_documents(documents)
+
+    def compact(self) -> int:
+        """
+        Remove tombstoned documents from every posting list and renumber the ordinals.
+
+        Returns:
+            int: Number of documents removed.
+        """
+        self.commit()
+        removed = self.n_deleted
+        if not removed:
+            return 0
+        keep = self.alive
+        remap = np.cumsum(keep) - 1  # ordinal cũ -> ordinal mới (chỉ có nghĩa với tài liệu còn sống)
+
+        post_keep = keep[self.post_docs]
+        rows = np.repeat(np.arange(self.post_offsets.shape[0] - 1), np.diff(self.post_offsets))
+        counts = np.bincount(rows[post_keep], minlength=self.post_offsets.shape[0] - 1)
+        self.post_docs = remap[self.post_docs[post_keep]]
+        self.post_tfs = self.post_tfs[post_keep]
+        self.post_offsets = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+
+        for field, postings in self.field_postings.items():
+            for value in list(postings):
+                ordinals = postings[value]
+                ordinals = remap[ordinals[keep[ordinals]]]
+                if ordinals.shape[0]:
+                    postings[value] = ordinals
+                else:
+                    del postings[value]
+        date_keep = keep[self.date_docs]
+        self.date_keys, self.date_docs = self.date_keys[date_keep], remap[self.date_docs[date_keep]]
+
+        self.doc_ids, self.doc_len = self.doc_ids[keep], self.doc_len[keep]
+        self.alive = np.ones(self.doc_ids.shape[0], dtype=bool)
+        self.n_deleted = 0
+        self.version = next_version()
+        logger.info(f"Đã xóa hẳn {removed} tài liệu khỏi keyword index (còn {len(self.doc_ids)}).")
+        return removed
+
+    def _merge_text(self, term_lists: dict):
+        # Ordinals mới luôn lớn hơn ordinals cũ nên posting mới được chèn vào cuối hàng của term
+        # tương ứng; chỉ các term trong delta được duyệt, phần CSR cũ được dời nguyên khối bởi np.insert
+        if not term_lists:
+            return
+        n_terms = self.post_offsets.shape[0] - 1
+        for term in term_lists:
+            if term not in self.vocab:
+                self.vocab[term] = len(self.vocab)
+        n_rows = len(self.vocab)
+
+        rows = np.fromiter((self.vocab[t] for t in term_lists), dtype=np.int64, count=len(term_lists))
+        lengths = np.fromiter((len(o) for o, _ in term_lists.values()), dtype=np.int64, count=len(term_lists))
+        new_rows = np.repeat(rows, lengths)
+        new_docs = np.concatenate([np.asarray(o, dtype=np.int64) for o, _ in term_lists.values()])
+        new_tfs = np.concatenate([np.asarray(c, dtype=np.float32) for _, c in term_lists.values()])
+        order = np.argsort(new_rows, kind="stable")
+        new_rows, new_docs, new_tfs = new_rows[order], new_docs[order], new_tfs[order]
+
+        # Vị trí chèn = cuối hàng cũ (term mới: cuối mảng);
+        # np.insert giữ nguyên thứ tự các phần tử có cùng vị trí chèn
+        row_ends = np.concatenate([self.post_offsets[1:], np.full(n_rows - n_terms, self.post_offsets[-1])])
+        positions = row_ends[new_rows]
+        self.post_docs = np.insert(self.post_docs, positions, new_docs)
+        self.post_tfs = np.insert(self.post_tfs, positions, new_tfs)
+
+        counts = np.bincount(new_rows, minlength=n_rows)
+        counts[:n_terms] += np.diff(self.post_offsets)
+        self.post_offsets = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+
+    # ------------------------------------------------------------------
+    # Filters
+    # ------------------------------------------------------------------
+    def _date_postings(self, condition) -> np.ndarray:
+        """
+        Ordinals matching a date condition: a prefix ('2023-05' matches every day of May 2023)
+        or an inclusive range given as a `(start, end)` tuple or `{"from": ..., "to": ...}` dict.
+        """
+        if isinstance(condition, dict):
+            condition = (condition.get("from"), condition.get("to"))
+        if isinstance(condition, (tuple, list)) and len(condition) == 2:
+            start, end = condition
+            low = normalize_date(start) if start else ""
+            high = normalize_date(end) + _DATE_MAX_SUFFIX if end else _DATE_MAX_SUFFIX
+        else:
+            low = normalize_date(condition)
+            if not low:
+                return np.empty(0, dtype=np.int64)
+            high = low + _DATE_MAX_SUFFIX
+        lo = np.searchsorted(self.date_keys, low, side="left")
+        hi = np.searchsorted(self.date_keys, high, side="right")
+        return np.unique(self.date_docs[lo:hi])
+
+    def _field_postings(self, field: str, condition) -> np.ndarray:
+        if field == "date":
+            return self._date_postings(condition)
+        if field not in self.field_postings:
+            raise KeyError(f"Unknown attribute field '{field}'")
+        postings = self.field_postings[field]
+        # Nhiều giá trị trong cùng một trường được hiểu là OR
+        hits = [postings.get(normalize_value(v)) for v in _as_list(condition)]
+        hits = [h for h in hits if h is not None]
+        if not hits:
+            return np.empty(0, dtype=np.int64)
+        return hits[0] if len(hits) == 1 else np.unique(np.concatenate(hits))
+
+    def filter(self, filters: dict) -> np.ndarray:
+        """
+        Evaluate structured filters (AND across fields, OR across values of one field).
+
+        Args:
+            filters (dict): e.g. `{"type": "image", "location": "Lăng Bác", "date": "2023-05"}`.
+
+        Returns:
+            np.ndarray: Sorted internal ordinals of matching documents.
+        """
+        self.commit()
+        postings = [self._field_postings(f, c) for f, c in filters.items() if c not in (None, "", [])]
+        ordinals = intersect_sorted(postings)
+        if self.n_deleted:
+            ordinals = ordinals[self.alive[ordinals]]
+        return ordinals
+
+    # ------------------------------------------------------------------
+    # Search
+    # ------------------------------------------------------------------
+    def _bm25(self, terms: list, candidates: np.ndarray = None):
+        n_docs = self.doc_ids.shape[0]
+        avgdl = float(self.doc_len.mean()) if n_docs else 0.0
+        docs_parts, score_parts = [], []
+        for term in set(terms):
+            row = self.vocab.get(term)
+            if row is None:
+                continue
+            start, end = self.post_offsets[row], self.post_offsets[row + 1]
+            docs, tfs = self.post_docs[start:end], self.post_tfs[start:end]
+            idf = np.log1p((n_docs - docs.shape[0] + 0.5) / (docs.shape[0] + 0.5))
+            if candidates is not None:
+                keep = _is_member(candidates, docs)
+                docs, tfs = docs[keep], tfs[keep]
+            if docs.shape[0] == 0:
+                continue
+            norm = self.k1 * (1.0 - self.b + self.b * self.doc_len[docs] / max(avgdl, 1e-9))
+            docs_parts.append(docs)
+            score_parts.append(idf * tfs * (self.k1 + 1.0) / (tfs + norm))
+        if not docs_parts:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        docs, inverse = np.unique(np.concatenate(docs_parts), return_inverse=True)
+        scores = np.bincount(inverse, weights=np.concatenate(score_parts)).astype(np.float32)
+        return docs, scores
+
+    def search(self, text: str = None, filters: dict = None, k: int = 5):
+        """
+        BM25 search over the candidates that pass the structured filters.
+
+        Args:
+            text (str): Free-text query. If empty, filtered documents are returned with score 0.
+            filters (dict): Structured filters, see `filter`.
+            k (int): Number of results.
+
+        Returns:
+            tuple[np.ndarray, np.ndarray]: `(ids, scores)` sorted by descending BM25 score.
+        """
+        self.commit()
+        candidates = self.filter(filters) if filters else None
+        if candidates is not None and candidates.shape[0] == 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+
+        terms = tokenize(text or "")
+        if terms:
+            docs, scores = self._bm25(terms, candidates)
+        elif candidates is not None:
+            docs, scores = candidates, np.zeros(candidates.shape[0], dtype=np.float32)
+        else:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        if self.n_deleted and candidates is None:
+            live = self.alive[docs]
+            docs, scores = docs[live], scores[live]
+
+        if docs.shape[0] > k:
+            top = np.argpartition(-scores, k - 1)[:k]
+        else:
+            top = np.arange(docs.shape[0])
+        top = top[np.lexsort((docs[top], -scores[top]))]
+        return self.doc_ids[docs[top]], scores[top]
+
+    def search_keywords(self, keywords, text: str = None, k: int = 5, filter_fields=DEFAULT_FILTER_FIELDS):
+        """
+        Search with the output of `extract_keywords`.
+
+        Fields listed in `filter_fields` become hard filters; the values of every other
+        attribute are appended to the BM25 query text.
+
+        Args:
+            keywords (dict | str): The keyword dict or its JSON string.
+            text (str): Optional extra free text (e.g. the normalized prompt).
+            k (int): Number of results.
+            filter_fields (tuple): Attribute fields applied as filters.
+
+        Returns:
+            tuple[np.ndarray, np.ndarray]: `(ids, scores)`, see `search`.
+        """
+        if isinstance(keywords, str):
+            keywords = json.loads(keywords)
+        keywords = {f: v for f, v in (keywords or {}).items() if f in self.attribute_fields}
+        filters = {f: keywords[f] for f in filter_fields if keywords.get(f)}
+        terms = [str(v) for f, value in keywords.items() if f not in filters for v in _as_list(value)]
+        query = " ".join(([text] if text else []) + terms)
+        return self.search(query, filters=filters, k=k)
+
+    # ------------------------------------------------------------------
+    # Persistence
+    # ------------------------------------------------------------------
+    def save(self, path):
+        """Persist the index to a directory (`postings.npz` + `meta.json`)."""
+        self.commit()
+        path = Path(path)
+        path.mkdir(parents=True, exist_ok=True)
+
+        field_meta, field_lists = {}, []
+        for field, postings in self.field_postings.items():
+            field_meta[field] = {}
+            for value, ordinals in postings.items():
+                field_meta[field][value] = len(field_lists)
+                field_lists.append(ordinals)
+        field_docs, field_offsets = _to_csr(field_lists, np.int64)
+
+        np.savez(
+            path / "postings.npz",
+            doc_ids=self.doc_ids, doc_len=self.doc_len,
+            post_docs=self.post_docs, post_tfs=self.post_tfs, post_offsets=self.post_offsets,
+            field_docs=field_docs, field_offsets=field_offsets,
+            date_keys=self.date_keys.astype(str), date_docs=self.date_docs,
+            alive=self.alive,
+        )
+        meta = {
+            "k1": self.k1, "b": self.b,
+            "text_fields": list(self.text_fields),
+            "attribute_fields": list(self.attribute_fields),
+            "vocab": self.vocab,
+            "fields": field_meta,
+        }
+        (path / "meta.json").write_text(json.dumps(meta, ensure_ascii=False), encoding="utf-8")
+
+    @classmethod
+    def load(cls, path):
+        """Load an index saved with `save`."""
+        path = Path(path)
+        meta = json.loads((path / "meta.json").read_text(encoding="utf-8"))
+        index = cls(meta["k1"], meta["b"], meta["text_fields"], meta["attribute_fields"])
+        with np.load(path / "postings.npz") as data:
+            index.doc_ids, index.doc_len = data["doc_ids"], data["doc_len"]
+            index.post_docs, index.post_tfs = data["post_docs"], data["post_tfs"]
+            index.post_offsets = data["post_offsets"]
+            field_docs, field_offsets = data["field_docs"], data["field_offsets"]
+            index.date_keys = data["date_keys"].astype(object)
+            index.date_docs = data["date_docs"]
+            # Index lưu trước khi có tombstone không có mảng `alive`
+            index.alive = data["alive"] if "alive" in data.files else np.ones(index.doc_ids.shape[0], dtype=bool)
+        index.n_deleted = int((~index.alive).sum())
+        index.vocab = meta["vocab"]
+        for field, values in meta["fields"].items():
+            index.field_postings[field] = {
+                value: field_docs[field_offsets[row]:field_offsets[row + 1]] for value, row in values.items()
+            }
+        return index
@@ -0,0 +1,314 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+from .keyword_index import normalize_date, normalize_value
+from .vector_index import _l2_normalize, to_numpy_embeddings
+
+logger = logging.getLogger(__name__)
+
+
+def filters_key(filters) -> str:
+    """
+    Canonical string form of the keyword filters of a query (a dict or its JSON string).
+
+    Empty values are dropped, strings are normalized like the keyword index does (`date` with
+    `normalize_date`), lists are sorted, so e.g. `{"location": "Lăng  Bác", "people": None}` and
+    `{"location": "lăng bác"}` give the same key.
+    """
+    def canonical(field, value):
+        if isinstance(value, dict):
+            return {k: canonical(field, v) for k, v in sorted(value.items()) if v not in (None, "", [], {})}
+        if isinstance(value, (list, tuple, set)):
+            return sorted(canonical(field, v) for v in value if v not in (None, ""))
+        if isinstance(value, str):
+            return normalize_date(value) if field == "date" else normalize_value(value)
+        return value
+
+    if isinstance(filters, str):  # chuỗi JSON từ `extract_keywords`
+        filters = json.loads(filters)
+    clean = {field: canonical(field, value) for field, value in (filters or {}).items()
+             if value not in (None, "", [], {})}
+    return json.dumps(clean, sort_keys=True, ensure_ascii=False)
+
+
+def _truncate(result, k: int):
+    """
+    First k hits of a result: `(ids, scores)` arrays (as from rank_fusion or an index search,
+    cut along the last axis) or a list of hits.
+    """
+    if isinstance(result, tuple):
+        return tuple(_truncate(part, k) for part in result)
+    if isinstance(result, np.ndarray):
+        return result[..., :k]
+    return result[:k]
+
+
+class _Entry:
+    __slots__ = ("group", "slot", "k", "result", "expires")
+
+    def __init__(self, group: str, slot: int, k: int, result, expires: float):
+        self.group = group
+        self.slot = slot
+        self.k = k
+        self.result = result
+        self.expires = expires
+
+
+class _Group:
+    """Unit query embeddings of the cached entries that share one filter key, one row per slot."""
+
+    def __init__(self, dim: int, capacity: int = 8):
+        self.vectors = np.zeros((capacity, dim), dtype=np.float32)
+        self.keys = [None] * capacity
+        self.free = list(range(capacity - 1, -1, -1))
+
+    def add(self, key: str, vector: np.ndarray) -> int:
+        if not self.free:
+            capacity = len(self.keys)
+            self.vectors = np.concatenate([self.vectors, np.zeros_like(self.vectors)])
+            self.keys.extend([None] * capacity)
+            self.free = list(range(2 * capacity - 1, capacity - 1, -1))
+        slot = self.free.pop()
+        self.vectors[slot] = vector
+        self.keys[slot] = key
+        return slot
+
+    def remove(self, slot: int):
+        self.vectors[slot] = 0.0  # hàng rỗng có cosine 0, không bao giờ vượt ngưỡng
+        self.keys[slot] = None
+        self.free.append(slot)
+
+    def __len__(self) -> int:
+        return len(self.keys) - len(self.free)
+
+
+class QueryResultCache:
+    """
+    Result cache for hybrid search, keyed on the keyword filters plus the query embedding.
+
+    - Exact tier: same filters and the same (normalized) embedding.
+    - Similarity tier: same filters and a cached query embedding with cosine similarity
+      >= `similarity_threshold`, so near-duplicate prompts ("ảnh Lăng Bác tháng 5 2023" /
+      "Ảnh chụp Lăng Bác vào tháng 5 năm 2023") share one retrieval.
+
+    Entries expire after `ttl` seconds and the least recently used ones are evicted beyond
+    `capacity`. Every lookup compares the versions of the registered `sources` (indexes with a
+    `version` attribute, such as IVFFlatIndex, CompressedIndex, KeywordIndex or the SQLite KG
+    store, or zero-argument callables) with those the entries were computed against, and drops
+    the whole cache as soon as any of them changed.
+
+    Counters are exposed through `stats()`.
+    """
+
+    def __init__(self, capacity: int = 1024, ttl: float = 300.0, similarity_threshold: float = 0.98,
+                 sources=()):
+        if not 0 < similarity_threshold <= 1:
+            raise ValueError("similarity_threshold must be in (0, 1]")
+        self.capacity = int(capacity)
+        self.ttl = float(ttl) if ttl else None
+        self.similarity_threshold = float(similarity_threshold)
+        self.sources = list(sources)
+        self._entries = OrderedDict()
+        self._groups = {}
+        self._versions = self._current_versions()
+        self._lock = threading.Lock()
+        self.exact_hits = 0
+        self.similar_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    # ------------------------------------------------------------------
+    # Versions
+    # ------------------------------------------------------------------
+    def add_source(self, source):
+        """Register another index / store whose changes must invalidate the cache."""
+        with self._lock:
+            self.sources.append(source)
+            self._clear()
+            self._versions = self._current_versions()
+
+    def _current_versions(self) -> tuple:
+        return tuple(source() if callable(source) else source.version for source in self.sources)
+
+    def _check_versions(self) -> tuple:
+        """Clears the cache if a source changed since the last lookup; returns the current versions."""
+        current = self._current_versions()
+        if current != self._versions:
+            if self._entries:
+                logger.debug(f"Index thay đổi, xóa {len(self._entries)} kết quả trong cache.")
+            self._clear()
+            self.invalidations += 1
+            self._versions = current
+        return current
+
+    def versions(self) -> tuple:
+        """Current versions of the sources, to pass to `put` when the result was computed elsewhere."""
+        return self._current_versions()
+
+    # ------------------------------------------------------------------
+    # Keys
+    # ------------------------------------------------------------------
+    @staticmethod
+    def _prepare(embedding) -> np.ndarray:
+        return _l2_normalize(to_numpy_embeddings(embedding))[0]
+
+    @staticmethod
+    def _exact_key(group: str, vector: np.ndarray) -> str:
+        digest = hashlib.blake2b(group.encode("utf-8"), digest_size=16)
+        digest.update(vector.tobytes())
+        return digest.hexdigest()
+
+    # ------------------------------------------------------------------
+    # Public API
+    # ------------------------------------------------------------------
+    def get(self, filters, embedding, k: int = 5):
+        """
+        Look up the cached top-k of a query.
+
+        Args:
+            filters (dict): Keyword filters extracted from the prompt (e.g. `type`, `date`, `location`).
+            embedding: Query embedding (any [dim] or [1, dim] array/tensor).
+            k (int): Number of results wanted; entries cached with a smaller k do not match.
+
+        Returns:
+            The cached result truncated to k, or None on a miss.
+        """
+        group_key = filters_key(filters)
+        vector = self._prepare(embedding)
+        key = self._exact_key(group_key, vector)
+        now = time.monotonic()
+        with self._lock:
+            self._check_versions()
+            entry = self._entries.get(key)
+            if entry is not None and self._is_live(key, entry, now) and entry.k >= k:
+                self._entries.move_to_end(key)
+                self.exact_hits += 1
+                return _truncate(entry.result, k)
+
+            group = self._groups.get(group_key)
+            if group is not None and group.vectors.shape[1] == vector.shape[0]:
+                similarities = group.vectors @ vector
+                for slot in np.argsort(-similarities):
+                    if similarities[slot] < self.similarity_threshold:
+                        break
+                    candidate_key = group.keys[slot]
+                    entry = self._entries.get(candidate_key)
+                    if entry is not None and self._is_live(candidate_key, entry, now) and entry.k >= k:
+                        self._entries.move_to_end(candidate_key)
+                        self.similar_hits += 1
+                        return _truncate(entry.result, k)
+            self.misses += 1
+            return None
+
+    def put(self, filters, embedding, k: int, result, versions: tuple = None):
+        """
+        Store the top-k result of a query.
+
+        Args:
+            versions (tuple): Source versions the result was computed against (see `versions()`).
+                              If they are no longer current, the result is not cached.
+        """
+        group_key = filters_key(filters)
+        vector = self._prepare(embedding)
+        key = self._exact_key(group_key, vector)
+        with self._lock:
+            current = self._check_versions()
+            if versions is not None and tuple(versions) != current:
+                return
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._groups[old.group].remove(old.slot)
+            group = self._groups.get(group_key)
+            if group is None:
+                group = self._groups[group_key] = _Group(vector.shape[0])
+            elif group.vectors.shape[1] != vector.shape[0]:
+                raise ValueError(f"Expected embeddings of dimension {group.vectors.shape[1]}, got {vector.shape[0]}")
+            expires = time.monotonic() + self.ttl if self.ttl else float("inf")
+            self._entries[key] = _Entry(group_key, group.add(key, vector), int(k), result, expires)
+            while len(self._entries) > self.capacity:
+                evicted_key, evicted = self._entries.popitem(last=False)
+                self._forget(evicted)
+                self.evictions += 1
+
+    def get_or_compute(self, filters, embedding, compute, k: int = 5):
+        """
+        Return the cached result of a query, running `compute()` and caching its result on a miss.
+
+        The source versions are read before `compute()` runs, so a result computed while an index
+        was being updated is returned but not cached.
+        """
+        result = self.get(filters, embedding, k)
+        if result is not None:
+            return result
+        versions = self.versions()
+        result = compute()
+        self.put(filters, embedding, k, result, versions=versions)
+        return result
+
+    def invalidate(self):
+        """Drop every cached result."""
+        with self._lock:
+            self._clear()
+            self.invalidations += 1
+
+    def stats(self) -> dict:
+        """Hit/miss/eviction counters and the current size."""
+        with self._lock:
+            lookups = self.exact_hits + self.similar_hits + self.misses
+            return {
+                "exact_hits": self.exact_hits,
+                "similar_hits": self.similar_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "invalidations": self.invalidations,
+                "hit_rate": (self.exact_hits + self.similar_hits) / lookups if lookups else 0.0,
+                "size": len(self._entries),
+            }
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    # ------------------------------------------------------------------
+    # Internals (called with the lock held)
+    # ------------------------------------------------------------------
+    def _is_live(self, key: str, entry: _Entry, now: float) -> bool:
+        if entry.expires > now:
+            return True
+        del self._entries[key]
+        self._forget(entry)
+        self.expirations += 1
+        return False
+
+    def _forget(self, entry: _Entry):
+        group = self._groups[entry.group]
+        group.remove(entry.slot)
+        if not len(group):
+            del self._groups[entry.group]
+
+    def _clear(self):
+        self._entries.clear()
+        self._groups.clear()
+
+
+def cache_from_env(sources=()) -> QueryResultCache:
+    """
+    Build the default cache from environment variables:
+    `QUERY_CACHE_SIZE` (entries, default 1024), `QUERY_CACHE_TTL` (seconds, default 300, 0 = no expiry)
+    and `QUERY_CACHE_SIMILARITY` (cosine threshold of the similarity tier, default 0.98).
+    """
+    return QueryResultCache(
+        capacity=int(os.getenv("QUERY_CACHE_SIZE", "1024")),
+        ttl=float(os.getenv("QUERY_CACHE_TTL", "300")),
+        similarity_threshold=float(os.getenv("QUERY_CACHE_SIMILARITY", "0.98")),
+        sources=sources,
+    )
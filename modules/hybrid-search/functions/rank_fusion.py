@@ -0,0 +1,194 @@
+import logging
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+RRF_K = 60
+
+
+def _as_ranked(ranked) -> tuple:
+    """Return `(ids, ranks)` as int64 arrays. Plain id arrays are ranked by position (1-based)."""
+    if isinstance(ranked, tuple) and len(ranked) == 2:
+        ids, ranks = ranked
+        return np.asarray(ids, dtype=np.int64).ravel(), np.asarray(ranks, dtype=np.float64).ravel()
+    ids = np.asarray(ranked, dtype=np.int64).ravel()
+    return ids, np.arange(1, ids.shape[0] + 1, dtype=np.float64)
+
+
+def _scatter_add(ids: np.ndarray, contrib: np.ndarray):
+    """
+    Sum `contrib` per distinct id. Dense non-negative ids go straight through `bincount`;
+    sparse/negative ids are first compacted with `unique`.
+
+    Returns:
+        tuple[np.ndarray, np.ndarray, np.ndarray]: `(unique_ids, sums, inverse)`.
+    """
+    if ids.shape[0] == 0:
+        return ids, np.empty(0, dtype=np.float64), ids
+    lo, hi = int(ids.min()), int(ids.max())
+    if lo >= 0 and hi < 4 * ids.shape[0] + 1024:
+        sums = np.bincount(ids, weights=contrib, minlength=hi + 1)
+        present = np.bincount(ids, minlength=hi + 1) > 0
+        unique_ids = np.flatnonzero(present)
+        # inverse: vị trí của từng id trong unique_ids
+        slot = np.cumsum(present) - 1
+        return unique_ids, sums[unique_ids], slot[ids]
+    unique_ids, inverse = np.unique(ids, return_inverse=True)
+    return unique_ids, np.bincount(inverse, weights=contrib), inverse
+
+
+def _select_top(ids: np.ndarray, scores: np.ndarray, top_k: int):
+    """Partial selection of the top_k highest scores, ties broken by smaller id."""
+    if ids.shape[0] > top_k:
+        top = np.argpartition(-scores, top_k - 1)[:top_k]
+    else:
+        top = np.arange(ids.shape[0])
+    top = top[np.lexsort((ids[top], -scores[top]))]
+    return ids[top], scores[top]
+
+
+def reciprocal_rank_fusion(ranked_lists, k: int = RRF_K, top_k: int = 5, weights=None):
+    """
+    Fuse any number of ranked lists with Reciprocal Rank Fusion (Appendix A of the README):
+    score(d) = sum_r w_r / (k + rank_r(d)).
+
+    Args:
+        ranked_lists (list): Each entry is either an id array ordered best-first (rank = position,
+                             starting at 1) or an `(ids, ranks)` tuple of arrays.
+        k (int): RRF constant.
+        top_k (int): Number of fused results to return.
+        weights (list): Optional per-list weights (default 1.0).
+
+    Returns:
+        tuple[np.ndarray, np.ndarray]: `(ids, scores)` sorted by descending RRF score.
+    """
+    ids_parts, contrib_parts = [], []
+    for i, ranked in enumerate(ranked_lists):
+        ids, ranks = _as_ranked(ranked)
+        weight = 1.0 if weights is None else float(weights[i])
+        ids_parts.append(ids)
+        contrib_parts.append(weight / (k + ranks))
+    if not ids_parts:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float64)
+
+    unique_ids, scores, _ = _scatter_add(np.concatenate(ids_parts), np.concatenate(contrib_parts))
+    return _select_top(unique_ids, scores, top_k)
+
+
+class StreamingRRF:
+    """
+    Reciprocal Rank Fusion over lazily produced ranked lists, with early termination.
+
+    Lists are consumed round-robin in geometrically growing chunks. After every round the
+    fused scores seen so far are lower bounds, and `lower + sum of 1/(k + next_rank)` over the
+    lists a document has not appeared in yet is an upper bound (a document not seen at all is
+    bounded by the sum over all lists). Consumption stops as soon as no unseen contribution can
+    change the membership or the order of the top_k, so deep candidate lists are only read
+    as far as needed.
+
+    Returned scores are the lower bounds at the time of stopping; the ranking itself is exact.
+    """
+
+    def __init__(self, k: int = RRF_K, top_k: int = 5, weights=None, initial_chunk: int = None):
+        self.k = k
+        self.top_k = top_k
+        self.weights = weights
+        self.initial_chunk = initial_chunk or max(16, 2 * top_k)
+        self.consumed = 0  # số phần tử đã đọc, để theo dõi mức tiết kiệm khi dừng sớm
+
+    @staticmethod
+    def _chunks(ranked, first: int):
+        """Yield `(ids, ranks)` chunks from an array, an `(ids, ranks)` tuple or an iterable of chunks."""
+        materialized = isinstance(ranked, np.ndarray) or (isinstance(ranked, tuple) and len(ranked) == 2) \
+            or (isinstance(ranked, list) and (not ranked or np.isscalar(ranked[0])))
+        if materialized:
+            ids, ranks = _as_ranked(ranked)
+            start, size = 0, first
+            while start < ids.shape[0]:
+                yield ids[start:start + size], ranks[start:start + size]
+                start += size
+                size *= 2
+            return
+        position = 0
+        for chunk in ranked:
+            ids, ranks = _as_ranked(chunk)
+            if not (isinstance(chunk, tuple) and len(chunk) == 2):
+                ranks = ranks + position
+            position += ids.shape[0]
+            yield ids, ranks
+
+    def fuse(self, ranked_lists):
+        """
+        Fuse ranked lists that may be lazy.
+
+        Args:
+            ranked_lists (list): Entries may be id arrays, `(ids, ranks)` tuples, or iterables
+                                 (e.g. generators) yielding such chunks best-first.
+
+        Returns:
+            tuple[np.ndarray, np.ndarray]: `(ids, scores)` of the top_k, best first.
+        """
+        n_lists = len(ranked_lists)
+        streams = [self._chunks(r, self.initial_chunk) for r in ranked_lists]
+        weights = np.ones(n_lists) if self.weights is None else np.asarray(self.weights, dtype=np.float64)
+        # Cận trên cho đóng góp tiếp theo của mỗi danh sách (0 khi đã đọc hết)
+        next_bound = weights / (self.k + 1.0)
+        # Các chunk được giữ theo từng danh sách để tổng điểm được cộng theo đúng thứ tự như
+        # reciprocal_rank_fusion: điểm bằng nhau phải bằng nhau đến từng bit thì tie-break mới khớp
+        ids_parts = [[] for _ in range(n_lists)]
+        contrib_parts = [[] for _ in range(n_lists)]
+        self.consumed = 0
+
+        while True:
+            for i, stream in enumerate(streams):
+                if next_bound[i] == 0.0:
+                    continue
+                chunk = next(stream, None)
+                # Chỉ StopIteration mới là hết danh sách; chunk rỗng giữa chừng thì đọc tiếp
+                while chunk is not None and chunk[0].shape[0] == 0:
+                    chunk = next(stream, None)
+                if chunk is None:
+                    next_bound[i] = 0.0
+                    continue
+                ids, ranks = chunk
+                ids_parts[i].append(ids)
+                contrib_parts[i].append(weights[i] / (self.k + ranks))
+                self.consumed += ids.shape[0]
+                # Cho phép rank bằng nhau nên rank tiếp theo >= rank cuối cùng
+                next_bound[i] = weights[i] / (self.k + ranks[-1])
+
+            if not any(ids_parts):
+                return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float64)
+            all_ids = np.concatenate([ids for parts in ids_parts for ids in parts])
+            list_of = np.repeat(np.arange(n_lists), [sum(ids.shape[0] for ids in parts) for parts in ids_parts])
+            all_contrib = np.concatenate([c for parts in contrib_parts for c in parts])
+            unique_ids, lower, inverse = _scatter_add(all_ids, all_contrib)
+            if not next_bound.any():
+                return _select_top(unique_ids, lower, self.top_k)
+            if self._is_settled(unique_ids, lower, inverse, list_of, next_bound):
+                logger.debug(f"RRF dừng sớm sau {self.consumed} phần tử.")
+                return _select_top(unique_ids, lower, self.top_k)
+
+    def _is_settled(self, unique_ids, lower, inverse, list_of, next_bound) -> bool:
+        n_lists = next_bound.shape[0]
+        seen = np.zeros((unique_ids.shape[0], n_lists), dtype=bool)
+        seen[inverse, list_of] = True
+        upper = lower + (~seen) @ next_bound
+        unseen_upper = next_bound.sum()
+
+        if unique_ids.shape[0] < self.top_k:
+            return False
+        top_ids, _ = _select_top(unique_ids, lower, self.top_k)
+        top = np.searchsorted(unique_ids, top_ids)  # unique_ids luôn được sắp xếp tăng dần
+        rest = np.ones(unique_ids.shape[0], dtype=bool)
+        rest[top] = False
+
+        # So sánh chặt: khi điểm có thể bằng nhau, tie-break theo id nhỏ hơn có thể đảo thứ tự
+        # 1) Không tài liệu nào ngoài top_k có thể bằng hoặc vượt qua tài liệu thứ k
+        outside = max(unseen_upper, upper[rest].max() if rest.any() else 0.0)
+        if lower[top[-1]] <= outside:
+            return False
+        # 2) Thứ tự trong top_k đã cố định: lower[i] > max(upper[j]) với mọi j đứng sau i
+        tail_max = np.maximum.accumulate(upper[top][::-1])[::-1]
+        return bool(np.all(lower[top][:-1] > tail_max[1:]))
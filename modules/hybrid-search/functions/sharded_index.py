@@ -0,0 +1,526 @@
+import json
+import logging
+import multiprocessing
+import os
+import shutil
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import numpy as np
+
+from .keyword_index import KeywordIndex, normalize_value
+from .rank_fusion import RRF_K, reciprocal_rank_fusion
+from .vector_index import METRICS, IVFFlatIndex, to_numpy_embeddings
+
+logger = logging.getLogger(__name__)
+
+SHARD_FORMAT_VERSION = 1
+SHARD_STRATEGIES = ("hash", "type")
+MEDIA_TYPES = ("image", "video", "audio", "text")
+# Số generation cũ giữ lại trên đĩa cho các worker còn đang đọc bản trước
+KEEP_GENERATIONS = 2
+
+_EMPTY_IDS = np.empty(0, dtype=np.int64)
+_EMPTY_SCORES = np.empty(0, dtype=np.float32)
+
+
+def hash_shard(doc_ids, n_shards: int) -> np.ndarray:
+    """Shard of each id: multiplicative (Fibonacci) hash, so consecutive ids spread evenly."""
+    h = np.asarray(doc_ids, dtype=np.int64).astype(np.uint64) * np.uint64(0x9E3779B97F4A7C15)
+    return ((h >> np.uint64(32)) % np.uint64(n_shards)).astype(np.int64)
+
+
+def _document_type(document) -> str:
+    """`type` of a document, top-level or inside a nested `keywords` dict / JSON string (as from `process_prompt`)."""
+    if not document:
+        return None
+    keywords = document.get("keywords") or {}
+    if isinstance(keywords, str):
+        keywords = json.loads(keywords)
+    value = document.get("type") or keywords.get("type")
+    return normalize_value(value) if isinstance(value, str) and value.strip() else None
+
+
+# =========================================================================================
+# Per-shard search (shared by the in-process path and the worker processes)
+# =========================================================================================
+def _query_shard(vector, keyword, query, keywords, text, k: int, nprobe: int):
+    """Top-k of one shard: `((vector_ids, distances), (keyword_ids, scores))`."""
+    if query is not None and vector is not None and len(vector):
+        ids, dist = vector.search(query, k=k, nprobe=nprobe)
+        found = ids[0] >= 0
+        vector_hits = (ids[0][found], dist[0][found])
+    else:
+        vector_hits = (_EMPTY_IDS, _EMPTY_SCORES)
+    if keywords or text:
+        keyword_hits = keyword.search_keywords(keywords, text=text, k=k)
+    else:
+        keyword_hits = (_EMPTY_IDS, _EMPTY_SCORES)
+    return vector_hits, keyword_hits
+
+
+def _load_generation(directory: Path):
+    vector = IVFFlatIndex.load(directory / "vector", mmap=True) if (directory / "vector").exists() else None
+    return vector, KeywordIndex.load(directory / "keyword")
+
+
+# Cache của từng worker: thư mục shard -> (thư mục generation, IVFFlatIndex | None, KeywordIndex)
+_WORKER_SHARDS = {}
+
+
+def _search_shard_worker(shard_dir: str, generation_dir: str, query, keywords, text, k: int, nprobe: int):
+    """Runs in a pool process: memory-maps the saved generation of a shard once, then queries it."""
+    cached = _WORKER_SHARDS.get(shard_dir)
+    if cached is None or cached[0] != generation_dir:
+        cached = _WORKER_SHARDS[shard_dir] = (generation_dir, *_load_generation(Path(generation_dir)))
+    return _query_shard(cached[1], cached[2], query, keywords, text, k, nprobe)
+
+
+def _merge(parts: list, k: int, ascending: bool):
+    """Global top-k of per-shard `(ids, scores)` lists (shards hold disjoint ids), ties by smaller id."""
+    parts = [p for p in parts if p[0].shape[0]]
+    if not parts:
+        return _EMPTY_IDS, _EMPTY_SCORES
+    ids = np.concatenate([p[0] for p in parts])
+    scores = np.concatenate([p[1] for p in parts])
+    order = np.lexsort((ids, scores if ascending else -scores))[:k]
+    return ids[order], scores[order]
+
+
+# =========================================================================================
+# Shard
+# =========================================================================================
+class _Shard:
+    """One partition: an IVF vector index plus a keyword index, saved as numbered generations."""
+
+    def __init__(self, path: Path, metric: str, nlist: int, nprobe: int):
+        self.path = path
+        self.metric = metric
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.vector = None               # IVFFlatIndex, huấn luyện ở lần upsert đầu tiên
+        self.keyword = KeywordIndex()
+        self.trained_size = 0            # số vector lúc huấn luyện IVF gần nhất
+        self.generation = 0              # 0 = chưa lưu xuống đĩa
+        self.dirty = False               # có thay đổi chưa lưu -> tìm kiếm trong tiến trình chính
+        self.lock = threading.RLock()
+
+    @property
+    def generation_dir(self) -> Path:
+        return self.path / f"gen-{self.generation:06d}"
+
+    @property
+    def version(self) -> tuple:
+        return (self.vector.version if self.vector is not None else 0, self.keyword.version)
+
+    def deleted_ratio(self) -> float:
+        rows = (self.vector.ids.shape[0] if self.vector is not None else 0) + self.keyword.doc_ids.shape[0]
+        deleted = (self.vector.n_deleted if self.vector is not None else 0) + self.keyword.n_deleted
+        return deleted / rows if rows else 0.0
+
+    # ------------------------------------------------------------------
+    # Writes (called with the lock held)
+    # ------------------------------------------------------------------
+    def upsert(self, ids: np.ndarray, vectors: np.ndarray = None, documents: list = None):
+        if vectors is not None:
+            if self.vector is None:
+                self.vector = IVFFlatIndex.build(vectors, ids, metric=self.metric, nlist=self.nlist,
+                                                 nprobe=self.nprobe)
+                self.trained_size = ids.shape[0]
+            else:
+                self.vector.upsert(vectors, ids)
+        if documents is not None:
+            self.keyword.upsert_documents(zip(ids.tolist(), documents)).commit()
+        self.dirty = True
+
+    def live_vectors(self, ids: np.ndarray):
+        """`(ids, vectors)` of the live vectors among `ids` (as stored, i.e. normalized for cosine)."""
+        if self.vector is None or ids.shape[0] == 0:
+            return _EMPTY_IDS, None
+        hits = np.isin(np.asarray(self.vector.ids), ids) & self.vector.alive
+        return np.asarray(self.vector.ids)[hits], np.asarray(self.vector.vectors)[hits]
+
+    def delete(self, ids: np.ndarray) -> int:
+        count = self.vector.delete(ids) if self.vector is not None else 0
+        count += self.keyword.delete(ids)
+        if count:
+            self.dirty = True
+        return count
+
+    def compact(self) -> int:
+        removed = (self.vector.compact() if self.vector is not None else 0) + self.keyword.compact()
+        if removed:
+            self.dirty = True
+        return removed
+
+    def retrain(self, growth: float) -> bool:
+        """Re-cluster the IVF cells once the shard has grown `growth` times past its training size."""
+        if self.vector is None or len(self.vector) < growth * max(self.trained_size, 1):
+            return False
+        self.vector.compact()
+        size = len(self.vector)
+        # Cùng quy tắc ~4*sqrt(n) cụm như IVFFlatIndex.build khi không cố định nlist
+        self.vector.nlist = self.nlist or max(1, int(4 * np.sqrt(size)))
+        self.vector.train(self.vector.vectors)
+        self.trained_size = size
+        self.dirty = True
+        logger.info(f"Đã huấn luyện lại IVF của shard '{self.path.name}' trên {size} vector.")
+        return True
+
+    # ------------------------------------------------------------------
+    # Persistence
+    # ------------------------------------------------------------------
+    def save(self):
+        """Write a new generation directory, then switch `shard.json` to it atomically."""
+        generation = self.generation + 1
+        directory = self.path / f"gen-{generation:06d}"
+        if directory.exists():
+            shutil.rmtree(directory)
+        if self.vector is not None:
+            self.vector.save(directory / "vector")
+        self.keyword.save(directory / "keyword")
+
+        state = {"generation": generation, "trained_size": self.trained_size}
+        tmp = self.path / "shard.json.tmp"
+        tmp.write_text(json.dumps(state, indent=2), encoding="utf-8")
+        os.replace(tmp, self.path / "shard.json")
+        self.generation = generation
+        self.dirty = False
+
+        # Trên Linux, file đã xóa vẫn đọc được qua mmap của worker cho tới khi nó chuyển sang bản mới
+        for old in self.path.glob("gen-*"):
+            if int(old.name[4:]) <= generation - KEEP_GENERATIONS:
+                shutil.rmtree(old, ignore_errors=True)
+
+    @classmethod
+    def load(cls, path: Path, metric: str, nlist: int, nprobe: int):
+        shard = cls(path, metric, nlist, nprobe)
+        state_file = path / "shard.json"
+        if state_file.exists():
+            state = json.loads(state_file.read_text(encoding="utf-8"))
+            shard.generation = state["generation"]
+            shard.trained_size = state["trained_size"]
+            shard.vector, shard.keyword = _load_generation(shard.generation_dir)
+        return shard
+
+
+# =========================================================================================
+# Sharded index
+# =========================================================================================
+class ShardedIndex:
+    """
+    Hybrid (IVF vector + keyword) index split into `n_shards` partitions with live updates.
+
+    - **Routing:** `shard_by="hash"` spreads ids evenly; `shard_by="type"` puts each media type
+      of `types` in its own shard (`types.index(type) % n_shards`), documents of any other type
+      fall back to the hash. Queries filtered on a known `type` only visit the matching shards.
+    - **Updates:** `upsert` replaces a document (vector and/or keyword fields) in place and
+      `delete` tombstones it; both are searchable immediately. `compact` / the background
+      compaction thread drop tombstones, re-cluster shards that outgrew their IVF training set
+      and save dirty shards.
+    - **Search:** every shard returns its own top-k, which are merged (vectors by distance,
+      keywords by BM25 score) and fused with RRF. With `workers > 0`, saved shards are searched
+      in a process pool whose workers memory-map them, so the corpus does not have to fit in
+      one process; shards with unsaved changes are searched in the calling process.
+
+    Each shard lives in `<path>/shard-XX/gen-NNNNNN/{vector,keyword}` and is never modified in
+    place: a save writes the next generation and switches `shard.json` to it.
+    """
+
+    def __init__(self, path, n_shards: int = 4, shard_by: str = "hash", types=MEDIA_TYPES,
+                 metric: str = "cosine", nlist: int = None, nprobe: int = 8, workers: int = 0):
+        if shard_by not in SHARD_STRATEGIES:
+            raise ValueError(f"Unsupported shard_by '{shard_by}', expected one of {SHARD_STRATEGIES}")
+        if metric not in METRICS:
+            raise ValueError(f"Unsupported metric '{metric}', expected one of {METRICS}")
+        if n_shards < 1:
+            raise ValueError("n_shards must be >= 1")
+        self.path = Path(path)
+        self.n_shards = int(n_shards)
+        self.shard_by = shard_by
+        self.types = tuple(normalize_value(t) for t in types)
+        self.metric = metric
+        self.nlist = nlist
+        self.nprobe = int(nprobe)
+        self.workers = int(workers)
+        self.shards = [_Shard(self._shard_path(i), metric, nlist, self.nprobe) for i in range(self.n_shards)]
+
+        self._pool = None
+        self._pool_lock = threading.Lock()
+        self._compactor = None
+        self._stop = threading.Event()
+
+    def _shard_path(self, i: int) -> Path:
+        return self.path / f"shard-{i:02d}"
+
+    def __len__(self) -> int:
+        """Number of live ids with a vector or a keyword document."""
+        return sum(max(len(s.vector) if s.vector is not None else 0, len(s.keyword)) for s in self.shards)
+
+    @property
+    def version(self) -> tuple:
+        """Changes on every upsert / delete / compaction, for `QueryResultCache` sources."""
+        return tuple(s.version for s in self.shards)
+
+    # ------------------------------------------------------------------
+    # Routing
+    # ------------------------------------------------------------------
+    def route(self, ids, documents=None) -> np.ndarray:
+        """Target shard of each id (see the class docstring)."""
+        ids = np.asarray(ids, dtype=np.int64).reshape(-1)
+        shards = hash_shard(ids, self.n_shards)
+        if self.shard_by == "type":
+            if documents is None:
+                raise ValueError("shard_by='type' needs the documents to route an upsert")
+            for i, document in enumerate(documents):
+                doc_type = _document_type(document)
+                if doc_type in self.types:
+                    shards[i] = self.types.index(doc_type) % self.n_shards
+        return shards
+
+    def _shards_for(self, keywords) -> list:
+        """Shards that can hold results for the `type` filter of a query (all of them if unknown)."""
+        if self.shard_by != "type" or not keywords:
+            return self.shards
+        value = keywords.get("type")
+        wanted = [normalize_value(v) for v in (value if isinstance(value, (list, tuple, set)) else [value]) if v]
+        if not wanted or any(t not in self.types for t in wanted):
+            return self.shards
+        return [self.shards[i] for i in sorted({self.types.index(t) % self.n_shards for t in wanted})]
+
+    # ------------------------------------------------------------------
+    # Writes
+    # ------------------------------------------------------------------
+    def upsert(self, ids, vectors=None, documents=None):
+        """
+        Insert or replace documents.
+
+        Args:
+            ids: int64 external ids (e.g. `contents.id`), unique within the call.
+            vectors: Optional embeddings, shape [n, dim].
+            documents (list[dict]): Optional keyword documents aligned with `ids`, see
+                                    `KeywordIndex.add_document`. Required when `shard_by='type'`.
+        """
+        ids = np.asarray(ids, dtype=np.int64).reshape(-1)
+        if np.unique(ids).shape[0] != ids.shape[0]:
+            raise ValueError("upsert ids must be unique")
+        x = to_numpy_embeddings(vectors) if vectors is not None else None
+        documents = list(documents) if documents is not None else None
+        if (x is not None and x.shape[0] != ids.shape[0]) or (documents is not None and len(documents) != ids.shape[0]):
+            raise ValueError("ids, vectors and documents must have the same length")
+
+        targets = self.route(ids, documents)
+        moved_ids, moved_vectors = [], []
+        if self.shard_by == "type":
+            # Đổi type thì đổi shard: xóa bản cũ ở các shard khác. Upsert không kèm vectors thì
+            # vector cũ được chuyển sang shard mới cùng document, thay vì bị xóa mất
+            for i, shard in enumerate(self.shards):
+                leaving = ids[targets != i]
+                with shard.lock:
+                    if x is None:
+                        found, found_vectors = shard.live_vectors(leaving)
+                        if found.shape[0]:
+                            moved_ids.append(found)
+                            moved_vectors.append(found_vectors)
+                    shard.delete(leaving)
+        moved_ids = np.concatenate(moved_ids) if moved_ids else _EMPTY_IDS
+        for i, shard in enumerate(self.shards):
+            mask = targets == i
+            if not mask.any():
+                continue
+            rows = np.flatnonzero(mask)
+            with shard.lock:
+                shard.upsert(ids[rows], x[rows] if x is not None else None,
+                             [documents[r] for r in rows] if documents is not None else None)
+                carried = np.isin(moved_ids, ids[rows])
+                if carried.any():
+                    shard.upsert(moved_ids[carried], np.concatenate(moved_vectors)[carried])
+        return self
+
+    def delete(self, ids) -> int:
+        """Tombstone the given ids in every shard. Returns the number of vectors + documents deleted."""
+        ids = np.asarray(ids, dtype=np.int64).reshape(-1)
+        count = 0
+        for shard in self.shards:
+            with shard.lock:
+                count += shard.delete(ids)
+        return count
+
+    # ------------------------------------------------------------------
+    # Maintenance
+    # ------------------------------------------------------------------
+    def flush(self) -> int:
+        """Save every shard with unsaved changes (and the index config). Returns the number saved."""
+        self.path.mkdir(parents=True, exist_ok=True)
+        meta = {
+            "format_version": SHARD_FORMAT_VERSION,
+            "n_shards": self.n_shards,
+            "shard_by": self.shard_by,
+            "types": list(self.types),
+            "metric": self.metric,
+            "nlist": self.nlist,
+            "nprobe": self.nprobe,
+        }
+        (self.path / "meta.json").write_text(json.dumps(meta, indent=2), encoding="utf-8")
+        saved = 0
+        for shard in self.shards:
+            with shard.lock:
+                if shard.dirty:
+                    shard.path.mkdir(parents=True, exist_ok=True)
+                    shard.save()
+                    saved += 1
+        return saved
+
+    def compact(self, min_deleted_ratio: float = 0.0, retrain_growth: float = 4.0, flush: bool = True) -> dict:
+        """
+        Compact shards whose share of tombstones is at least `min_deleted_ratio`, re-cluster those
+        that grew `retrain_growth` times past their IVF training size, then `flush`.
+
+        Returns:
+            dict: {"removed", "retrained", "saved"}.
+        """
+        removed = retrained = 0
+        for shard in self.shards:
+            with shard.lock:
+                ratio = shard.deleted_ratio()
+                if ratio > 0 and ratio >= min_deleted_ratio:
+                    removed += shard.compact()
+                retrained += shard.retrain(retrain_growth)
+        saved = self.flush() if flush else 0
+        if removed or retrained:
+            logger.info(f"Compact: xóa {removed} tombstone, huấn luyện lại {retrained} shard, lưu {saved} shard.")
+        return {"removed": removed, "retrained": retrained, "saved": saved}
+
+    def start_compaction(self, interval: float = 60.0, min_deleted_ratio: float = 0.2, retrain_growth: float = 4.0):
+        """Run `compact` every `interval` seconds in a daemon thread until `stop_compaction` / `close`."""
+        if self._compactor is not None and self._compactor.is_alive():
+            return
+        self._stop.clear()
+
+        def run():
+            while not self._stop.wait(interval):
+                try:
+                    self.compact(min_deleted_ratio, retrain_growth)
+                except Exception:
+                    logger.exception("Lỗi khi compact sharded index.")
+
+        self._compactor = threading.Thread(target=run, name="shard-compaction", daemon=True)
+        self._compactor.start()
+
+    def stop_compaction(self):
+        if self._compactor is not None:
+            self._stop.set()
+            self._compactor.join()
+            self._compactor = None
+
+    def close(self):
+        """Stop the compaction thread, save pending changes and shut the worker pool down."""
+        self.stop_compaction()
+        self.flush()
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    # ------------------------------------------------------------------
+    # Search
+    # ------------------------------------------------------------------
+    def _executor(self):
+        with self._pool_lock:
+            if self._pool is None:
+                # spawn: fork một tiến trình đang có thread (compaction) dễ bị deadlock
+                self._pool = ProcessPoolExecutor(max_workers=self.workers,
+                                                 mp_context=multiprocessing.get_context("spawn"))
+            return self._pool
+
+    def _scatter(self, query, keywords, text, k: int, nprobe: int):
+        """Per-shard top-k of every relevant shard: saved shards in the pool, the others here."""
+        if isinstance(keywords, str):
+            keywords = json.loads(keywords)
+        if query is not None:
+            query = to_numpy_embeddings(query)[:1]
+        futures, local = [], []
+        for shard in self._shards_for(keywords):
+            with shard.lock:
+                if self.workers > 0 and not shard.dirty and shard.generation:
+                    futures.append(self._executor().submit(
+                        _search_shard_worker, str(shard.path), str(shard.generation_dir),
+                        query, keywords, text, k, nprobe))
+                else:
+                    local.append(shard)
+        results = []
+        for shard in local:
+            with shard.lock:
+                results.append(_query_shard(shard.vector, shard.keyword, query, keywords, text, k, nprobe))
+        results.extend(future.result() for future in futures)
+        return results
+
+    def search_vectors(self, query_embedding, k: int = 5, nprobe: int = None):
+        """
+        Approximate k nearest neighbours across all shards.
+
+        Returns:
+            tuple[np.ndarray, np.ndarray]: `(ids, distances)`, 1-D, sorted by ascending distance.
+        """
+        results = self._scatter(query_embedding, None, None, k, nprobe)
+        return _merge([r[0] for r in results], k, ascending=True)
+
+    def search_keywords(self, keywords, text: str = None, k: int = 5):
+        """
+        Keyword search across the shards that can match the `type` filter.
+
+        Returns:
+            tuple[np.ndarray, np.ndarray]: `(ids, scores)` sorted by descending BM25 score.
+            BM25 statistics (document count, average length) are per shard.
+        """
+        results = self._scatter(None, keywords, text, k, None)
+        return _merge([r[1] for r in results], k, ascending=False)
+
+    def search(self, query_embedding=None, keywords=None, text: str = None, k: int = 5, fanout_k: int = None,
+               nprobe: int = None, rrf_k: int = RRF_K):
+        """
+        Hybrid search: one scatter-gather pass for both the vector and the keyword side, merge
+        of the per-shard top `fanout_k` (default `k`), then Reciprocal Rank Fusion.
+
+        Args:
+            query_embedding: Query embedding ([dim] or [1, dim]), or None for keyword-only search.
+            keywords (dict | str): Output of `extract_keywords`, see `KeywordIndex.search_keywords`.
+            text (str): Optional free text for BM25 (e.g. the normalized prompt).
+            k (int): Number of fused results.
+            fanout_k (int): Candidates taken from every shard and from each side before fusion.
+            nprobe (int): IVF cells scanned per shard.
+            rrf_k (int): RRF constant.
+
+        Returns:
+            tuple[np.ndarray, np.ndarray]: `(ids, scores)` sorted by descending RRF score.
+        """
+        fanout_k = max(k, fanout_k or k)
+        results = self._scatter(query_embedding, keywords, text, fanout_k, nprobe)
+        vector_ids, _ = _merge([r[0] for r in results], fanout_k, ascending=True)
+        keyword_ids, _ = _merge([r[1] for r in results], fanout_k, ascending=False)
+        return reciprocal_rank_fusion([vector_ids, keyword_ids], k=rrf_k, top_k=k)
+
+    # ------------------------------------------------------------------
+    # Persistence
+    # ------------------------------------------------------------------
+    @classmethod
+    def load(cls, path, workers: int = 0):
+        """
+        Open an index saved with `flush` / `close`. The vector arrays are memory-mapped; a shard
+        is only read into memory once it is updated.
+        """
+        path = Path(path)
+        meta = json.loads((path / "meta.json").read_text(encoding="utf-8"))
+        if meta.get("format_version") != SHARD_FORMAT_VERSION:
+            raise ValueError(f"Unsupported sharded index format version: {meta.get('format_version')}")
+        index = cls(path, n_shards=meta["n_shards"], shard_by=meta["shard_by"], types=meta["types"],
+                    metric=meta["metric"], nlist=meta["nlist"], nprobe=meta["nprobe"], workers=workers)
+        index.shards = [_Shard.load(index._shard_path(i), index.metric, index.nlist, index.nprobe)
+                        for i in range(index.n_shards)]
+        return index
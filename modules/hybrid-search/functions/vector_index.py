@@ -0,0 +1,447 @@
+import itertools
+import json
+import logging
+from pathlib import Path
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+METRICS = ("cosine", "l2")
+INDEX_FORMAT_VERSION = 1
+
+# Bộ đếm phiên bản dùng chung cho mọi index trong process: mỗi lần một index được tạo, tải
+# hoặc thay đổi nó nhận một số mới, nên cache kết quả (query_cache) phát hiện mọi thay đổi.
+_versions = itertools.count(1)
+
+
+def next_version() -> int:
+    """Returns a process-wide unique, increasing version number for a changed index."""
+    return next(_versions)
+
+
+def to_numpy_embeddings(vectors) -> np.ndarray:
+    """
+    Convert embeddings into a contiguous float32 matrix of shape [n, dim].
+
+    Accepts a NumPy array, a torch tensor (e.g. the [1, 768] CLS tensor returned by
+    `get_phobert_sentence_embedding`) or a list of either.
+
+    Args:
+        vectors: The embeddings to convert.
+
+    Returns:
+        np.ndarray: A C-contiguous float32 matrix.
+    """
+    if isinstance(vectors, (list, tuple)):
+        if len(vectors) == 0:
+            return np.empty((0, 0), dtype=np.float32)
+        vectors = np.concatenate([to_numpy_embeddings(v) for v in vectors], axis=0)
+    if hasattr(vectors, "detach"):  # torch.Tensor
+        vectors = vectors.detach().cpu().numpy()
+    arr = np.asarray(vectors, dtype=np.float32)
+    if arr.ndim == 1:
+        arr = arr[None, :]
+    if arr.ndim != 2:
+        raise ValueError(f"Embeddings must be 1-D or 2-D, got shape {arr.shape}")
+    return np.ascontiguousarray(arr)
+
+
+def _l2_normalize(x: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(x, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return x / norms
+
+
+def _squared_l2(x: np.ndarray, c: np.ndarray, c_sq: np.ndarray) -> np.ndarray:
+    """Pairwise squared L2 distances between rows of x and rows of c."""
+    x_sq = np.einsum("ij,ij->i", x, x)[:, None]
+    d = x_sq - 2.0 * (x @ c.T) + c_sq[None, :]
+    np.maximum(d, 0.0, out=d)
+    return d
+
+
+def _assign_nearest(x: np.ndarray, centroids: np.ndarray, centroid_sq: np.ndarray,
+                    chunk_size: int = 65536) -> np.ndarray:
+    """Return the nearest centroid of every row of x, computed in chunks to bound memory."""
+    labels = np.empty(x.shape[0], dtype=np.int64)
+    for start in range(0, x.shape[0], chunk_size):
+        block = x[start:start + chunk_size]
+        labels[start:start + chunk_size] = _squared_l2(block, centroids, centroid_sq).argmin(axis=1)
+    return labels
+
+
+def kmeans(x: np.ndarray, k: int, n_iter: int = 20, seed: int = 0, spherical: bool = False) -> np.ndarray:
+    """
+    Lloyd's k-means on a float32 matrix.
+
+    Args:
+        x: Training points, shape [n, dim] with n >= k.
+        k (int): Number of centroids.
+        n_iter (int): Number of Lloyd iterations.
+        seed (int): Random seed for initialization and re-seeding of empty clusters.
+        spherical (bool): L2-normalize the centroids after every update (cosine k-means).
+
+    Returns:
+        np.ndarray: Centroids, shape [k, dim].
+    """
+    rng = np.random.default_rng(seed)
+    centroids = x[rng.choice(x.shape[0], k, replace=False)].copy()
+    for _ in range(n_iter):
+        labels = _assign_nearest(x, centroids, np.einsum("ij,ij->i", centroids, centroids))
+
+        # Cộng theo cụm bằng sort + reduceat, nhanh hơn nhiều so với np.add.at
+        order = np.argsort(labels, kind="stable")
+        counts = np.bincount(labels, minlength=k).astype(np.float32)
+        present = np.flatnonzero(counts)
+        sums = np.zeros_like(centroids)
+        sums[present] = np.add.reduceat(x[order], (np.cumsum(counts) - counts)[present].astype(np.int64), axis=0)
+
+        empty = counts == 0
+        if empty.any():
+            # Gieo lại các cụm rỗng bằng các điểm ngẫu nhiên
+            sums[empty] = x[rng.choice(x.shape[0], int(empty.sum()), replace=False)]
+            counts[empty] = 1.0
+        centroids = sums / counts[:, None]
+        if spherical:
+            centroids = _l2_normalize(centroids)
+    return np.ascontiguousarray(centroids, dtype=np.float32)
+
+
+def _top_k(distances: np.ndarray, k: int) -> np.ndarray:
+    """Return the positions of the k smallest distances, sorted ascending."""
+    if k >= distances.shape[0]:
+        return np.argsort(distances, kind="stable")
+    part = np.argpartition(distances, k - 1)[:k]
+    return part[np.argsort(distances[part], kind="stable")]
+
+
+class IVFFlatIndex:
+    """
+    Inverted-file (IVF-flat) approximate nearest neighbour index over NumPy arrays.
+
+    Vectors are clustered with k-means into `nlist` coarse cells. At query time only
+    the `nprobe` cells closest to the query are scanned exhaustively, so `nprobe` is the
+    recall/latency knob: `nprobe == nlist` is an exact search, small values trade recall
+    for lower (p99) latency.
+
+    The packed layout (vectors sorted by cell + an offsets array) is written as plain
+    `.npy` files, so `load(..., mmap=True)` answers queries straight from the page cache
+    without reading the whole corpus into memory.
+    """
+
+    def __init__(self, dim: int, metric: str = "cosine", nlist: int = 1024, nprobe: int = 8):
+        if metric not in METRICS:
+            raise ValueError(f"Unsupported metric '{metric}', expected one of {METRICS}")
+        self.dim = int(dim)
+        self.metric = metric
+        self.nlist = int(nlist)
+        self.nprobe = int(nprobe)
+
+        self.centroids = None          # [nlist, dim]
+        self._centroid_sq = None       # [nlist]
+        self.vectors = np.empty((0, self.dim), dtype=np.float32)  # sorted by cell
+        self.ids = np.empty(0, dtype=np.int64)                    # same order as vectors
+        self.offsets = np.zeros(1, dtype=np.int64)                # cell i -> vectors[offsets[i]:offsets[i+1]]
+        self.alive = np.ones(0, dtype=bool)                       # False = tombstone (đã xóa, chờ compact)
+        self.n_deleted = 0
+        self.version = next_version()                              # đổi sau mỗi train/add
+
+    # ------------------------------------------------------------------
+    # Properties
+    # ------------------------------------------------------------------
+    @property
+    def is_trained(self) -> bool:
+        return self.centroids is not None
+
+    def __len__(self) -> int:
+        """Number of live (not deleted) vectors."""
+        return int(self.ids.shape[0]) - self.n_deleted
+
+    # ------------------------------------------------------------------
+    # Build
+    # ------------------------------------------------------------------
+    def _prepare(self, vectors) -> np.ndarray:
+        x = to_numpy_embeddings(vectors)
+        if x.shape[1] != self.dim:
+            raise ValueError(f"Expected vectors of dimension {self.dim}, got {x.shape[1]}")
+        if self.metric == "cosine":
+            x = _l2_normalize(x)
+        return np.ascontiguousarray(x, dtype=np.float32)
+
+    def _assign(self, x: np.ndarray) -> np.ndarray:
+        return _assign_nearest(x, self.centroids, self._centroid_sq)
+
+    def train(self, vectors, n_iter: int = 20, max_points_per_centroid: int = 256, seed: int = 0):
+        """
+        Learn the coarse quantizer with k-means (spherical k-means for cosine).
+
+        Args:
+            vectors: Training vectors, shape [n, dim].
+            n_iter (int): Number of Lloyd iterations.
+            max_points_per_centroid (int): Training is run on a random sample of at most
+                                           `nlist * max_points_per_centroid` vectors.
+            seed (int): Random seed for sampling and initialization.
+        """
+        x = self._prepare(vectors)
+        if x.shape[0] == 0:
+            raise ValueError("Cannot train an index on an empty set of vectors")
+
+        rng = np.random.default_rng(seed)
+        nlist = min(self.nlist, x.shape[0])
+        sample_size = min(x.shape[0], nlist * max_points_per_centroid)
+        if sample_size < x.shape[0]:
+            x = x[rng.choice(x.shape[0], sample_size, replace=False)]
+
+        centroids = kmeans(x, nlist, n_iter=n_iter, seed=int(rng.integers(2**31)),
+                           spherical=self.metric == "cosine")
+
+        self.nlist = nlist
+        self.centroids = centroids
+        self._centroid_sq = np.einsum("ij,ij->i", self.centroids, self.centroids)
+        if self.ids.shape[0]:
+            # Huấn luyện lại index đã có vector: gán lại các vector đã lưu vào cụm mới rồi sắp xếp lại
+            stored = np.asarray(self.vectors)
+            labels = self._assign(stored)
+            order = np.argsort(labels, kind="stable")
+            self.vectors = np.ascontiguousarray(stored[order])
+            self.ids = np.asarray(self.ids)[order]
+            self.alive = self.alive[order]
+            counts = np.bincount(labels, minlength=self.nlist)
+            self.offsets = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+        else:
+            self.offsets = np.zeros(self.nlist + 1, dtype=np.int64)
+        self.version = next_version()
+        logger.info(f"Đã huấn luyện IVF index với {self.nlist} cụm trên {x.shape[0]} vector.")
+        return self
+
+    def add(self, vectors, ids=None):
+        """
+        Add vectors to a trained index.
+
+        Args:
+            vectors: Vectors to add, shape [n, dim].
+            ids: Optional int64 external ids. Defaults to consecutive ids after the current size.
+        """
+        if not self.is_trained:
+            raise RuntimeError("Index must be trained before adding vectors")
+        x = self._prepare(vectors)
+        if ids is None:
+            start = int(self.ids.max()) + 1 if self.ids.shape[0] else 0
+            ids = np.arange(start, start + x.shape[0], dtype=np.int64)
+        ids = np.asarray(ids, dtype=np.int64)
+        if ids.shape[0] != x.shape[0]:
+            raise ValueError("ids and vectors must have the same length")
+
+        labels = self._assign(x)
+        old_labels = np.repeat(np.arange(self.nlist, dtype=np.int64), np.diff(self.offsets))
+
+        all_labels = np.concatenate([old_labels, labels])
+        order = np.argsort(all_labels, kind="stable")
+        self.vectors = np.ascontiguousarray(np.concatenate([np.asarray(self.vectors), x])[order])
+        self.ids = np.concatenate([np.asarray(self.ids), ids])[order]
+        self.alive = np.concatenate([self.alive, np.ones(ids.shape[0], dtype=bool)])[order]
+        counts = np.bincount(all_labels, minlength=self.nlist)
+        self.offsets = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+        self.version = next_version()
+        return self
+
+    def delete(self, ids) -> int:
+        """
+        Tombstone every vector with one of the given ids. Deleted vectors are skipped by `search`
+        and physically removed by `compact`.
+
+        Returns:
+            int: Number of vectors deleted.
+        """
+        ids = np.unique(np.asarray(ids, dtype=np.int64).reshape(-1))
+        if ids.shape[0] == 0 or self.ids.shape[0] == 0:
+            return 0
+        hits = np.isin(np.asarray(self.ids), ids) & self.alive
+        count = int(hits.sum())
+        if count:
+            self.alive[hits] = False
+            self.n_deleted += count
+            self.version = next_version()
+        return count
+
+    def upsert(self, vectors, ids):
+        """Insert vectors, replacing any live vector with the same id (delete + add)."""
+        ids = np.asarray(ids, dtype=np.int64)
+        if np.unique(ids).shape[0] != ids.shape[0]:
+            raise ValueError("upsert ids must be unique")
+        self.delete(ids)
+        return self.add(vectors, ids)
+
+    def compact(self) -> int:
+        """
+        Physically remove tombstoned vectors and rebuild the offsets.
+
+        Returns:
+            int: Number of vectors removed.
+        """
+        removed = self.n_deleted
+        if not removed:
+            return 0
+        keep = self.alive
+        labels = np.repeat(np.arange(self.nlist, dtype=np.int64), np.diff(self.offsets))[keep]
+        self.vectors = np.ascontiguousarray(np.asarray(self.vectors)[keep])
+        self.ids = np.asarray(self.ids)[keep]
+        counts = np.bincount(labels, minlength=self.nlist)
+        self.offsets = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+        self.alive = np.ones(self.ids.shape[0], dtype=bool)
+        self.n_deleted = 0
+        self.version = next_version()
+        return removed
+
+    @classmethod
+    def build(cls, vectors, ids=None, metric: str = "cosine", nlist: int = None, nprobe: int = 8, **train_kwargs):
+        """
+        Train an index and add all vectors in one call.
+
+        Args:
+            vectors: Corpus embeddings, shape [n, dim].
+            ids: Optional int64 external ids.
+            metric (str): 'cosine' or 'l2'.
+            nlist (int): Number of cells. Defaults to ~4*sqrt(n), the usual IVF rule of thumb.
+            nprobe (int): Default number of cells scanned per query.
+
+        Returns:
+            IVFFlatIndex: The built index.
+        """
+        x = to_numpy_embeddings(vectors)
+        if nlist is None:
+            nlist = max(1, int(4 * np.sqrt(x.shape[0])))
+        index = cls(x.shape[1], metric=metric, nlist=nlist, nprobe=nprobe)
+        index.train(x, **train_kwargs)
+        index.add(x, ids)
+        return index
+
+    # ------------------------------------------------------------------
+    # Search
+    # ------------------------------------------------------------------
+    def _distances(self, q: np.ndarray, block: np.ndarray) -> np.ndarray:
+        if self.metric == "cosine":
+            return 1.0 - block @ q
+        diff = block - q
+        return np.einsum("ij,ij->i", diff, diff)
+
+    def search(self, queries, k: int = 5, nprobe: int = None):
+        """
+        Return the approximate k nearest neighbours of each query.
+
+        Args:
+            queries: Query embeddings, shape [n_queries, dim] or [dim].
+            k (int): Number of neighbours to return.
+            nprobe (int): Cells scanned per query. Overrides the index default; higher values
+                          improve recall at the cost of latency.
+
+        Returns:
+            tuple[np.ndarray, np.ndarray]: `(ids, distances)`, both of shape [n_queries, k],
+            sorted by ascending distance (cosine distance `1 - cos` or squared L2).
+            Missing neighbours are padded with id -1 and distance +inf.
+        """
+        if not self.is_trained:
+            raise RuntimeError("Index must be trained before searching")
+        q = self._prepare(queries)
+        nprobe = min(self.nprobe if nprobe is None else int(nprobe), self.nlist)
+
+        out_ids = np.full((q.shape[0], k), -1, dtype=np.int64)
+        out_dist = np.full((q.shape[0], k), np.inf, dtype=np.float32)
+        if len(self) == 0:
+            return out_ids, out_dist
+
+        if nprobe >= self.nlist:
+            probes = np.broadcast_to(np.arange(self.nlist), (q.shape[0], self.nlist))
+        else:
+            coarse = _squared_l2(q, self.centroids, self._centroid_sq)
+            probes = np.argpartition(coarse, nprobe - 1, axis=1)[:, :nprobe]
+
+        offsets = self.offsets
+        alive = self.alive if self.n_deleted else None
+        for i in range(q.shape[0]):
+            cells = probes[i]
+            if cells.shape[0] == self.nlist:
+                block, block_ids = self.vectors, self.ids
+                block_alive = alive
+            else:
+                spans = [(offsets[c], offsets[c + 1]) for c in cells if offsets[c + 1] > offsets[c]]
+                if not spans:
+                    continue
+                rows = np.concatenate([np.arange(s, e) for s, e in spans])
+                block, block_ids = self.vectors[rows], self.ids[rows]
+                block_alive = alive[rows] if alive is not None else None
+
+            dist = self._distances(q[i], block)
+            if block_alive is not None:
+                dist[~block_alive] = np.inf
+                top = _top_k(dist, k)
+                top = top[np.isfinite(dist[top])]
+            else:
+                top = _top_k(dist, k)
+            out_ids[i, :top.shape[0]] = block_ids[top]
+            out_dist[i, :top.shape[0]] = dist[top]
+        return out_ids, out_dist
+
+    # ------------------------------------------------------------------
+    # Persistence
+    # ------------------------------------------------------------------
+    def save(self, path):
+        """
+        Persist the index as a directory of `.npy` files plus a `meta.json` header.
+
+        Args:
+            path: Target directory (created if missing).
+        """
+        path = Path(path)
+        path.mkdir(parents=True, exist_ok=True)
+        np.save(path / "centroids.npy", self.centroids)
+        np.save(path / "vectors.npy", np.ascontiguousarray(self.vectors))
+        np.save(path / "ids.npy", self.ids)
+        np.save(path / "offsets.npy", self.offsets)
+        if self.n_deleted:
+            np.save(path / "alive.npy", self.alive)
+        elif (path / "alive.npy").exists():
+            (path / "alive.npy").unlink()
+        meta = {
+            "format_version": INDEX_FORMAT_VERSION,
+            "dim": self.dim,
+            "metric": self.metric,
+            "nlist": self.nlist,
+            "nprobe": self.nprobe,
+            "size": len(self),
+        }
+        (path / "meta.json").write_text(json.dumps(meta, indent=2), encoding="utf-8")
+        logger.info(f"Đã lưu IVF index ({len(self)} vector) vào '{path}'.")
+
+    @classmethod
+    def load(cls, path, mmap: bool = True):
+        """
+        Load an index saved with `save`.
+
+        Args:
+            path: Index directory.
+            mmap (bool): Memory-map the vector/id arrays instead of reading them into RAM,
+                         giving a near-constant cold start regardless of corpus size.
+
+        Returns:
+            IVFFlatIndex: The loaded index.
+        """
+        path = Path(path)
+        meta = json.loads((path / "meta.json").read_text(encoding="utf-8"))
+        if meta.get("format_version") != INDEX_FORMAT_VERSION:
+            raise ValueError(f"Unsupported index format version: {meta.get('format_version')}")
+        mode = "r" if mmap else None
+
+        index = cls(meta["dim"], metric=meta["metric"], nlist=meta["nlist"], nprobe=meta["nprobe"])
+        index.centroids = np.load(path / "centroids.npy")
+        index._centroid_sq = np.einsum("ij,ij->i", index.centroids, index.centroids)
+        index.vectors = np.load(path / "vectors.npy", mmap_mode=mode)
+        index.ids = np.load(path / "ids.npy", mmap_mode=mode)
+        index.offsets = np.load(path / "offsets.npy")
+        if (path / "alive.npy").exists():
+            index.alive = np.load(path / "alive.npy")
+            index.n_deleted = int((~index.alive).sum())
+        else:
+            index.alive = np.ones(index.ids.shape[0], dtype=bool)
+        return index
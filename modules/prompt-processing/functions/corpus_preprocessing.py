@@ -0,0 +1,106 @@
+import itertools
+import logging
+import os
+import re
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+
+from .text_normalization import normalize_text
+
+logger = logging.getLogger(__name__)
+
+SEGMENT_CACHE_SIZE = int(os.getenv("SEGMENT_CACHE_SIZE", "65536"))
+PREPROCESS_CHUNK_SIZE = 256
+
+# Ranh giới câu trên văn bản đã chuẩn hóa: sau dấu kết thúc câu và một khoảng trắng
+_SENTENCE_BOUNDARY_RE = re.compile(r"(?<=[.!?…])\s+")
+
+
+# --- Word segmentation (memoized) ---
+@lru_cache(maxsize=SEGMENT_CACHE_SIZE)
+def _segment_sentence(sentence: str) -> str:
+    from pyvi import ViTokenizer
+    return ViTokenizer.tokenize(sentence)
+
+
+def segment_text(text: str) -> str:
+    """
+    Tách từ tiếng Việt bằng ViTokenizer, có ghi nhớ theo từng câu.
+    Caption và transcript lặp lại rất nhiều câu, nên mỗi câu chỉ được tách từ một lần
+    cho mỗi process (LRU, kích thước `SEGMENT_CACHE_SIZE`).
+    Args:
+      text (str): Văn bản đã qua normalize_text.
+    Returns:
+      str: Văn bản đã tách từ (các âm tiết của một từ nối bằng '_').
+    """
+    if not text:
+        return text
+    return " ".join(_segment_sentence(sentence) for sentence in _SENTENCE_BOUNDARY_RE.split(text))
+
+
+def segment_cache_info():
+    """Thống kê hit/miss của cache tách từ trong process hiện tại."""
+    return _segment_sentence.cache_info()
+
+
+# --- Streaming preprocessing ---
+def preprocess_text(text: str, segment: bool = True):
+    """
+    Chuẩn hóa và (tùy chọn) tách từ một văn bản.
+    Returns:
+      tuple[str, str | None]: (normalized, segmented)
+    """
+    normalized = normalize_text(text)
+    return normalized, segment_text(normalized) if segment else None
+
+
+def _preprocess_chunk(texts: list, segment: bool) -> list:
+    """Chạy trong worker: xử lý một chunk, mỗi văn bản trùng lặp chỉ xử lý một lần."""
+    done = {}
+    for text in texts:
+        if text not in done:
+            done[text] = preprocess_text(text, segment)
+    return [done[text] for text in texts]
+
+
+def iter_preprocessed(documents, workers: int = None, chunk_size: int = PREPROCESS_CHUNK_SIZE,
+                      segment: bool = True, max_in_flight: int = None):
+    """
+    Chuẩn hóa và tách từ một luồng văn bản, song song trên một process pool.
+    Văn bản được đọc theo chunk, nên bộ nhớ chỉ phụ thuộc số chunk đang xử lý, không phụ thuộc
+    kích thước corpus. Kết quả được trả về đúng thứ tự đầu vào, để embedding và keyword index
+    dùng chung một lượt tiền xử lý thay vì mỗi bên tự tách từ lại.
+    Args:
+      documents (Iterable[str]): Các văn bản (list hoặc iterator bất kỳ).
+      workers (int): Số process; 0 để chạy ngay trong process hiện tại (mặc định: số core).
+      chunk_size (int): Số văn bản mỗi lần gửi cho một worker.
+      segment (bool): Có tách từ hay không (False: segmented luôn là None).
+      max_in_flight (int): Số chunk tối đa đang xử lý cùng lúc (mặc định: 2 * workers).
+    Yields:
+      tuple[str, str | None]: (normalized, segmented) cho từng văn bản, theo thứ tự đầu vào.
+    """
+    iterator = iter(documents)
+    chunks = iter(lambda: list(itertools.islice(iterator, chunk_size)), [])
+    workers = (os.cpu_count() or 1) if workers is None else int(workers)
+
+    if workers <= 0:
+        for chunk in chunks:
+            yield from _preprocess_chunk(chunk, segment)
+        return
+
+    max_in_flight = max_in_flight or 2 * workers
+    n_docs = 0
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        pending = deque()
+        for chunk in chunks:
+            pending.append(pool.submit(_preprocess_chunk, chunk, segment))
+            if len(pending) >= max_in_flight:
+                results = pending.popleft().result()
+                n_docs += len(results)
+                yield from results
+        while pending:
+            results = pending.popleft().result()
+            n_docs += len(results)
+            yield from results
+    logger.info(f"Đã tiền xử lý {n_docs} văn bản với {workers} process.")
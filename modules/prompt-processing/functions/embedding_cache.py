@@ -0,0 +1,227 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+import numpy as np
+
+from .text_normalization import normalize_text
+
+logger = logging.getLogger(__name__)
+
+
+class EmbeddingCache:
+    """
+    Two-tier cache for sentence embeddings, keyed on `normalize_text(text)` plus the model id.
+
+    - Memory tier: a bounded LRU of float32 vectors.
+    - Disk tier (optional): an append-only float32 vector file, memory-mapped for reads, plus a
+      `key -> row` index file. It survives restarts, so warm queries skip the transformer. A write
+      torn by a crash is trimmed back to the last complete row when the cache is reopened.
+
+    Counters are exposed through `stats()`.
+    """
+
+    def __init__(self, model_id: str, capacity: int = 4096, cache_dir=None):
+        self.model_id = model_id
+        self.capacity = int(capacity)
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self._dir = None
+        self._rows = {}
+        self._dim = None
+        self._mmap = None
+        if cache_dir is not None:
+            self._open_disk(Path(cache_dir) / model_id.replace("/", "__"))
+
+    # ------------------------------------------------------------------
+    # Keys
+    # ------------------------------------------------------------------
+    def key(self, text: str) -> str:
+        """Cache key of a text: hash of the model id and the normalized text."""
+        payload = f"{self.model_id}\x00{normalize_text(text)}".encode("utf-8")
+        return hashlib.blake2b(payload, digest_size=16).hexdigest()
+
+    # ------------------------------------------------------------------
+    # Disk tier
+    # ------------------------------------------------------------------
+    def _open_disk(self, path: Path):
+        path.mkdir(parents=True, exist_ok=True)
+        self._dir = path
+        meta_path = path / "meta.json"
+        if meta_path.exists():
+            self._dim = json.loads(meta_path.read_text(encoding="utf-8"))["dim"]
+        index_path = path / "index.tsv"
+        if self._dim is not None:
+            n_rows = self._truncate_vectors(path / "vectors.f32")
+            if index_path.exists():
+                self._load_index(index_path, n_rows)
+        logger.info(f"Đã mở cache embedding trên đĩa '{path}' với {len(self._rows)} mục.")
+
+    def _truncate_vectors(self, vectors_path: Path) -> int:
+        """
+        Cut `vectors.f32` back to a whole number of rows after a torn write (crash, full disk);
+        otherwise every row appended later would map to the wrong bytes.
+
+        Returns:
+            int: Number of complete rows.
+        """
+        row_bytes = 4 * self._dim
+        size = vectors_path.stat().st_size if vectors_path.exists() else 0
+        if size % row_bytes:
+            logger.warning(f"'{vectors_path}' bị ghi dở ({size % row_bytes} byte thừa), "
+                           f"cắt về {size // row_bytes} dòng.")
+            os.truncate(vectors_path, size - size % row_bytes)
+        return size // row_bytes
+
+    def _load_index(self, index_path: Path, n_rows: int):
+        """
+        Load the `key -> row` index. Partial lines and entries past the last complete row are
+        dropped and the file is rewritten without them, so that a row number reused by a later
+        write can never resolve to a stale key.
+        """
+        dropped = 0
+        with open(index_path, encoding="utf-8") as f:
+            for line in f:
+                parts = line.rstrip("\n").split("\t")
+                if line.endswith("\n") and len(parts) == 2 and parts[1].isdigit() and int(parts[1]) < n_rows:
+                    self._rows[parts[0]] = int(parts[1])
+                else:
+                    dropped += 1
+        if dropped:
+            logger.warning(f"Bỏ {dropped} dòng hỏng trong '{index_path}'.")
+            tmp_path = index_path.with_suffix(".tmp")
+            tmp_path.write_text("".join(f"{key}\t{row}\n" for key, row in self._rows.items()), encoding="utf-8")
+            os.replace(tmp_path, index_path)
+
+    def _disk_get(self, key: str):
+        row = self._rows.get(key)
+        if row is None:
+            return None
+        if self._mmap is None or row >= self._mmap.shape[0]:
+            n_rows = (self._dir / "vectors.f32").stat().st_size // (4 * self._dim)
+            self._mmap = np.memmap(self._dir / "vectors.f32", dtype=np.float32, mode="r", shape=(n_rows, self._dim))
+        return np.array(self._mmap[row])
+
+    def _disk_put(self, key: str, vector: np.ndarray):
+        if self._dim is None:
+            self._dim = int(vector.shape[0])
+            (self._dir / "meta.json").write_text(
+                json.dumps({"model_id": self.model_id, "dim": self._dim}), encoding="utf-8")
+        if vector.shape[0] != self._dim:
+            raise ValueError(f"Expected embedding of dimension {self._dim}, got {vector.shape[0]}")
+        # Ghi vector trước, rồi mới ghi chỉ mục; phần ghi dở do crash được dọn khi mở lại (_open_disk)
+        with open(self._dir / "vectors.f32", "ab") as f:
+            start = f.tell()
+            row = start // (4 * self._dim)
+            try:
+                f.write(vector.astype(np.float32).tobytes())
+                f.flush()
+            except OSError:
+                # Ví dụ đầy đĩa: cắt phần ghi dở để các dòng sau vẫn thẳng hàng
+                f.truncate(start)
+                raise
+        with open(self._dir / "index.tsv", "a", encoding="utf-8") as f:
+            f.write(f"{key}\t{row}\n")
+        self._rows[key] = row
+
+    # ------------------------------------------------------------------
+    # Public API
+    # ------------------------------------------------------------------
+    def get(self, text: str):
+        """
+        Look up a cached embedding.
+
+        Returns:
+            np.ndarray | None: A float32 vector of shape [hidden_size], or None on a miss. The vector is
+            a copy, so callers may modify it without corrupting the cache.
+        """
+        key = self.key(text)
+        with self._lock:
+            vector = self._memory.get(key)
+            if vector is not None:
+                self._memory.move_to_end(key)
+                self.hits += 1
+                return vector.copy()
+            if self._dir is not None:
+                vector = self._disk_get(key)
+                if vector is not None:
+                    self.disk_hits += 1
+                    self._remember(key, vector)
+                    return vector.copy()
+            self.misses += 1
+            return None
+
+    def put(self, text: str, vector):
+        """Store an embedding (any [hidden_size] or [1, hidden_size] array/tensor) in both tiers."""
+        if hasattr(vector, "detach"):  # torch.Tensor
+            vector = vector.detach().cpu().numpy()
+        # Bản sao riêng: phía gọi có thể tiếp tục sửa mảng/tensor của mình
+        vector = np.array(vector, dtype=np.float32).reshape(-1)
+        if vector.shape[0] == 0:
+            return
+        key = self.key(text)
+        with self._lock:
+            self._remember(key, vector)
+            if self._dir is not None and key not in self._rows:
+                self._disk_put(key, vector)
+
+    def _remember(self, key: str, vector: np.ndarray):
+        self._memory[key] = vector
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.capacity:
+            self._memory.popitem(last=False)
+            self.evictions += 1
+
+    def get_or_compute(self, text: str, compute):
+        """
+        Return the cached embedding of `text`, computing and storing it with `compute(text)` on a miss.
+
+        Returns:
+            np.ndarray: A float32 vector of shape [hidden_size] (empty if `compute` failed), never
+            shared with the cache.
+        """
+        vector = self.get(text)
+        if vector is not None:
+            return vector
+        vector = compute(text)
+        if hasattr(vector, "detach"):
+            vector = vector.detach().cpu().numpy()
+        vector = np.asarray(vector, dtype=np.float32).reshape(-1)
+        self.put(text, vector)
+        return vector
+
+    def stats(self) -> dict:
+        """Hit/miss/eviction counters and tier sizes."""
+        with self._lock:
+            lookups = self.hits + self.disk_hits + self.misses
+            return {
+                "memory_hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": (self.hits + self.disk_hits) / lookups if lookups else 0.0,
+                "memory_size": len(self._memory),
+                "disk_size": len(self._rows),
+            }
+
+
+def cache_from_env(model_id: str) -> EmbeddingCache:
+    """
+    Build the default cache from environment variables:
+    `EMBEDDING_CACHE_SIZE` (memory tier capacity, default 4096) and
+    `EMBEDDING_CACHE_DIR` (disk tier directory; disabled if unset).
+    """
+    return EmbeddingCache(
+        model_id,
+        capacity=int(os.getenv("EMBEDDING_CACHE_SIZE", "4096")),
+        cache_dir=os.getenv("EMBEDDING_CACHE_DIR") or None,
+    )
@@ -1,8 +1,24 @@
-import torch
-from transformers import AutoModel, AutoTokenizer
-from pyvi import ViTokenizer
+import itertools
+import os
+import threading
+import numpy as np
 import logging
 import sys
+from pathlib import Path
+from typing import TYPE_CHECKING
+
+from .corpus_preprocessing import segment_text
+
+# Cho phép import các module dùng chung trong ./modules (utils.telemetry)
+_MODULES_DIR = str(Path(__file__).resolve().parents[2])
+if _MODULES_DIR not in sys.path:
+    sys.path.append(_MODULES_DIR)
+
+from utils import telemetry  # noqa: E402
+
+# torch, transformers và pyvi được import khi cần để việc import module này luôn nhanh
+if TYPE_CHECKING:
+    import torch
 
 # --- Cấu hình Logging ---
 # Thiết lập logger để ghi log ra console và file
@@ -18,21 +34,138 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 # -------------------------
 
-# --- Tải mô hình và tokenizer ---
-# Đảm bảo tải mô hình và tokenizer chỉ một lần duy nhất
-try:
-    logger.info("Đang tải mô hình và tokenizer PhoBERT...")
-    phobert_model = AutoModel.from_pretrained("vinai/phobert-base")
-    phobert_tokenizer = AutoTokenizer.from_pretrained("vinai/phobert-base")
-    phobert_model.eval() # Chuyển sang chế độ đánh giá để tắt dropout
-    logger.info("Đã tải mô hình và tokenizer PhoBERT thành công.")
-except Exception as e:
-    logger.error(f"Lỗi khi tải mô hình hoặc tokenizer: {e}")
-    phobert_model = None
-    phobert_tokenizer = None
+# --- Tải mô hình và tokenizer (lazy) ---
+# Mô hình chỉ được tải một lần, ở lần gọi đầu tiên (hoặc qua warm_up()), an toàn đa luồng.
+# Có thể chỉ định đường dẫn mô hình cục bộ / thư mục cache qua biến môi trường.
+PHOBERT_MODEL_NAME = os.getenv("PHOBERT_MODEL_PATH", "vinai/phobert-base")
+PHOBERT_CACHE_DIR = os.getenv("PHOBERT_CACHE_DIR") or None
+# Backend suy luận trên CPU (xem utils/inference.py): eager | int8 | torchscript | torchscript-int8 | onnx | onnx-int8
+PHOBERT_BACKEND = os.getenv("PHOBERT_BACKEND", "eager")
+# Backend chỉ được dùng khi mọi vector [CLS] kiểm tra có cosine >= ngưỡng này so với eager PyTorch
+PHOBERT_BACKEND_MIN_COSINE = float(os.getenv("PHOBERT_BACKEND_MIN_COSINE", "0.99"))
+
+
+def cache_model_id(model_name: str = None, backend: str = None) -> str:
+    """Model id for `EmbeddingCache`: model plus backend, so switching `PHOBERT_BACKEND` never serves stale vectors."""
+    return f"{model_name or PHOBERT_MODEL_NAME}@{backend or PHOBERT_BACKEND}"
+
+_VERIFY_TEXTS = [
+    "Chào bạn , hôm_nay bạn thế_nào ?",
+    "Ảnh chụp Lăng_Bác vào tháng 5 năm 2023 , có trời nắng và đám_đông",
+    "video",
+    "Video quay lại cảnh tôi đi Đà_Lạt cùng gia_đình vào tháng 8 năm 2024 , thời_tiết rất đẹp . " * 3,
+]
+
+
+class ModelLoadError(RuntimeError):
+    """Raised when the PhoBERT model or tokenizer cannot be loaded."""
+
+
+phobert_model = None
+phobert_tokenizer = None
+backend_report = None  # {"backend", "requested", "min_cosine", "max_abs_diff", ...} của lần tải gần nhất
+_load_error = None
+_load_lock = threading.Lock()
+
+
+def _apply_backend(model, tokenizer, model_name: str, backend: str):
+    """
+    Wraps the eager model in the configured CPU backend after checking its outputs against eager.
+    Falls back to the eager model (with a warning) if the backend cannot be built or does not match.
+
+    Returns:
+        tuple: `(model, report)`.
+    """
+    from utils import inference
+
+    report = {"requested": backend, "backend": "eager", "threads": inference.configure_threads()}
+    if backend == "eager":
+        return model, report
+    try:
+        batches = inference.encoder_sample_batches(tokenizer, _VERIFY_TEXTS)
+        candidate = inference.build_encoder_backend(model, backend, model_name, batches)
+        report.update(inference.verify_encoder(model, candidate, batches, PHOBERT_BACKEND_MIN_COSINE))
+    except Exception as e:
+        # Gồm BackendError và mọi lỗi khi so sánh với eager: backend chỉ là tối ưu,
+        # không được làm hỏng việc tải model
+        logger.warning(f"Không dùng được backend '{backend}', quay về eager PyTorch: {e}")
+        report["error"] = str(e)
+        return model, report
+    if not report["ok"]:
+        logger.warning(f"Backend '{backend}' lệch so với eager PyTorch (cosine nhỏ nhất {report['min_cosine']:.4f} "
+                       f"< {PHOBERT_BACKEND_MIN_COSINE}), quay về eager.")
+        return model, report
+    report["backend"] = backend
+    logger.info(f"Dùng backend '{backend}' cho PhoBERT (cosine nhỏ nhất {report['min_cosine']:.4f}, "
+                f"sai khác tối đa {report['max_abs_diff']:.2e}).")
+    return candidate, report
+
+
+def load_phobert(model_name: str = None, cache_dir: str = None, reload: bool = False, backend: str = None):
+    """
+    Returns the PhoBERT model and tokenizer, loading them on first use.
+
+    Args:
+        model_name (str): Hub id or local path. Defaults to `PHOBERT_MODEL_PATH` / 'vinai/phobert-base'.
+        cache_dir (str): Download cache directory. Defaults to `PHOBERT_CACHE_DIR`.
+        reload (bool): Load again even if a model is loaded or a previous attempt failed.
+        backend (str): CPU inference backend, defaults to `PHOBERT_BACKEND` (see utils/inference.py).
+                       The result is checked against eager PyTorch (see `backend_report`).
+
+    Returns:
+        tuple: `(phobert_model, phobert_tokenizer)`.
+
+    Raises:
+        ModelLoadError: If loading fails. The failure is remembered, so later calls fail fast
+                        until `reload=True` is passed.
+    """
+    global phobert_model, phobert_tokenizer, backend_report, _load_error
+    if phobert_model is not None and not reload:
+        return phobert_model, phobert_tokenizer
+    with _load_lock:
+        if phobert_model is not None and not reload:
+            return phobert_model, phobert_tokenizer
+        if _load_error is not None and not reload:
+            raise ModelLoadError(str(_load_error)) from _load_error
+
+        model_name = model_name or PHOBERT_MODEL_NAME
+        cache_dir = cache_dir or PHOBERT_CACHE_DIR
+        try:
+            from transformers import AutoModel, AutoTokenizer
+
+            logger.info(f"Đang tải mô hình và tokenizer PhoBERT từ '{model_name}'...")
+            model = AutoModel.from_pretrained(model_name, cache_dir=cache_dir)
+            tokenizer = AutoTokenizer.from_pretrained(model_name, cache_dir=cache_dir)
+            model.eval() # Chuyển sang chế độ đánh giá để tắt dropout
+            model, report = _apply_backend(model, tokenizer, model_name, backend or PHOBERT_BACKEND)
+        except Exception as e:
+            logger.error(f"Lỗi khi tải mô hình hoặc tokenizer: {e}")
+            _load_error = e
+            raise ModelLoadError(f"Không thể tải PhoBERT từ '{model_name}': {e}") from e
+
+        phobert_model, phobert_tokenizer, backend_report, _load_error = model, tokenizer, report, None
+        logger.info("Đã tải mô hình và tokenizer PhoBERT thành công.")
+        return phobert_model, phobert_tokenizer
+
+
+def _segment(text: str) -> str:
+    """Word-segments Vietnamese text with pyvi, memoized per sentence (see corpus_preprocessing)."""
+    return segment_text(text)
+
+
+def warm_up(model_name: str = None, cache_dir: str = None):
+    """
+    Loads the model and runs one tiny forward pass, so the first real request does not pay
+    for loading, lazy imports or first-call allocations.
+
+    Raises:
+        ModelLoadError: If the model cannot be loaded.
+    """
+    load_phobert(model_name, cache_dir)
+    get_phobert_sentence_embeddings(["khởi động"])
 # ---------------------------------
 
-def get_phobert_sentence_embedding(text: str) -> torch.Tensor:
+def get_phobert_sentence_embedding(text: str) -> "torch.Tensor":
     """
     Generates a sentence embedding for a given Vietnamese text using PhoBERT.
 
@@ -43,22 +176,29 @@ def get_phobert_sentence_embedding(text: str) -> torch.Tensor:
         torch.Tensor: A tensor representing the sentence embedding (from the [CLS] token).
                       The shape will be [1, hidden_size], typically [1, 768].
     """
-    if phobert_model is None or phobert_tokenizer is None:
+    import torch
+
+    try:
+        phobert_model, phobert_tokenizer = load_phobert()
+    except ModelLoadError:
         logger.warning("Mô hình PhoBERT chưa được tải. Không thể tạo embedding.")
         return torch.empty(0) # Trả về tensor rỗng nếu mô hình không tồn tại
 
-    logger.info(f"Đang tạo embedding cho văn bản: '{text}'")
+    # Nội dung văn bản chỉ được ghi log theo tỉ lệ lấy mẫu (TELEMETRY_PAYLOAD_SAMPLE_RATE)
+    telemetry.log_payload(logger, "Đang tạo embedding cho văn bản: '%s'", text)
 
     try:
         # Bước 1: Word-segment the text using ViTokenizer
-        segmented_text = ViTokenizer.tokenize(text)
-        logger.info(f"Văn bản đã được tách từ: '{segmented_text}'")
+        with telemetry.span("segment"):
+            segmented_text = _segment(text)
+        telemetry.log_payload(logger, "Văn bản đã được tách từ: '%s'", segmented_text)
 
         # Bước 2: Tokenize the segmented text using PhoBERT's tokenizer
-        input_ids = phobert_tokenizer.encode(segmented_text, return_tensors="pt")
+        with telemetry.span("tokenize"):
+            input_ids = phobert_tokenizer.encode(segmented_text, return_tensors="pt")
         
         # Bước 3: Extract embeddings from the PhoBERT model
-        with torch.no_grad():
+        with telemetry.span("forward", items=1), torch.no_grad():
             outputs = phobert_model(input_ids)
 
         last_hidden_states = outputs[0]
@@ -73,7 +213,165 @@ def get_phobert_sentence_embedding(text: str) -> torch.Tensor:
         return torch.empty(0)
 
 
+def get_cached_phobert_sentence_embedding(text: str, cache) -> "torch.Tensor":
+    """
+    Same as `get_phobert_sentence_embedding`, but served from an `EmbeddingCache` when possible.
+
+    Args:
+        text (str): The input Vietnamese text string.
+        cache (EmbeddingCache): Cache keyed on the normalized text and the model id.
+
+    Returns:
+        torch.Tensor: The [1, hidden_size] sentence embedding, or an empty tensor on failure.
+    """
+    import torch
+
+    # get_or_compute trả về bản sao, nên tensor (chia sẻ bộ nhớ qua from_numpy) không trỏ vào cache
+    vector = cache.get_or_compute(text, get_phobert_sentence_embedding)
+    if vector.size == 0:
+        return torch.empty(0)
+    return torch.from_numpy(vector).unsqueeze(0)
+
+
+# --- Batch API ---
+PHOBERT_MAX_LENGTH = 256  # Số token tối đa (kể cả <s> và </s>) mà PhoBERT chấp nhận
+
+
+def _split_into_chunks(token_ids: list, max_length: int, bos_id: int, eos_id: int) -> list:
+    """Split the content tokens of one text into windows that fit `max_length` with <s> ... </s>."""
+    body = token_ids[1:-1]
+    window = max_length - 2
+    if not body:
+        return [token_ids]
+    return [[bos_id] + body[i:i + window] + [eos_id] for i in range(0, len(body), window)]
+
+
+def _embed_padded_batch(model, pad_id: int, batch_ids: list) -> np.ndarray:
+    """Run one forward pass over a length bucket with dynamic padding; returns the [CLS] vectors."""
+    import torch
+
+    longest = max(len(ids) for ids in batch_ids)
+    input_ids = torch.full((len(batch_ids), longest), pad_id, dtype=torch.long)
+    attention_mask = torch.zeros((len(batch_ids), longest), dtype=torch.long)
+    for row, ids in enumerate(batch_ids):
+        input_ids[row, :len(ids)] = torch.tensor(ids, dtype=torch.long)
+        attention_mask[row, :len(ids)] = 1
+
+    with telemetry.span("forward", items=len(batch_ids)), torch.no_grad():
+        outputs = model(input_ids=input_ids, attention_mask=attention_mask)
+    return outputs[0][:, 0, :].float().numpy()
+
+
+def iter_phobert_sentence_embeddings(texts, batch_size: int = 32, max_length: int = PHOBERT_MAX_LENGTH,
+                                     long_text: str = "truncate", window_batches: int = 16,
+                                     presegmented: bool = False):
+    """
+    Generates PhoBERT sentence embeddings for a stream of texts, batch by batch.
+
+    Texts are read in windows of `batch_size * window_batches`, word-segmented and tokenized
+    in bulk, sorted by token length and grouped into buckets so every batch is padded only to
+    its own longest sequence.
+
+    Args:
+        texts (Iterable[str]): Input Vietnamese texts (a list or any iterator).
+        batch_size (int): Number of texts per yielded batch.
+        max_length (int): Token limit per sequence, at most 256 for PhoBERT.
+        long_text (str): 'truncate' cuts long texts at `max_length`; 'chunk' splits them into
+                         `max_length` windows and averages the [CLS] vectors of the windows.
+        window_batches (int): Number of batches buffered for length bucketing.
+        presegmented (bool): The texts are already word-segmented (e.g. the `segmented` half of
+                             `corpus_preprocessing.iter_preprocessed`), skip ViTokenizer.
+
+    Yields:
+        tuple[np.ndarray, np.ndarray]: `(indices, embeddings)` where `indices` are the positions
+        of the texts in the input stream and `embeddings` is a C-contiguous float32 matrix of
+        shape [len(indices), hidden_size].
+
+    Raises:
+        ModelLoadError: If the model cannot be loaded.
+    """
+    if long_text not in ("truncate", "chunk"):
+        raise ValueError("long_text must be 'truncate' or 'chunk'")
+    max_length = min(max_length, PHOBERT_MAX_LENGTH)
+    phobert_model, phobert_tokenizer = load_phobert()
+
+    iterator = iter(texts)
+    position = 0
+    while True:
+        window = list(itertools.islice(iterator, batch_size * window_batches))
+        if not window:
+            return
+        indices = np.arange(position, position + len(window))
+        position += len(window)
+
+        # Bước 1 + 2: tách từ và mã hóa cả cửa sổ một lần
+        if presegmented:
+            segmented = window
+        else:
+            with telemetry.span("segment", items=len(window)):
+                segmented = [_segment(text) for text in window]
+        with telemetry.span("tokenize", items=len(window)):
+            encoded = phobert_tokenizer(segmented, truncation=long_text == "truncate",
+                                        max_length=max_length if long_text == "truncate" else None)["input_ids"]
+        if long_text == "truncate":
+            sequences, owners = encoded, np.arange(len(window))
+        else:
+            sequences, owners = [], []
+            for owner, ids in enumerate(encoded):
+                for chunk in _split_into_chunks(ids, max_length, phobert_tokenizer.bos_token_id,
+                                                phobert_tokenizer.eos_token_id):
+                    sequences.append(chunk)
+                    owners.append(owner)
+            owners = np.asarray(owners)
+
+        # Bước 3: gom nhóm theo độ dài rồi chạy mô hình trên từng nhóm
+        order = np.argsort([len(ids) for ids in sequences], kind="stable")
+        vectors = None
+        for start in range(0, len(order), batch_size):
+            bucket = order[start:start + batch_size]
+            cls = _embed_padded_batch(phobert_model, phobert_tokenizer.pad_token_id,
+                                      [sequences[i] for i in bucket])
+            if vectors is None:
+                vectors = np.empty((len(sequences), cls.shape[1]), dtype=np.float32)
+            vectors[bucket] = cls
+
+        # Gộp các đoạn (nếu chia nhỏ) về từng văn bản gốc bằng trung bình
+        if long_text == "chunk":
+            sums = np.zeros((len(window), vectors.shape[1]), dtype=np.float32)
+            np.add.at(sums, owners, vectors)
+            vectors = sums / np.bincount(owners, minlength=len(window))[:, None].astype(np.float32)
+
+        # Trả về theo lô, giữ nguyên thứ tự đầu vào
+        for start in range(0, len(window), batch_size):
+            yield indices[start:start + batch_size], np.ascontiguousarray(vectors[start:start + batch_size])
+        logger.debug(f"Đã tạo embedding cho {position} văn bản.")
+
+
+def get_phobert_sentence_embeddings(texts, batch_size: int = 32, max_length: int = PHOBERT_MAX_LENGTH,
+                                    long_text: str = "truncate", presegmented: bool = False) -> np.ndarray:
+    """
+    Generates PhoBERT sentence embeddings for a list of texts.
+
+    Args:
+        texts (Iterable[str]): Input Vietnamese texts.
+        batch_size (int): Number of texts per forward pass.
+        max_length (int): Token limit per sequence, at most 256 for PhoBERT.
+        long_text (str): 'truncate' or 'chunk', see `iter_phobert_sentence_embeddings`.
+        presegmented (bool): The texts are already word-segmented.
+
+    Returns:
+        np.ndarray: A float32 matrix of shape [n_texts, hidden_size], in input order.
+    """
+    batches = [emb for _, emb in iter_phobert_sentence_embeddings(texts, batch_size, max_length, long_text,
+                                                                  presegmented=presegmented)]
+    if not batches:
+        hidden_size = load_phobert()[0].config.hidden_size
+        return np.empty((0, hidden_size), dtype=np.float32)
+    return np.concatenate(batches, axis=0)
+
+
 # --- Ví dụ sử dụng ---
+# Chạy như module để import tương đối hoạt động: python -m functions.embedding_vector_extraction (từ thư mục module)
 if __name__ == "__main__":
     example_text_1 = "Chào bạn, hôm nay bạn thế nào?"
     embedding_1 = get_phobert_sentence_embedding(example_text_1)
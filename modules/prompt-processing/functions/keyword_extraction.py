@@ -1,37 +1,81 @@
 import os
 import json
+import time
 import logging
-from dotenv import load_dotenv
-from google import genai
+import sys
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+from pathlib import Path
+
+from .rule_based_extraction import extract_keywords_rule_based, is_confident
+
+# Cho phép import các module dùng chung trong ./modules (utils.telemetry)
+_MODULES_DIR = str(Path(__file__).resolve().parents[2])
+if _MODULES_DIR not in sys.path:
+    sys.path.append(_MODULES_DIR)
+
+from utils import telemetry  # noqa: E402
 
 # --- Cấu hình Logging ---
-# Tạo thư mục logging nếu chưa tồn tại
-log_dir = "logging"
-if not os.path.exists(log_dir):
-    os.makedirs(log_dir)
-
-# Thiết lập logger
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler(os.path.join(log_dir, "app.log")),
-        logging.StreamHandler() # Ghi log ra console
-    ]
-)
+# Việc ghi log ra file (thư mục logging/) do entry point đảm nhận (xem prompt-processing.py),
+# để import module này không tạo thư mục hay file nào.
 logger = logging.getLogger(__name__)
 
-# Tải các biến môi trường từ file .env
-load_dotenv()
+# --- Phần xử lý API Key và khởi tạo client (lazy) ---
+# Client Gemini chỉ được tạo ở lần gọi đầu tiên (hoặc qua warm_up()), an toàn đa luồng.
+client = None
+_client_resolved = False  # True khi đã thử khởi tạo (kể cả khi thiếu key), để không đọc .env lại mỗi lần gọi
+_client_lock = threading.Lock()
+
+
+def get_client(reload: bool = False):
+    """
+    Trả về client Gemini, khởi tạo ở lần gọi đầu tiên từ GEMINI_API_KEY (đọc cả file .env).
+    Kết quả "thiếu API key" cũng được ghi nhớ (và chỉ log một lần) cho tới khi gọi với reload=True.
+    Returns:
+      genai.Client | None: Client, hoặc None nếu thiếu API key.
+    """
+    global client, _client_resolved
+    if (client is not None or _client_resolved) and not reload:
+        return client
+    with _client_lock:
+        if (client is not None or _client_resolved) and not reload:
+            return client
+        from dotenv import load_dotenv
+        load_dotenv()
+        api_key = os.getenv('GEMINI_API_KEY')
+        if not api_key:
+            logger.error("Lỗi: Không tìm thấy GEMINI_API_KEY trong biến môi trường. Vui lòng kiểm tra file .env.")
+            client, _client_resolved = None, True
+            return None
+        from google import genai
+        client = genai.Client(api_key=api_key)
+        _client_resolved = True
+        logger.info("Đã khởi tạo client Gemini thành công.")
+        return client
 
-# --- Phần xử lý API Key và khởi tạo client ---
-API_KEY = os.getenv('GEMINI_API_KEY')
-if not API_KEY:
-    logger.error("Lỗi: Không tìm thấy GEMINI_API_KEY trong biến môi trường. Vui lòng kiểm tra file .env.")
-    client = None
-else:
-    client = genai.Client(api_key=API_KEY)
-    logger.info("Đã khởi tạo client Gemini thành công.")
+
+def set_client(new_client):
+    """
+    Thay client Gemini bằng một đối tượng khác, ví dụ stub cục bộ khi test.
+    Stub chỉ cần có `models.generate_content(model=..., contents=...)` trả về đối tượng có `.text`.
+    Args:
+      new_client: Client mới, hoặc None để khởi tạo lại từ GEMINI_API_KEY ở lần gọi sau.
+    """
+    global client, _client_resolved
+    with _client_lock:
+        client = new_client
+        _client_resolved = new_client is not None
+
+
+def warm_up() -> bool:
+    """
+    Khởi tạo trước client Gemini để request đầu tiên không phải chờ.
+    Returns:
+      bool: True nếu client đã sẵn sàng.
+    """
+    return get_client() is not None
 
 # ----------------------------------------------
 
@@ -82,32 +126,194 @@ template = """
   }
 """
 
-def extract_keywords(text: str) -> str:
+# --- Chế độ trích xuất, cache và gộp request ---
+# KEYWORD_EXTRACTION_MODE:
+#   "llm"         - gọi Gemini (mặc định)
+#   "rules_first" - dùng bộ trích xuất luật nếu đủ tin cậy, ngược lại gọi Gemini
+#   "rules"       - chỉ dùng luật, không bao giờ gọi API
+# KEYWORD_RULE_FALLBACK=1: khi Gemini không khả dụng/lỗi, trả về kết quả luật (có đánh dấu
+# FALLBACK_MARKER) thay vì JSON lỗi. Mặc định tắt: giữ nguyên hành vi trả về {"error": ...}.
+KEYWORD_EXTRACTION_MODE = os.getenv("KEYWORD_EXTRACTION_MODE", "llm")
+KEYWORD_RULE_FALLBACK = os.getenv("KEYWORD_RULE_FALLBACK", "0") == "1"
+# Khóa được thêm vào kết quả dự phòng bằng luật, để phía gọi biết kết quả không đến từ Gemini
+FALLBACK_MARKER = "fallback"
+KEYWORD_CACHE_TTL = float(os.getenv("KEYWORD_CACHE_TTL", "3600"))
+KEYWORD_CACHE_SIZE = int(os.getenv("KEYWORD_CACHE_SIZE", "10000"))
+
+
+class TTLCache:
+    """LRU cache with per-entry expiry, safe to share between threads."""
+
+    def __init__(self, ttl: float, maxsize: int):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            expires, value = item
+            if expires < time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+llm_cache = TTLCache(KEYWORD_CACHE_TTL, KEYWORD_CACHE_SIZE)
+_inflight = {}
+_inflight_lock = threading.Lock()
+stats = {"rule_hits": 0, "cache_hits": 0, "coalesced": 0, "llm_calls": 0, "fallbacks": 0}
+_stats_lock = threading.Lock()
+
+
+def _count(name: str):
+    """Tăng bộ đếm trong `stats` (được gọi từ nhiều thread cùng lúc)."""
+    with _stats_lock:
+        stats[name] += 1
+
+
+def is_degraded(payload) -> bool:
     """
-    Trích xuất từ khóa từ văn bản đầu vào bằng mô hình Gemini của Google.
+    True nếu kết quả của `extract_keywords` là JSON lỗi hoặc kết quả dự phòng bằng luật.
     Args:
-      text (str): Văn bản đầu vào.
+      payload (str | dict): Chuỗi JSON trả về (hoặc dict đã parse).
+    """
+    if payload is None:
+        return True
+    if isinstance(payload, str):
+        try:
+            payload = json.loads(payload)
+        except ValueError:
+            return True
+    return not isinstance(payload, dict) or "error" in payload or FALLBACK_MARKER in payload
+
+
+def _fallback_json(text: str) -> str:
+    _count("fallbacks")
+    with telemetry.span("rules"):
+        result = extract_keywords_rule_based(text)
+    result[FALLBACK_MARKER] = "rules"
+    return json.dumps(result, ensure_ascii=False)
+
+
+def _rules_json(text: str) -> str:
+    with telemetry.span("rules"):
+        return json.dumps(extract_keywords_rule_based(text), ensure_ascii=False)
+
+
+def _call_gemini(text: str):
+    """
+    Gọi Gemini một lần.
     Returns:
-      str: Một chuỗi JSON với các từ khóa đã trích xuất.
+      tuple[str, bool]: (chuỗi JSON, True nếu gọi API thành công).
     """
+    try:
+        client = get_client()
+    except Exception as e:
+        logger.error(f"Lỗi khi khởi tạo Gemini client: {e}")
+        client = None
     if client is None:
-        logger.warning(f"Không thể trích xuất từ khóa cho '{text}' vì Gemini client chưa được khởi tạo.")
-        return json.dumps({"error": "Gemini client is not initialized due to missing API key."})
+        logger.warning("Không thể trích xuất từ khóa vì Gemini client chưa được khởi tạo.")
+        telemetry.log_payload(logger, "Văn bản không được trích xuất từ khóa: '%s'", text)
+        if KEYWORD_RULE_FALLBACK:
+            return _fallback_json(text), False
+        return json.dumps({"error": "Gemini client is not initialized due to missing API key."}), False
 
     task = f'Input: {text}\nOutput:'
     few_shot_prompt = template + task
-    logger.info(f"Đang gọi Gemini API với input: '{text}'")
+    telemetry.log_payload(logger, "Đang gọi Gemini API với input: '%s'", text)
 
     try:
-        response = client.models.generate_content(
-            model="gemini-2.5-flash",
-            contents=few_shot_prompt
-        )
-        logger.info(f"Phản hồi từ Gemini API: {response.text}")
-        return response.text
+        _count("llm_calls")
+        with telemetry.span("llm"):
+            response = client.models.generate_content(
+                model="gemini-2.5-flash",
+                contents=few_shot_prompt
+            )
+        telemetry.log_payload(logger, "Phản hồi từ Gemini API: %s", response.text)
+        return response.text, True
     except Exception as e:
         logger.error(f"Lỗi khi gọi Gemini API: {e}")
-        return json.dumps({"error": str(e)})
+        if KEYWORD_RULE_FALLBACK:
+            return _fallback_json(text), False
+        return json.dumps({"error": str(e)}), False
+
+
+def _extract_with_llm(text: str) -> str:
+    """
+    Gọi Gemini qua TTL cache; các request giống hệt nhau đang chạy đồng thời chỉ dùng chung một lần gọi.
+    """
+    key = text.strip()
+    cached = llm_cache.get(key)
+    if cached is not None:
+        _count("cache_hits")
+        return cached
+
+    with _inflight_lock:
+        future = _inflight.get(key)
+        owner = future is None
+        if owner:
+            future = Future()
+            _inflight[key] = future
+    if not owner:
+        _count("coalesced")
+        return future.result()
+
+    try:
+        result, ok = _call_gemini(text)
+        # Chỉ cache phản hồi thật từ API, không cache lỗi hay kết quả dự phòng
+        if ok:
+            llm_cache.put(key, result)
+        future.set_result(result)
+        return result
+    except BaseException as e:
+        future.set_exception(e)
+        raise
+    finally:
+        with _inflight_lock:
+            _inflight.pop(key, None)
+
+
+def extract_keywords(text: str, mode: str = None) -> str:
+    """
+    Trích xuất từ khóa từ văn bản đầu vào bằng mô hình Gemini của Google.
+    Kết quả Gemini được cache theo TTL và các request giống nhau đồng thời được gộp lại;
+    bộ trích xuất luật (rule_based_extraction) được dùng làm đường nhanh hoặc dự phòng.
+    Args:
+      text (str): Văn bản đầu vào.
+      mode (str): "llm", "rules_first" hoặc "rules" (mặc định KEYWORD_EXTRACTION_MODE).
+    Returns:
+      str: Một chuỗi JSON với các từ khóa đã trích xuất.
+    """
+    mode = mode or KEYWORD_EXTRACTION_MODE
+    if mode == "rules":
+        _count("rule_hits")
+        return _rules_json(text)
+    if mode == "rules_first":
+        with telemetry.span("rules"):
+            result = extract_keywords_rule_based(text)
+        if is_confident(result):
+            _count("rule_hits")
+            return json.dumps(result, ensure_ascii=False)
+    return _extract_with_llm(text)
 
 '''
 # --- Ví dụ sử dụng ---
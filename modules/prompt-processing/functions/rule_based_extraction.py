@@ -0,0 +1,194 @@
+import re
+import unicodedata
+
+# --- Gazetteers ---
+# Danh sách từ khóa cho từng trường trong schema của keyword_extraction.
+# Giá trị trả về luôn là đoạn văn bản gốc khớp được (giữ nguyên chữ hoa/thường).
+TYPE_KEYWORDS = {
+    "image": ["ảnh", "hình ảnh", "bức ảnh", "tấm ảnh", "hình", "ảnh chụp", "photo", "picture"],
+    "video": ["video", "clip", "đoạn phim", "thước phim", "phim"],
+    "audio": ["âm thanh", "bản ghi âm", "ghi âm", "bài hát", "audio", "podcast"],
+    "text": ["văn bản", "tài liệu", "ghi chú", "bài viết", "tin nhắn"],
+}
+
+LOCATIONS = [
+    "Lăng Bác", "Hồ Gươm", "Hồ Hoàn Kiếm", "Hồ Tây", "Văn Miếu", "phố cổ Hà Nội", "phố cổ Hội An",
+    "công viên Yên Sở", "công viên Thống Nhất", "Hà Nội", "Thành phố Hồ Chí Minh", "TP. Hồ Chí Minh",
+    "TP.HCM", "Sài Gòn", "Đà Lạt", "Đà Nẵng", "Hội An", "Huế", "Nha Trang", "Vũng Tàu", "Hạ Long",
+    "vịnh Hạ Long", "Sa Pa", "Sapa", "Phú Quốc", "Ninh Bình", "Tràng An", "Mộc Châu", "Hà Giang",
+    "Cần Thơ", "Hải Phòng", "Quy Nhơn", "Côn Đảo", "Việt Nam", "bãi biển", "biển", "núi",
+    "công viên", "trường học", "nhà hàng", "quán cà phê", "sân bay", "bệnh viện", "nhà",
+]
+
+DEVICES = [
+    "điện thoại", "iPhone", "Samsung", "máy ảnh", "máy ảnh phim", "máy quay", "camera", "GoPro",
+    "flycam", "drone", "máy tính bảng", "iPad", "webcam", "camera hành trình", "máy ghi âm",
+]
+
+WEATHER = [
+    "trời nắng", "nắng", "nắng gắt", "trời mưa", "mưa", "mưa phùn", "mưa to", "nhiều mây", "âm u",
+    "sương mù", "tuyết", "gió", "bão", "trời lạnh", "trời nóng", "trời đẹp", "quang đãng",
+]
+
+EVENTS = [
+    "buổi sinh nhật", "sinh nhật", "lễ cưới", "đám cưới", "lễ tốt nghiệp", "tốt nghiệp", "Tết",
+    "Tết Nguyên Đán", "Trung Thu", "Giáng Sinh", "Noel", "năm mới", "hội nghị", "buổi hòa nhạc",
+    "lễ hội", "họp lớp", "du lịch", "dã ngoại", "diễu binh", "bắn pháo hoa",
+]
+
+PEOPLE = [
+    "tôi", "bạn bè", "gia đình", "bố mẹ", "bố", "mẹ", "vợ", "chồng", "con", "em bé", "ông bà",
+    "đồng nghiệp", "người yêu", "anh chị em", "đám đông", "du khách", "học sinh", "sinh viên",
+]
+
+EMOTIONS = [
+    "vui vẻ", "vui", "hạnh phúc", "buồn", "buồn bã", "hào hứng", "phấn khích", "xúc động",
+    "bình yên", "thư giãn", "lãng mạn", "sợ hãi", "tức giận",
+]
+
+OBJECTS = [
+    "hoa anh đào", "hoa sen", "hoa đào", "hoa mai", "hoa", "bánh kem", "bánh sinh nhật", "pháo hoa",
+    "xe máy", "ô tô", "xe đạp", "chó", "mèo", "cây", "núi", "biển", "thuyền", "đèn lồng", "cờ",
+]
+
+ACTIVITY_VERBS = ["chụp", "quay", "đi", "nấu", "ăn", "chơi", "tắm", "leo", "bơi", "hát", "nhảy", "thăm"]
+
+
+def _nfc(text: str) -> str:
+    return unicodedata.normalize("NFC", text)
+
+
+def _compile_gazetteer(phrases) -> re.Pattern:
+    """One alternation regex per gazetteer, longest phrases first, bounded by non-word characters."""
+    ordered = sorted({_nfc(p) for p in phrases}, key=len, reverse=True)
+    return re.compile(r"(?<!\w)(" + "|".join(re.escape(p) for p in ordered) + r")(?!\w)", re.IGNORECASE)
+
+
+_TYPE_PATTERNS = [(kind, _compile_gazetteer(words)) for kind, words in TYPE_KEYWORDS.items()]
+_LOCATION_RE = _compile_gazetteer(LOCATIONS)
+_DEVICE_RE = _compile_gazetteer(DEVICES)
+_WEATHER_RE = _compile_gazetteer(WEATHER)
+_EVENT_RE = _compile_gazetteer(EVENTS)
+_PEOPLE_RE = _compile_gazetteer(PEOPLE)
+_EMOTION_RE = _compile_gazetteer(EMOTIONS)
+_OBJECT_RE = _compile_gazetteer(OBJECTS)
+_ACTIVITY_STOP = r"(?:tại|ở|vào|cùng|với|bằng|lúc|của)(?!\w)"
+_ACTIVITY_RE = re.compile(
+    r"(?<!\w)((?:" + "|".join(ACTIVITY_VERBS) + r")(?:\s+(?!" + _ACTIVITY_STOP + r")\w+){1,3}?)"
+    r"(?=\s+" + _ACTIVITY_STOP + r"|[,.;]|$)",
+    re.IGNORECASE,
+)
+
+# --- Ngày tháng ---
+# "ngày 19 tháng 5 năm 2023", "19/5/2023", "19-05-2023"
+_DAY_MONTH_YEAR_RE = re.compile(
+    r"(?:ngày\s+)?(\d{1,2})(?:\s+tháng\s+|[/-])(\d{1,2})(?:\s*,?\s*năm\s+|[/-])(\d{4})", re.IGNORECASE)
+# "tháng 5 năm 2023", "tháng 5/2023", "tháng 05-2023", "5/2023"
+_MONTH_YEAR_RE = re.compile(r"(?:tháng\s+)?(\d{1,2})(?:\s*,?\s*năm\s+|\s*[/-]\s*)(\d{4})", re.IGNORECASE)
+# "2023-05-19", "2023-05"
+_ISO_RE = re.compile(r"(?<!\d)(\d{4})-(\d{1,2})(?:-(\d{1,2}))?(?!\d)")
+# "năm 2023"
+_YEAR_RE = re.compile(r"năm\s+(\d{4})", re.IGNORECASE)
+
+
+def _valid(month: int = 1, day: int = 1) -> bool:
+    return 1 <= month <= 12 and 1 <= day <= 31
+
+
+def extract_date(text: str):
+    """
+    Trích xuất ngày tháng dạng 'YYYY-MM-DD', 'YYYY-MM' hoặc 'YYYY' từ cụm từ tiếng Việt.
+    Args:
+      text (str): Văn bản đầu vào.
+    Returns:
+      str | None: Ngày đã chuẩn hóa, hoặc None nếu không tìm thấy.
+    """
+    match = _ISO_RE.search(text)
+    if match:
+        year, month, day = match.group(1), int(match.group(2)), int(match.group(3) or 1)
+        if _valid(month, day):
+            return f"{year}-{month:02d}" + (f"-{day:02d}" if match.group(3) else "")
+    match = _DAY_MONTH_YEAR_RE.search(text)
+    if match and _valid(int(match.group(2)), int(match.group(1))):
+        return f"{match.group(3)}-{int(match.group(2)):02d}-{int(match.group(1)):02d}"
+    match = _MONTH_YEAR_RE.search(text)
+    if match and _valid(int(match.group(1))):
+        return f"{match.group(2)}-{int(match.group(1)):02d}"
+    match = _YEAR_RE.search(text)
+    if match:
+        return match.group(1)
+    return None
+
+
+def _find_all(pattern: re.Pattern, text: str) -> list:
+    seen, found = set(), []
+    for match in pattern.finditer(text):
+        value = match.group(1)
+        if value.lower() not in seen:
+            seen.add(value.lower())
+            found.append(value)
+    return found
+
+
+def _first(pattern: re.Pattern, text: str):
+    match = pattern.search(text)
+    return match.group(1) if match else None
+
+
+def extract_keywords_rule_based(text: str) -> dict:
+    """
+    Trích xuất từ khóa bằng luật (gazetteer + regex), không cần gọi API.
+    Kết quả có cùng schema JSON với `keyword_extraction.extract_keywords`, chỉ chứa các trường tìm thấy.
+    Args:
+      text (str): Văn bản đầu vào (nên đã qua normalize_text).
+    Returns:
+      dict: Các thuộc tính trích xuất được.
+    """
+    text = _nfc(text)
+    result = {}
+
+    # type: lấy loại nội dung xuất hiện sớm nhất trong câu
+    best = None
+    for kind, pattern in _TYPE_PATTERNS:
+        match = pattern.search(text)
+        if match and (best is None or match.start() < best[0]):
+            best = (match.start(), kind)
+    if best:
+        result["type"] = best[1]
+
+    activity = _first(_ACTIVITY_RE, text)
+    if activity:
+        result["activity"] = activity
+    location = _first(_LOCATION_RE, text)
+    if location:
+        result["location"] = location
+    event = _first(_EVENT_RE, text)
+    if event:
+        result["event"] = event
+    date = extract_date(text)
+    if date:
+        result["date"] = date
+    people = _find_all(_PEOPLE_RE, text)
+    if people:
+        result["people"] = people
+    emotion = _first(_EMOTION_RE, text)
+    if emotion:
+        result["emotion"] = emotion
+    device = _first(_DEVICE_RE, text)
+    if device:
+        result["device"] = device
+    weather = _first(_WEATHER_RE, text)
+    if weather:
+        result["weather"] = weather
+    objects = [o for o in _find_all(_OBJECT_RE, text) if o.lower() != (location or "").lower()]
+    if objects:
+        result["object"] = objects if len(objects) > 1 else objects[0]
+    return result
+
+
+def is_confident(result: dict, min_fields: int = 2) -> bool:
+    """
+    Kết quả luật có đủ tin cậy để dùng thay cho LLM không: phải có `type` (trường bắt buộc)
+    và ít nhất `min_fields` trường tổng cộng.
+    """
+    return "type" in result and len(result) >= min_fields
@@ -1,6 +1,10 @@
 import re
 import unicodedata
 
+# Biên dịch sẵn một lần, dùng lại cho mọi lời gọi
+_SPACE_BEFORE_PUNCT_RE = re.compile(r"\s+([.,!?;:])")
+_WHITESPACE_RE = re.compile(r"\s+")
+
 def normalize_text(text: str) -> str:
     """
     Chuẩn hóa prompt để xử lý NLP.
@@ -15,13 +19,14 @@ def normalize_text(text: str) -> str:
         raise ValueError("Input must be a string")
 
     # Chuẩn hóa Unicode
-    text = unicodedata.normalize("NFC", text)
+    if not unicodedata.is_normalized("NFC", text):
+        text = unicodedata.normalize("NFC", text)
 
     # Loại bỏ khoảng trắng thừa xung quanh dấu câu
-    text = re.sub(r"\s+([.,!?;:])", r"\1", text)
+    text = _SPACE_BEFORE_PUNCT_RE.sub(r"\1", text)
 
     # Thay nhiều khoảng trắng bằng 1
-    text = re.sub(r"\s+", " ", text)
+    text = _WHITESPACE_RE.sub(" ", text)
 
     # Loại bỏ khoảng trắng đầu và cuối
     text = text.strip()
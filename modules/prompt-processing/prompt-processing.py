@@ -2,8 +2,12 @@
 import os
 import time
 import json
+import asyncio
 import logging
+from concurrent.futures import ThreadPoolExecutor
 from functions import text_normalization, embedding_vector_extraction, keyword_extraction
+from functions.embedding_cache import cache_from_env
+from utils import telemetry  # ./modules được thêm vào sys.path khi import functions
 
 # --- Logging Configuration ---
 # Create the logging directory if it doesn't exist
@@ -21,6 +25,10 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Cache embedding theo văn bản đã chuẩn hóa + model + backend (cấu hình qua EMBEDDING_CACHE_SIZE / EMBEDDING_CACHE_DIR)
+embedding_cache = cache_from_env(embedding_vector_extraction.cache_model_id())
+
+@telemetry.traced("process_prompt")
 def process_prompt(prompt: str) -> dict:
     """
     Processes the input prompt to extract keywords and generate embeddings.
@@ -32,23 +40,29 @@ def process_prompt(prompt: str) -> dict:
         dict: A dictionary containing normalized text, keyword extraction results,
               and embedding vectors.
     """
-    logger.info(f"Bắt đầu xử lý prompt: '{prompt}'")
+    # Nội dung prompt chỉ được ghi log theo tỉ lệ lấy mẫu; thời gian từng bước luôn được đo (utils.telemetry)
+    telemetry.log_payload(logger, "Bắt đầu xử lý prompt: '%s'", prompt)
     
     # Normalize the input text
-    normalized_text = text_normalization.normalize_text(prompt)
-    logger.info(f"Đã chuẩn hóa văn bản: '{normalized_text}'")
+    with telemetry.span("normalize"):
+        normalized_text = text_normalization.normalize_text(prompt)
+    telemetry.log_payload(logger, "Đã chuẩn hóa văn bản: '%s'", normalized_text)
 
     # Extract keywords using the keyword extraction function
     try:
-        keywords = keyword_extraction.extract_keywords(normalized_text)
-        logger.info(f"Đã trích xuất từ khóa thành công: {keywords}")
+        with telemetry.span("keywords"):
+            keywords = keyword_extraction.extract_keywords(normalized_text)
+        telemetry.log_payload(logger, "Đã trích xuất từ khóa thành công: %s", keywords)
     except Exception as e:
         logger.error(f"Lỗi khi trích xuất từ khóa: {e}")
         keywords = None
 
     # Generate embedding vector for the normalized text
     try:
-        embedding_vector = embedding_vector_extraction.get_phobert_sentence_embedding(normalized_text)
+        with telemetry.span("embedding"):
+            embedding_vector = embedding_vector_extraction.get_cached_phobert_sentence_embedding(
+                normalized_text, embedding_cache
+            )
         logger.info("Đã tạo embedding vector thành công.")
     except Exception as e:
         logger.error(f"Lỗi khi tạo embedding vector: {e}")
@@ -60,6 +74,119 @@ def process_prompt(prompt: str) -> dict:
         "embedding_vector": embedding_vector
     }
 
+# --- Concurrent pipeline ---
+# Trích xuất từ khóa (gọi mạng) và tạo embedding (suy luận cục bộ) độc lập với nhau,
+# nên chạy song song. Mỗi bước có thread pool riêng: lời gọi Gemini bị treo vẫn giữ thread
+# của nó sau khi hết timeout, và không được làm nghẽn bước embedding.
+KEYWORD_TIMEOUT = float(os.getenv("KEYWORD_TIMEOUT", "3.0"))
+EMBEDDING_TIMEOUT = float(os.getenv("EMBEDDING_TIMEOUT", "10.0"))
+keyword_executor = ThreadPoolExecutor(
+    max_workers=int(os.getenv("KEYWORD_WORKERS", "16")),
+    thread_name_prefix="prompt-keywords",
+)
+embedding_executor = ThreadPoolExecutor(
+    max_workers=int(os.getenv("EMBEDDING_WORKERS", "8")),
+    thread_name_prefix="prompt-embedding",
+)
+
+
+async def _run_stage(name: str, executor, func, arg, timeout: float):
+    """
+    Runs one blocking stage on its executor with a timeout. The timeout starts when a worker
+    thread picks the stage up, so time spent queued behind other prompts is not counted.
+
+    Returns:
+        tuple: `(result, ok)`; `result` is None when the stage failed or timed out.
+    """
+    loop = asyncio.get_running_loop()
+    started = asyncio.Event()
+
+    def run(value):
+        loop.call_soon_threadsafe(started.set)
+        return telemetry.traced(name)(func)(value)
+
+    future = loop.run_in_executor(executor, run, arg)
+    waiter = asyncio.ensure_future(started.wait())
+    try:
+        # Chờ đến khi bước thực sự bắt đầu (hoặc future kết thúc sớm, ví dụ executor đã shutdown)
+        await asyncio.wait({future, waiter}, return_when=asyncio.FIRST_COMPLETED)
+        result = await asyncio.wait_for(future, timeout)
+        return result, True
+    except asyncio.TimeoutError:
+        # Thread vẫn chạy tiếp ở nền, nhưng kết quả của nó bị bỏ qua
+        logger.warning(f"Bước '{name}' vượt quá {timeout:.2f}s, trả về kết quả một phần.")
+    except Exception as e:
+        logger.error(f"Lỗi ở bước '{name}': {e}")
+    finally:
+        waiter.cancel()
+    return None, False
+
+
+async def process_prompt_async(prompt: str, keyword_timeout: float = None, embedding_timeout: float = None) -> dict:
+    """
+    Concurrent version of `process_prompt`: keyword extraction and embedding run in parallel,
+    so end-to-end latency is max(LLM round trip, inference) instead of their sum.
+
+    Args:
+        prompt (str): The input text prompt to process.
+        keyword_timeout (float): Seconds to wait for keyword extraction (default `KEYWORD_TIMEOUT`).
+        embedding_timeout (float): Seconds to wait for the embedding (default `EMBEDDING_TIMEOUT`).
+
+    Returns:
+        dict: Same keys as `process_prompt`, plus `degraded` (True if any stage failed or timed out,
+              or if keyword extraction returned an error / rule-fallback payload) and `degraded_stages`
+              (names of those stages). Missing results are None.
+    """
+    with telemetry.span("normalize"):
+        normalized_text = text_normalization.normalize_text(prompt)
+
+    (keywords, keywords_ok), (embedding_vector, embedding_ok) = await asyncio.gather(
+        _run_stage("keywords", keyword_executor, keyword_extraction.extract_keywords, normalized_text,
+                   KEYWORD_TIMEOUT if keyword_timeout is None else keyword_timeout),
+        _run_stage("embedding", embedding_executor,
+                   lambda text: embedding_vector_extraction.get_cached_phobert_sentence_embedding(
+                       text, embedding_cache), normalized_text,
+                   EMBEDDING_TIMEOUT if embedding_timeout is None else embedding_timeout),
+    )
+
+    # extract_keywords không raise khi Gemini lỗi mà trả về JSON lỗi / kết quả dự phòng
+    keywords_ok = keywords_ok and not keyword_extraction.is_degraded(keywords)
+    degraded_stages = [name for name, ok in (("keywords", keywords_ok), ("embedding", embedding_ok)) if not ok]
+    return {
+        "normalized_text": normalized_text,
+        "keywords": keywords,
+        "embedding_vector": embedding_vector,
+        "degraded": bool(degraded_stages),
+        "degraded_stages": degraded_stages,
+    }
+
+
+async def process_prompts_async(prompts, max_concurrency: int = 8, **kwargs) -> list:
+    """
+    Processes many prompts with at most `max_concurrency` in flight at once.
+
+    Args:
+        prompts (Iterable[str]): Input prompts.
+        max_concurrency (int): Maximum number of prompts processed concurrently.
+        **kwargs: Per-stage timeouts forwarded to `process_prompt_async`.
+
+    Returns:
+        list[dict]: Results in the same order as `prompts`.
+    """
+    semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def bounded(prompt):
+        async with semaphore:
+            return await process_prompt_async(prompt, **kwargs)
+
+    return await asyncio.gather(*(bounded(p) for p in prompts))
+
+
+def process_prompts(prompts, max_concurrency: int = 8, **kwargs) -> list:
+    """Synchronous entry point for `process_prompts_async`."""
+    return asyncio.run(process_prompts_async(list(prompts), max_concurrency=max_concurrency, **kwargs))
+
+
 if __name__ == "__main__":
     sample_prompt = "Ảnh chụp Lăng Bác vào tháng 5 năm 2023, có trời nắng và đám đông"
     
@@ -79,4 +206,6 @@ if __name__ == "__main__":
         embedding_info = f"Vector Embedding (5 chiều đầu tiên): {result['embedding_vector'][0, :5]}"
     logger.info(embedding_info)
     
-    logger.info(f"Thời gian chạy: {elapsed_time:.4f} giây")
\ No newline at end of file
+    logger.info(f"Thời gian chạy: {elapsed_time:.4f} giây")
+    logger.info(f"Thống kê cache embedding: {embedding_cache.stats()}")
+    logger.info(f"Thời gian từng bước: {json.dumps(telemetry.stage_summary(), ensure_ascii=False)}")
\ No newline at end of file
@@ -0,0 +1,255 @@
+"""
+Optimized CPU inference backends: thread control, int8 quantization and TorchScript / ONNX export.
+
+The encoder backends below are used for PhoBERT (YOLO uses the ultralytics exporter, see
+footage-processing/functions/object_detection.py).
+
+An encoder backend replaces an eager Hugging Face encoder with an object that has the same call
+signature (`model(input_ids)` / `model(input_ids=..., attention_mask=...)` returning a tuple
+whose first element is the last hidden state, plus `.config`), so call sites stay unchanged:
+- `eager`: the model as loaded.
+- `int8`: eager PyTorch with dynamic int8 quantization of every nn.Linear.
+- `torchscript` / `torchscript-int8`: a traced and frozen TorchScript module.
+- `onnx` / `onnx-int8`: ONNX Runtime on CPU (`pip install onnx onnxruntime`); int8 uses ONNX
+  Runtime dynamic quantization.
+
+Exported files are cached in `INFERENCE_EXPORT_DIR`, and every backend is checked against the
+eager model (`verify_encoder`) before it is used.
+
+This module imports torch at import time; load it lazily, only when a backend is requested.
+"""
+import logging
+import os
+import re
+from pathlib import Path
+
+import numpy as np
+import torch
+
+logger = logging.getLogger(__name__)
+
+# --- Configuration (environment variables) ---
+# Số thread tính toán cho torch / ONNX Runtime, 0 = để mặc định (thường là số core)
+INFERENCE_THREADS = int(os.getenv("INFERENCE_THREADS", "0"))
+INFERENCE_EXPORT_DIR = os.getenv("INFERENCE_EXPORT_DIR",
+                                 os.path.join(os.path.expanduser("~"), ".cache", "retriever-inference"))
+# INFERENCE_REEXPORT=1 bỏ qua file đã export trong cache (ví dụ sau khi cập nhật trọng số)
+INFERENCE_REEXPORT = os.getenv("INFERENCE_REEXPORT", "0").lower() in ("1", "true", "yes")
+
+ENCODER_BACKENDS = ("eager", "int8", "torchscript", "torchscript-int8", "onnx", "onnx-int8")
+
+
+class BackendError(RuntimeError):
+    """Raised when a backend cannot be built or does not match the eager model."""
+
+
+def configure_threads(num_threads: int = None) -> int:
+    """
+    Pins the number of intra-op threads used by torch (and by sessions created here).
+
+    Args:
+        num_threads (int): Thread count; defaults to `INFERENCE_THREADS`. 0 keeps torch's default.
+
+    Returns:
+        int: The thread count torch now uses.
+    """
+    num_threads = INFERENCE_THREADS if num_threads is None else num_threads
+    if num_threads > 0:
+        torch.set_num_threads(num_threads)
+    return torch.get_num_threads()
+
+
+def export_path(model_id: str, backend: str, suffix: str) -> Path:
+    """Cache file for an exported model, e.g. `<INFERENCE_EXPORT_DIR>/vinai_phobert-base.onnx-int8.onnx`."""
+    safe_id = re.sub(r"[^A-Za-z0-9._-]+", "_", str(model_id)).strip("_")
+    directory = Path(INFERENCE_EXPORT_DIR)
+    directory.mkdir(parents=True, exist_ok=True)
+    return directory / f"{safe_id}.{backend}{suffix}"
+
+
+def quantize_dynamic_int8(model):
+    """Returns a copy of `model` with every nn.Linear replaced by a dynamically quantized int8 Linear."""
+    from torch.ao.quantization import quantize_dynamic
+
+    return quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+
+
+def quantize_onnx_int8(source, target) -> Path:
+    """Dynamic int8 quantization of an ONNX file with ONNX Runtime (weights int8, activations at run time)."""
+    try:
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+    except ImportError as e:
+        raise BackendError("int8 ONNX quantization requires `pip install onnx onnxruntime`") from e
+
+    quantize_dynamic(str(source), str(target), weight_type=QuantType.QInt8)
+    logger.info(f"Đã lượng tử hóa int8 ONNX vào '{target}'.")
+    return Path(target)
+
+
+# =========================================================================================
+# Encoder wrappers
+# =========================================================================================
+class _EncoderForExport(torch.nn.Module):
+    """(input_ids, attention_mask) -> last_hidden_state, a plain-tensor signature for tracing / export."""
+
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+    def forward(self, input_ids, attention_mask):
+        return self.model(input_ids=input_ids, attention_mask=attention_mask, return_dict=False)[0]
+
+
+class CompiledEncoder:
+    """
+    Drop-in replacement for an HF encoder backed by a TorchScript module or an ONNX Runtime session.
+
+    Accepts the call forms used by the embedding code and returns `(last_hidden_state,)`.
+    """
+
+    def __init__(self, forward, config, backend: str, path: Path = None):
+        self._forward = forward
+        self.config = config
+        self.backend = backend
+        self.path = path
+
+    def __call__(self, input_ids=None, attention_mask=None, **kwargs):
+        if attention_mask is None:
+            attention_mask = torch.ones_like(input_ids)
+        return (self._forward(input_ids, attention_mask),)
+
+    def eval(self):
+        return self
+
+    def __repr__(self):
+        return f"CompiledEncoder(backend={self.backend!r}, path={str(self.path)!r})"
+
+
+def _torchscript_encoder(model, sample, path: Path, int8: bool) -> CompiledEncoder:
+    if INFERENCE_REEXPORT or not path.exists():
+        source = quantize_dynamic_int8(model) if int8 else model
+        with torch.no_grad():
+            traced = torch.jit.trace(_EncoderForExport(source).eval(), sample, strict=False, check_trace=False)
+        torch.jit.save(torch.jit.freeze(traced), str(path))
+        logger.info(f"Đã export TorchScript vào '{path}'.")
+    module = torch.jit.load(str(path)).eval()
+
+    def forward(input_ids, attention_mask):
+        with torch.no_grad():
+            return module(input_ids, attention_mask)
+
+    return CompiledEncoder(forward, model.config, "torchscript-int8" if int8 else "torchscript", path)
+
+
+def _onnx_encoder(model, sample, path: Path, int8: bool, num_threads: int) -> CompiledEncoder:
+    try:
+        import onnxruntime as ort
+    except ImportError as e:
+        raise BackendError("ONNX backend requires `pip install onnx onnxruntime`") from e
+
+    fp32_path = path.with_name(path.name.replace(".onnx-int8", ".onnx")) if int8 else path
+    if INFERENCE_REEXPORT or not fp32_path.exists():
+        axes = {0: "batch", 1: "sequence"}
+        with torch.no_grad():
+            torch.onnx.export(
+                _EncoderForExport(model).eval(), sample, str(fp32_path),
+                input_names=["input_ids", "attention_mask"], output_names=["last_hidden_state"],
+                dynamic_axes={"input_ids": axes, "attention_mask": axes, "last_hidden_state": axes},
+                opset_version=17,
+            )
+        logger.info(f"Đã export ONNX vào '{fp32_path}'.")
+    if int8 and (INFERENCE_REEXPORT or not path.exists()):
+        quantize_onnx_int8(fp32_path, path)
+
+    options = ort.SessionOptions()
+    options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+    if num_threads > 0:
+        options.intra_op_num_threads = num_threads
+        options.inter_op_num_threads = 1
+    session = ort.InferenceSession(str(path), options, providers=["CPUExecutionProvider"])
+
+    def forward(input_ids, attention_mask):
+        hidden = session.run(None, {
+            "input_ids": np.asarray(input_ids, dtype=np.int64),
+            "attention_mask": np.asarray(attention_mask, dtype=np.int64),
+        })[0]
+        return torch.from_numpy(hidden)
+
+    return CompiledEncoder(forward, model.config, "onnx-int8" if int8 else "onnx", path)
+
+
+# =========================================================================================
+# Building + verification
+# =========================================================================================
+def encoder_sample_batches(tokenizer, texts, pad_id: int = None) -> list:
+    """Tokenizes `texts` into padded `(input_ids, attention_mask)` batches: all together, then one by one."""
+    pad_id = tokenizer.pad_token_id if pad_id is None else pad_id
+    encoded = tokenizer(list(texts), truncation=True, max_length=256)["input_ids"]
+
+    def pad(rows):
+        longest = max(len(ids) for ids in rows)
+        input_ids = torch.full((len(rows), longest), pad_id, dtype=torch.long)
+        attention_mask = torch.zeros((len(rows), longest), dtype=torch.long)
+        for i, ids in enumerate(rows):
+            input_ids[i, :len(ids)] = torch.tensor(ids, dtype=torch.long)
+            attention_mask[i, :len(ids)] = 1
+        return input_ids, attention_mask
+
+    return [pad(encoded)] + [pad([ids]) for ids in encoded]
+
+
+def verify_encoder(reference, candidate, batches, min_cosine: float = 0.99) -> dict:
+    """
+    Compares the [CLS] vectors of `candidate` against `reference` on the given batches.
+
+    Returns:
+        dict: {"min_cosine", "max_abs_diff", "ok"}; `ok` is True when every vector has cosine
+              similarity >= `min_cosine` with its eager counterpart.
+    """
+    min_cos, max_diff = 1.0, 0.0
+    with torch.no_grad():
+        for input_ids, attention_mask in batches:
+            expected = reference(input_ids=input_ids, attention_mask=attention_mask)[0][:, 0, :].float()
+            actual = candidate(input_ids=input_ids, attention_mask=attention_mask)[0][:, 0, :].float()
+            cos = torch.nn.functional.cosine_similarity(expected, actual, dim=1)
+            min_cos = min(min_cos, float(cos.min()))
+            max_diff = max(max_diff, float((expected - actual).abs().max()))
+    return {"min_cosine": min_cos, "max_abs_diff": max_diff, "ok": min_cos >= min_cosine}
+
+
+def build_encoder_backend(model, backend: str, model_id: str, sample_batches, num_threads: int = None):
+    """
+    Wraps an eager HF encoder in the requested backend.
+
+    Args:
+        model: The eager model (in eval mode).
+        backend (str): One of `ENCODER_BACKENDS`.
+        model_id (str): Hub id or path, used to name the cached export.
+        sample_batches (list): `(input_ids, attention_mask)` pairs, see `encoder_sample_batches`;
+                               the first one is used as the tracing / export example.
+        num_threads (int): Intra-op threads, default `INFERENCE_THREADS`.
+
+    Returns:
+        The model to use in place of `model` (the same object for 'eager').
+
+    Raises:
+        BackendError: If the backend is unknown or cannot be built.
+    """
+    if backend not in ENCODER_BACKENDS:
+        raise BackendError(f"Unknown backend '{backend}', expected one of {ENCODER_BACKENDS}")
+    num_threads = configure_threads(num_threads)
+    if backend == "eager":
+        return model
+
+    kind, _, int8 = backend.partition("-")
+    try:
+        if backend == "int8":
+            return quantize_dynamic_int8(model)
+        sample = tuple(sample_batches[0])
+        if kind == "torchscript":
+            return _torchscript_encoder(model, sample, export_path(model_id, backend, ".pt"), bool(int8))
+        return _onnx_encoder(model, sample, export_path(model_id, backend, ".onnx"), bool(int8), num_threads)
+    except BackendError:
+        raise
+    except Exception as e:
+        raise BackendError(f"Could not build backend '{backend}': {e}") from e
@@ -0,0 +1,383 @@
+"""
+Lightweight in-process tracing and metrics shared by the pipeline modules.
+
+- `span(stage)` times one pipeline stage (normalize, segment, tokenize, forward, llm, decode,
+  infer, annotate, ...) into a latency histogram and counts its errors and items.
+- Metrics live in a process-wide registry and can be exported in the Prometheus text format
+  (`render_prometheus`) or as JSON with per-stage p50/p90/p99 (`snapshot`).
+- `log_payload` logs prompts / model outputs only for a sampled fraction of calls
+  (`TELEMETRY_PAYLOAD_SAMPLE_RATE`, default 0), independently of the metrics.
+
+Usage (from a module directory, with ./modules on sys.path):
+    from utils import telemetry
+
+    with telemetry.span("forward", items=len(batch)):
+        outputs = model(input_ids)
+    telemetry.log_payload(logger, "Prompt: '%s'", prompt)
+    print(telemetry.render_prometheus())
+"""
+import bisect
+import json
+import logging
+import math
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+# --- Configuration (environment variables) ---
+# TELEMETRY_ENABLED=0 tắt hoàn toàn việc đo (span chỉ còn là một context manager rỗng)
+TELEMETRY_ENABLED = os.getenv("TELEMETRY_ENABLED", "1").lower() not in ("0", "false", "no")
+# Tỉ lệ lời gọi được ghi log nội dung (prompt, văn bản tách từ, phản hồi LLM): 1 = tất cả, 0 = không (mặc định)
+PAYLOAD_SAMPLE_RATE = float(os.getenv("TELEMETRY_PAYLOAD_SAMPLE_RATE", "0"))
+METRIC_PREFIX = os.getenv("TELEMETRY_METRIC_PREFIX", "retriever")
+
+# Latency buckets in seconds: 100µs .. 60s, roughly x2.5 apart, enough for p50/p99 interpolation
+DEFAULT_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+QUANTILES = (0.5, 0.9, 0.99)
+
+
+# =========================================================================================
+# Metric types
+# =========================================================================================
+def _label_key(labelnames: tuple, labels: dict) -> tuple:
+    if set(labels) != set(labelnames):
+        raise ValueError(f"Expected labels {list(labelnames)}, got {sorted(labels)}")
+    return tuple(str(labels[name]) for name in labelnames)
+
+
+def _format_labels(labelnames: tuple, key: tuple, extra: str = "") -> str:
+    parts = [f'{name}="{_escape_label(value)}"' for name, value in zip(labelnames, key)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _escape_label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class Counter:
+    """Monotonic counter, optionally split by label values."""
+
+    type_name = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = _label_key(self.labelnames, labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(_label_key(self.labelnames, labels), 0.0)
+
+    def reset(self):
+        with self._lock:
+            self._values.clear()
+
+    def samples(self) -> list:
+        """Returns sorted `(label_key, value)` pairs."""
+        with self._lock:
+            return sorted(self._values.items())
+
+    def to_prometheus(self) -> list:
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+                for key, value in self.samples()]
+
+    def to_dict(self) -> dict:
+        return {",".join(key) or "": value for key, value in self.samples()}
+
+
+class _HistogramSeries:
+    __slots__ = ("counts", "count", "sum", "max")
+
+    def __init__(self, n_buckets: int):
+        self.counts = [0] * (n_buckets + 1)  # phần tử cuối là bucket +Inf
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+
+class Histogram:
+    """
+    Fixed-bucket histogram (Prometheus semantics), optionally split by label values.
+
+    Memory is constant per label set; quantiles are estimated by linear interpolation inside
+    the bucket that contains them, like PromQL's `histogram_quantile`.
+    """
+
+    type_name = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames=(), buckets=DEFAULT_BUCKETS):
+        if list(buckets) != sorted(buckets) or not buckets:
+            raise ValueError("buckets must be a non-empty increasing sequence")
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(float(b) for b in buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = _label_key(self.labelnames, labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = _HistogramSeries(len(self.buckets))
+            series.counts[index] += 1
+            series.count += 1
+            series.sum += value
+            if value > series.max:
+                series.max = value
+
+    def reset(self):
+        with self._lock:
+            self._series.clear()
+
+    def _copy(self) -> list:
+        with self._lock:
+            return [(key, list(s.counts), s.count, s.sum, s.max) for key, s in sorted(self._series.items())]
+
+    def quantile(self, q: float, **labels):
+        """Estimated q-quantile (0 < q < 1) for one label set, or None if nothing was observed."""
+        key = _label_key(self.labelnames, labels)
+        for series_key, counts, count, _, max_value in self._copy():
+            if series_key == key:
+                return self._quantile(q, counts, count, max_value)
+        return None
+
+    def _quantile(self, q: float, counts: list, count: int, max_value: float):
+        if count == 0:
+            return None
+        rank = q * count
+        cumulative = 0
+        for i, n in enumerate(counts):
+            if n and cumulative + n >= rank:
+                lower = self.buckets[i - 1] if i > 0 else 0.0
+                # Bucket +Inf (hoặc bucket chứa giá trị lớn nhất): không vượt quá max đã quan sát
+                upper = min(self.buckets[i], max_value) if i < len(self.buckets) else max_value
+                upper = max(upper, lower)
+                return lower + (upper - lower) * (rank - cumulative) / n
+            cumulative += n
+        return max_value
+
+    def to_prometheus(self) -> list:
+        lines = []
+        for key, counts, count, total, _ in self._copy():
+            cumulative = 0
+            for bound, n in zip(self.buckets + (math.inf,), counts):
+                cumulative += n
+                le = 'le="' + _format_value(bound) + '"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {count}")
+        return lines
+
+    def to_dict(self) -> dict:
+        """{label values joined by ',': {"count", "sum", "mean", "max", "p50", "p90", "p99"}}, in seconds."""
+        out = {}
+        for key, counts, count, total, max_value in self._copy():
+            row = {"count": count, "sum": total, "mean": total / count if count else None, "max": max_value}
+            for q in QUANTILES:
+                row[f"p{int(q * 100)}"] = self._quantile(q, counts, count, max_value)
+            out[",".join(key) or ""] = row
+        return out
+
+
+# =========================================================================================
+# Registry
+# =========================================================================================
+class MetricsRegistry:
+    """Process-wide collection of metrics; `counter`/`histogram` return the existing metric by name."""
+
+    def __init__(self, prefix: str = METRIC_PREFIX):
+        self.prefix = prefix
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _get_or_create(self, cls, name, documentation, labelnames, **kwargs):
+        full_name = f"{self.prefix}_{name}" if self.prefix else name
+        with self._lock:
+            metric = self._metrics.get(full_name)
+            if metric is None:
+                metric = self._metrics[full_name] = cls(full_name, documentation, labelnames, **kwargs)
+            elif not isinstance(metric, cls) or metric.labelnames != tuple(labelnames):
+                raise ValueError(f"Metric '{full_name}' already registered with a different type or labels")
+            return metric
+
+    def counter(self, name: str, documentation: str, labelnames=()) -> Counter:
+        return self._get_or_create(Counter, name, documentation, labelnames)
+
+    def histogram(self, name: str, documentation: str, labelnames=(), buckets=DEFAULT_BUCKETS) -> Histogram:
+        return self._get_or_create(Histogram, name, documentation, labelnames, buckets=buckets)
+
+    def reset(self):
+        """Clears all recorded values (the metrics stay registered)."""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        for metric in metrics:
+            metric.reset()
+
+    def render_prometheus(self) -> str:
+        """All metrics in the Prometheus text exposition format (version 0.0.4)."""
+        with self._lock:
+            metrics = sorted(self._metrics.items())
+        lines = []
+        for name, metric in metrics:
+            lines.append(f"# HELP {name} {metric.documentation}")
+            lines.append(f"# TYPE {name} {metric.type_name}")
+            lines.extend(metric.to_prometheus())
+        return "\n".join(lines) + "\n"
+
+    def snapshot(self) -> dict:
+        """All metrics as a JSON-serializable dict, histograms summarized with p50/p90/p99."""
+        with self._lock:
+            metrics = sorted(self._metrics.items())
+        return {name: {"type": metric.type_name, "values": metric.to_dict()} for name, metric in metrics}
+
+
+registry = MetricsRegistry()
+
+stage_duration = registry.histogram(
+    "stage_duration_seconds", "Wall-clock duration of one pipeline stage call.", ("stage",))
+stage_errors = registry.counter("stage_errors_total", "Pipeline stage calls that raised an exception.", ("stage",))
+stage_items = registry.counter("stage_items_total", "Items (texts, frames, ...) processed by a stage.", ("stage",))
+
+
+# =========================================================================================
+# Spans
+# =========================================================================================
+@contextmanager
+def span(stage: str, items: int = None):
+    """
+    Times the enclosed block as one call of `stage`.
+
+    Args:
+        stage (str): Stage name, used as the `stage` label.
+        items (int): Number of items handled by this call (e.g. batch size), added to
+                     `stage_items_total`. Defaults to none.
+
+    Exceptions propagate unchanged; they are counted in `stage_errors_total` and the duration
+    is still recorded.
+    """
+    if not TELEMETRY_ENABLED:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    except BaseException:
+        stage_errors.inc(stage=stage)
+        raise
+    finally:
+        stage_duration.observe(time.perf_counter() - start, stage=stage)
+        if items:
+            stage_items.inc(items, stage=stage)
+
+
+def observe(stage: str, seconds: float, items: int = None):
+    """Records a duration measured elsewhere (e.g. accumulated inside a worker loop) for `stage`."""
+    if not TELEMETRY_ENABLED:
+        return
+    stage_duration.observe(seconds, stage=stage)
+    if items:
+        stage_items.inc(items, stage=stage)
+
+
+def traced(stage: str):
+    """Decorator form of `span`: every call of the function is one call of `stage`."""
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(stage):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+# =========================================================================================
+# Sampled payload logging
+# =========================================================================================
+def should_log_payload(logger: logging.Logger = None, level: int = logging.INFO) -> bool:
+    """True for a `PAYLOAD_SAMPLE_RATE` fraction of calls (and only if `logger` would emit `level`)."""
+    if PAYLOAD_SAMPLE_RATE <= 0:
+        return False
+    if logger is not None and not logger.isEnabledFor(level):
+        return False
+    return PAYLOAD_SAMPLE_RATE >= 1 or random.random() < PAYLOAD_SAMPLE_RATE
+
+
+def log_payload(logger: logging.Logger, msg: str, *args, level: int = logging.INFO):
+    """
+    Logs a message that carries user content (prompts, segmented text, LLM responses), sampled.
+
+    Use %-style arguments so the message is only formatted when the call is sampled.
+    """
+    if should_log_payload(logger, level):
+        logger.log(level, msg, *args)
+
+
+def set_payload_sample_rate(rate: float):
+    """Changes the payload logging rate at runtime (0 disables payload logging)."""
+    global PAYLOAD_SAMPLE_RATE
+    if not 0 <= rate <= 1:
+        raise ValueError("rate must be between 0 and 1")
+    PAYLOAD_SAMPLE_RATE = rate
+
+
+# =========================================================================================
+# Export
+# =========================================================================================
+def render_prometheus() -> str:
+    """Metrics of this process in the Prometheus text format."""
+    return registry.render_prometheus()
+
+
+def snapshot() -> dict:
+    """Metrics of this process as a JSON-serializable dict."""
+    return registry.snapshot()
+
+
+def stage_summary() -> dict:
+    """Per-stage latency in milliseconds: {stage: {"count", "errors", "items", "p50_ms", "p90_ms", "p99_ms", "max_ms"}}."""
+    summary = {}
+    for stage, row in stage_duration.to_dict().items():
+        summary[stage] = {
+            "count": row["count"],
+            "errors": stage_errors.value(stage=stage),
+            "items": stage_items.value(stage=stage),
+            **{f"{key}_ms": 1000 * row[key] for key in ("p50", "p90", "p99", "max") if row[key] is not None},
+        }
+    return summary
+
+
+def write_metrics(path, fmt: str = None):
+    """
+    Writes the current metrics to a file: Prometheus text (`.prom`, e.g. for node_exporter's
+    textfile collector) or JSON (`.json`), chosen from `fmt` or the file extension.
+    """
+    path = str(path)
+    fmt = fmt or ("json" if path.endswith(".json") else "prometheus")
+    if fmt not in ("json", "prometheus"):
+        raise ValueError("fmt must be 'json' or 'prometheus'")
+    content = json.dumps(snapshot(), ensure_ascii=False, indent=2) if fmt == "json" else render_prometheus()
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(content)
+    os.replace(tmp_path, path)